@@ -0,0 +1,343 @@
+"""
+Postgres-backed job queue for slow AI work (strategy reports).
+
+POST /api/ai-strategy used to download every document, parse it and wait
+on Gemini inside the HTTP request. Now the request only enqueues a row in
+`ai_jobs` and returns its id; workers claim jobs with FOR UPDATE SKIP
+LOCKED, so any number of them (threads in the API process or separate
+`python ai_worker.py` processes) can share the queue without
+double-processing.
+
+  - Dedup: at most one queued/running job per (kind, student). Submitting
+    again while one is in flight returns the existing job.
+  - Retries: a failed attempt is re-queued with exponential backoff until
+    max_attempts; PermanentJobError fails the job immediately.
+  - Leases: a running job whose worker died is re-queued once its lease
+    (AI_JOB_LEASE_SECONDS) expires. A live worker renews it every
+    AI_JOB_HEARTBEAT_SECONDS, and completes or fails a job only while it
+    still holds the lease, so a reaped job's late result is dropped.
+
+Plain psycopg2 and no FastAPI, so the API and the standalone worker run
+the same code.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import traceback
+from typing import Callable, Optional
+
+from psycopg2.extras import RealDictCursor
+
+AI_JOB_MAX_ATTEMPTS = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "3"))
+AI_JOB_BACKOFF_SECONDS = float(os.getenv("AI_JOB_BACKOFF_SECONDS", "15"))
+AI_JOB_BACKOFF_MAX_SECONDS = float(os.getenv("AI_JOB_BACKOFF_MAX_SECONDS", "600"))
+AI_JOB_LEASE_SECONDS = float(os.getenv("AI_JOB_LEASE_SECONDS", "900"))
+AI_JOB_POLL_SECONDS = float(os.getenv("AI_JOB_POLL_SECONDS", "2"))
+AI_JOB_HEARTBEAT_SECONDS = float(os.getenv("AI_JOB_HEARTBEAT_SECONDS", str(AI_JOB_LEASE_SECONDS / 3)))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+AI_JOBS_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS ai_jobs (
+        id BIGSERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        student_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued'
+            CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        run_after TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        locked_by TEXT,
+        locked_at TIMESTAMPTZ,
+        requested_by TEXT,
+        payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+        result JSONB,
+        last_error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        started_at TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ
+    );
+
+    -- Per-student dedup: only one in-flight job of each kind.
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_ai_jobs_active
+        ON ai_jobs (kind, student_id) WHERE status IN ('queued', 'running');
+
+    -- Claim order for workers.
+    CREATE INDEX IF NOT EXISTS idx_ai_jobs_queued
+        ON ai_jobs (run_after, id) WHERE status = 'queued';
+
+    CREATE INDEX IF NOT EXISTS idx_ai_jobs_student
+        ON ai_jobs (student_id, created_at DESC);
+"""
+
+_JOB_COLUMNS = """
+    id, kind, student_id, status, attempts, max_attempts, run_after,
+    locked_by, locked_at, requested_by, payload, result, last_error,
+    created_at, started_at, finished_at
+"""
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying can't help (student gone, bad config)."""
+
+
+def enqueue_job(conn, kind: str, student_id: int, requested_by: str = None,
+                payload: dict = None, max_attempts: int = AI_JOB_MAX_ATTEMPTS) -> tuple:
+    """
+    Queues a job and commits. Returns (job, created); when a job of this
+    kind is already queued/running for the student, that job is returned
+    with created=False instead of starting a second run.
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        for _ in range(3):
+            cur.execute(f"""
+                INSERT INTO ai_jobs (kind, student_id, requested_by, payload, max_attempts)
+                VALUES (%s, %s, %s, %s::jsonb, %s)
+                ON CONFLICT (kind, student_id) WHERE status IN ('queued', 'running') DO NOTHING
+                RETURNING {_JOB_COLUMNS}
+            """, (kind, student_id, requested_by, json.dumps(payload or {}), max_attempts))
+            job = cur.fetchone()
+            if job:
+                conn.commit()
+                return job, True
+
+            cur.execute(f"""
+                SELECT {_JOB_COLUMNS} FROM ai_jobs
+                WHERE kind = %s AND student_id = %s AND status IN ('queued', 'running')
+            """, (kind, student_id))
+            job = cur.fetchone()
+            if job:
+                conn.commit()
+                return job, False
+            # The active job finished between the two statements; try again.
+    conn.rollback()
+    raise RuntimeError(f"Could not enqueue {kind} job for student {student_id}")
+
+
+def get_job(conn, job_id) -> Optional[dict]:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"SELECT {_JOB_COLUMNS} FROM ai_jobs WHERE id = %s", (job_id,))
+        return cur.fetchone()
+
+
+def latest_job(conn, kind: str, student_id: int) -> Optional[dict]:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT {_JOB_COLUMNS} FROM ai_jobs
+            WHERE kind = %s AND student_id = %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        """, (kind, student_id))
+        return cur.fetchone()
+
+
+def claim_job(conn, worker_id: str, kinds: list) -> Optional[dict]:
+    """Atomically takes the next due job (SKIP LOCKED) and commits the claim."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            UPDATE ai_jobs
+            SET status = 'running', attempts = attempts + 1,
+                locked_by = %s, locked_at = NOW(),
+                started_at = COALESCE(started_at, NOW())
+            WHERE id = (
+                SELECT id FROM ai_jobs
+                WHERE status = 'queued' AND run_after <= NOW() AND kind = ANY(%s)
+                ORDER BY run_after, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {_JOB_COLUMNS}
+        """, (worker_id, list(kinds)))
+        job = cur.fetchone()
+    conn.commit()
+    return job
+
+
+def heartbeat_job(conn, job_id, worker_id: str) -> bool:
+    """Renews the lease on a job this worker holds; False once it has lost it."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE ai_jobs
+            SET locked_at = NOW()
+            WHERE id = %s AND locked_by = %s AND status = 'running'
+        """, (job_id, worker_id))
+        held = cur.rowcount == 1
+    conn.commit()
+    return held
+
+
+def complete_job(conn, job_id, worker_id: str, result: dict = None) -> bool:
+    """Records the result if this worker still holds the job; False (and no write) otherwise."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE ai_jobs
+            SET status = 'succeeded', result = %s::jsonb, last_error = NULL,
+                locked_by = NULL, locked_at = NULL, finished_at = NOW()
+            WHERE id = %s AND locked_by = %s
+        """, (json.dumps(result or {}, default=str), job_id, worker_id))
+        held = cur.rowcount == 1
+    conn.commit()
+    return held
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with +/-20% jitter so retries don't stampede."""
+    delay = min(AI_JOB_BACKOFF_MAX_SECONDS, AI_JOB_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def fail_job(conn, job: dict, error: str, retry: bool = True) -> bool:
+    """
+    Re-queues the job with backoff, or marks it failed when out of attempts.
+    Only while job["locked_by"] still holds it; returns False otherwise.
+    """
+    retry = retry and job["attempts"] < job["max_attempts"]
+    with conn.cursor() as cur:
+        if retry:
+            cur.execute("""
+                UPDATE ai_jobs
+                SET status = 'queued', last_error = %s,
+                    run_after = NOW() + make_interval(secs => %s),
+                    locked_by = NULL, locked_at = NULL
+                WHERE id = %s AND locked_by = %s
+            """, (error[:2000], backoff_seconds(job["attempts"]), job["id"], job["locked_by"]))
+        else:
+            cur.execute("""
+                UPDATE ai_jobs
+                SET status = 'failed', last_error = %s,
+                    locked_by = NULL, locked_at = NULL, finished_at = NOW()
+                WHERE id = %s AND locked_by = %s
+            """, (error[:2000], job["id"], job["locked_by"]))
+        held = cur.rowcount == 1
+    conn.commit()
+    return held
+
+
+def reap_expired_leases(conn, lease_seconds: float = AI_JOB_LEASE_SECONDS) -> int:
+    """
+    Jobs stuck in 'running' past their lease belong to a worker that died.
+    Re-queue them (or fail them if that was the last attempt). Returns the
+    number of jobs touched.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE ai_jobs
+            SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE NOW() END,
+                last_error = 'Worker lease expired',
+                locked_by = NULL, locked_at = NULL, run_after = NOW()
+            WHERE status = 'running' AND locked_at < NOW() - make_interval(secs => %s)
+        """, (lease_seconds,))
+        touched = cur.rowcount
+    conn.commit()
+    return touched
+
+
+def queue_stats(conn) -> dict:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT kind, status, COUNT(*) AS jobs,
+                   MIN(created_at) FILTER (WHERE status = 'queued') AS oldest_queued_at
+            FROM ai_jobs
+            GROUP BY kind, status
+            ORDER BY kind, status
+        """)
+        return {"by_status": cur.fetchall()}
+
+
+def serialize_job(job: dict) -> dict:
+    """JSON-friendly view for the API (timestamps as ISO strings)."""
+    out = {}
+    for key, value in job.items():
+        out[key] = value.isoformat() if hasattr(value, "isoformat") else value
+    out["done"] = job["status"] in ("succeeded", "failed")
+    return out
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def _renew_lease(connect: Callable, job_id, worker_id: str, done: threading.Event,
+                 interval: float = AI_JOB_HEARTBEAT_SECONDS):
+    """Heartbeat thread: renews the job's lease every `interval` until `done` is set or the lease is lost."""
+    while not done.wait(interval):
+        conn = None
+        try:
+            conn = connect()
+            if not heartbeat_job(conn, job_id, worker_id):
+                print(f"[ai-jobs] {worker_id} lost the lease on job {job_id}")
+                return
+        except Exception as e:
+            print(f"[ai-jobs] heartbeat for job {job_id} failed: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def run_worker(connect: Callable, handlers: dict, stop: threading.Event,
+               worker_id: str = None, poll_seconds: float = AI_JOB_POLL_SECONDS):
+    """
+    Claim/run loop until `stop` is set. `connect()` returns a pooled
+    psycopg2 connection; `handlers` maps kind -> fn(connect, job) returning a
+    JSON-serialisable result. The claim's connection goes back to the pool
+    before the handler runs, so a handler checks one out only while it
+    actually talks to the database. While it runs, a heartbeat thread keeps
+    the lease alive. Each loop also reaps expired leases, which is one cheap
+    indexed UPDATE.
+    """
+    worker_id = worker_id or default_worker_id()
+    kinds = list(handlers)
+    while not stop.is_set():
+        conn = None
+        job = None
+        try:
+            conn = connect()
+            reap_expired_leases(conn)
+            job = claim_job(conn, worker_id, kinds)
+            conn.close()
+            conn = None
+            if job:
+                print(f"[ai-jobs] {worker_id} running job {job['id']} ({job['kind']}, "
+                      f"student {job['student_id']}, attempt {job['attempts']}/{job['max_attempts']})")
+                done = threading.Event()
+                heartbeat = threading.Thread(
+                    target=_renew_lease, args=(connect, job["id"], worker_id, done),
+                    name=f"ai-lease-{job['id']}", daemon=True,
+                )
+                heartbeat.start()
+                try:
+                    result = handlers[job["kind"]](connect, job)
+                    done.set()
+                    conn = connect()
+                    recorded = complete_job(conn, job["id"], worker_id, result)
+                except PermanentJobError as e:
+                    done.set()
+                    conn = conn or connect()
+                    conn.rollback()
+                    recorded = fail_job(conn, job, str(e), retry=False)
+                except Exception as e:
+                    done.set()
+                    traceback.print_exc()
+                    conn = conn or connect()
+                    conn.rollback()
+                    recorded = fail_job(conn, job, str(e) or type(e).__name__)
+                finally:
+                    done.set()
+                    heartbeat.join()
+                if not recorded:
+                    print(f"[ai-jobs] {worker_id} no longer holds job {job['id']}; result dropped")
+        except Exception as e:
+            print(f"[ai-jobs] worker {worker_id} error: {e}")
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+        finally:
+            if conn is not None:
+                conn.close()
+        if not job:
+            stop.wait(poll_seconds)
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 import re
 from typing import List, Tuple, Optional, Union
@@ -7,6 +9,13 @@ from google.genai import types
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 _client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
 
+REPORT_MODEL = "gemini-2.5-flash"
+
+# Bump whenever the prompt template, model or post-processing below changes.
+# Cached reports (ai_report_cache.py) are keyed on it, and entries from
+# older versions are evicted on startup.
+PROMPT_VERSION = "strategy-v1"
+
 
 def generate_strategic_report(
     student_name: str,
@@ -376,7 +385,7 @@ Begin the report for {student_name} now.
     # --- CALL GEMINI ---
     try:
         response = _client.models.generate_content(
-            model='gemini-2.5-flash',
+            model=REPORT_MODEL,
             contents=contents,
             config={
                 "tools": [{"google_search": {}}],
@@ -395,4 +404,47 @@ Begin the report for {student_name} now.
 
     except Exception as e:
         print(f"Gemini API Error: {e}")
-        raise Exception(f"AI generation failed: {str(e)}")
\ No newline at end of file
+        raise Exception(f"AI generation failed: {str(e)}")
+
+
+def report_cache_key(
+    student_name: str,
+    destination: str = "Global (AI Recommended)",
+    budget=None,
+    notes: str = "No notes provided.",
+    pdf_files: Optional[List[Tuple[str, bytes, str]]] = None,
+    field_interests: list = None,
+    program_interest: str = "",
+    document_hashes: Optional[List[Tuple[str, str, str]]] = None,  # (label, mime_type, sha256)
+) -> str:
+    """
+    sha256 over everything generate_strategic_report() sends to Gemini:
+    the student inputs, each attached document's label, mime type and
+    content hash, and PROMPT_VERSION / REPORT_MODEL. Same inputs, same key.
+    (pdf_data is left out: it is extracted from the same documents.)
+
+    Pass either pdf_files (hashed here) or document_hashes (already known,
+    e.g. from document_extractions, so nothing has to be downloaded).
+    """
+    if document_hashes is not None:
+        documents = [list(d) for d in document_hashes]
+    else:
+        documents = []
+        for item in pdf_files or []:
+            label, file_bytes = item[0], item[1]
+            mime_type = item[2] if len(item) == 3 else ""
+            documents.append([label, mime_type, hashlib.sha256(file_bytes).hexdigest()])
+
+    material = {
+        "prompt_version": PROMPT_VERSION,
+        "model": REPORT_MODEL,
+        "student_name": student_name,
+        "destination": destination,
+        "budget": budget if isinstance(budget, (int, float)) else str(budget or "").strip(),
+        "notes": notes or "",
+        "field_interests": list(field_interests or []),
+        "program_interest": program_interest or "",
+        "documents": documents,
+    }
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
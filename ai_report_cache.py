@@ -0,0 +1,108 @@
+"""
+Content-addressed cache for Gemini strategy reports.
+
+Entries are keyed by ai_report.report_cache_key(): a sha256 of every
+prompt input (document content hashes, notes, budget, interests, ...)
+plus PROMPT_VERSION. Re-running the analysis for a student whose inputs
+haven't changed returns the stored report instead of calling Gemini again.
+Any change to the inputs produces a new key, so nothing needs explicit
+invalidation. Bumping PROMPT_VERSION orphans the old entries, and
+evict_stale_reports() deletes them.
+
+Hit/generation counters live on the rows themselves, so the hit rate
+covers every API process and standalone worker.
+"""
+import os
+
+from psycopg2.extras import RealDictCursor
+
+from ai_report import PROMPT_VERSION
+
+# Entries nobody has read (or written) for this long are dropped too.
+AI_REPORT_CACHE_MAX_AGE_DAYS = float(os.getenv("AI_REPORT_CACHE_MAX_AGE_DAYS", "180"))
+
+AI_REPORT_CACHE_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS ai_report_cache (
+        cache_key TEXT PRIMARY KEY,
+        prompt_version TEXT NOT NULL,
+        student_id INTEGER,
+        report TEXT NOT NULL,
+        hit_count INTEGER NOT NULL DEFAULT 0,
+        generation_count INTEGER NOT NULL DEFAULT 1,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        last_used_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_ai_report_cache_version
+        ON ai_report_cache (prompt_version);
+"""
+
+
+def lookup_cached_report(conn, cache_key: str):
+    """Returns the cached report (counting the hit) or None. Doesn't commit."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE ai_report_cache
+            SET hit_count = hit_count + 1, last_used_at = NOW()
+            WHERE cache_key = %s AND prompt_version = %s
+            RETURNING report
+        """, (cache_key, PROMPT_VERSION))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def store_cached_report(conn, cache_key: str, report: str, student_id: int = None):
+    """Upserts a freshly generated report (a forced regenerate replaces the entry). Doesn't commit."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO ai_report_cache (cache_key, prompt_version, student_id, report)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE
+            SET report = EXCLUDED.report,
+                generation_count = ai_report_cache.generation_count + 1,
+                last_used_at = NOW()
+        """, (cache_key, PROMPT_VERSION, student_id, report))
+
+
+def evict_stale_reports(conn, max_age_days: float = AI_REPORT_CACHE_MAX_AGE_DAYS) -> dict:
+    """Deletes entries from other prompt versions and ones unused for max_age_days; commits."""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM ai_report_cache WHERE prompt_version <> %s", (PROMPT_VERSION,))
+        stale_versions = cur.rowcount
+        expired = 0
+        if max_age_days > 0:
+            cur.execute("""
+                DELETE FROM ai_report_cache
+                WHERE last_used_at < NOW() - make_interval(secs => %s)
+            """, (max_age_days * 86400,))
+            expired = cur.rowcount
+    conn.commit()
+    return {"stale_versions": stale_versions, "expired": expired}
+
+
+def report_cache_stats(conn) -> dict:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT prompt_version,
+                   COUNT(*) AS entries,
+                   COALESCE(SUM(hit_count), 0) AS hits,
+                   COALESCE(SUM(generation_count), 0) AS generations,
+                   COALESCE(SUM(LENGTH(report)), 0) AS report_chars
+            FROM ai_report_cache
+            GROUP BY prompt_version
+            ORDER BY prompt_version
+        """)
+        versions = cur.fetchall()
+
+    current = next((v for v in versions if v["prompt_version"] == PROMPT_VERSION), None)
+    hits = int(current["hits"]) if current else 0
+    generations = int(current["generations"]) if current else 0
+    lookups = hits + generations
+    return {
+        "prompt_version": PROMPT_VERSION,
+        "hits": hits,
+        "generations": generations,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        "max_age_days": AI_REPORT_CACHE_MAX_AGE_DAYS,
+        "versions": versions,
+    }
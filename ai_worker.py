@@ -0,0 +1,50 @@
+"""
+Standalone AI job worker.
+
+Runs the same handlers as the in-process worker threads in main.py, but in
+its own process so Gemini calls and document parsing never compete with
+API requests. Start as many as you like; they share the ai_jobs queue via
+SKIP LOCKED.
+
+    AI_WORKER_THREADS=0 uvicorn main:app ...   # API hosts: no AI work
+    python ai_worker.py --threads 2            # worker host(s)
+"""
+import argparse
+import signal
+import threading
+
+from ai_jobs import AI_JOB_POLL_SECONDS, default_worker_id, run_worker
+from main import AI_JOB_HANDLERS, get_db_connection
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued AI jobs.")
+    parser.add_argument("--threads", type=int, default=1, help="worker threads in this process")
+    parser.add_argument("--poll", type=float, default=AI_JOB_POLL_SECONDS,
+                        help="seconds to sleep when the queue is empty")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    threads = []
+    for i in range(max(1, args.threads)):
+        worker_id = f"{default_worker_id()}-{i}"
+        t = threading.Thread(
+            target=run_worker, args=(get_db_connection, AI_JOB_HANDLERS, stop),
+            kwargs={"worker_id": worker_id, "poll_seconds": args.poll},
+            name=f"ai-worker-{i}",
+        )
+        t.start()
+        threads.append(t)
+    print(f"[ai-worker] {len(threads)} thread(s) polling for {sorted(AI_JOB_HANDLERS)}")
+
+    # Join with a timeout so signals are handled promptly.
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(timeout=1)
+
+
+if __name__ == "__main__":
+    main()
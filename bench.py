@@ -0,0 +1,927 @@
+"""
+Fortrust OS — performance benchmarks.
+
+Run from the repo root (same .env as main.py):
+
+    python bench.py concurrency --base-url http://localhost:8000 --token <JWT>
+    python bench.py dashboard --students 100000
+    python bench.py plans            # exits 1 if a hot query misses its index
+    python bench.py extract --docs 1 5 10 20
+    python bench.py upload-memory    # exits 1 if an upload's peak memory grows with its size
+    python bench.py import --rows 100000
+    python bench.py reassign --students 5000   # exits 1 if a bulk reassignment exceeds --max-ms
+
+Database benchmarks build their synthetic data in a scratch schema
+(bench_*) and drop it afterwards unless --keep is given.
+
+Each sub-command prints a short report; pass --json-out to save the numbers
+and --compare to diff against a previous run (e.g. before/after a change).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import requests
+from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor
+
+from dashboard_stats import SAFE_JSONB_ARRAY_SQL, build_dashboard_queries, assemble_dashboard_stats, timeframe_clause
+from document_pipeline import extract_pdf_text, fetch_and_extract
+from lead_import import LEAD_DEDUP_INDEXES, import_leads
+from migrations import backfill_by_id_range
+from query_plans import check_hot_query_plans, create_student_indexes
+from student_applications import STUDENT_APPLICATIONS_BACKFILL_SQL, STUDENT_APPLICATIONS_SCHEMA_SQL
+from student_assignees import (
+    STUDENT_ASSIGNEES_BACKFILL_SQL, STUDENT_ASSIGNEES_SCHEMA_SQL, STUDENT_ASSIGNEES_TRIGGERS_SQL,
+    reassign_students,
+)
+from upload_stream import UPLOAD_CHUNK_BYTES, UploadRejected, spool_upload
+
+load_dotenv()
+
+
+# =====================================================================
+# --- HELPERS ---
+# =====================================================================
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summarize(latencies_ms, elapsed_s, errors):
+    return {
+        "requests": len(latencies_ms) + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed_s, 3),
+        "throughput_rps": round(len(latencies_ms) / elapsed_s, 2) if elapsed_s else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 50), 1),
+        "p95_ms": round(percentile(latencies_ms, 95), 1),
+        "p99_ms": round(percentile(latencies_ms, 99), 1),
+        "mean_ms": round(statistics.mean(latencies_ms), 1) if latencies_ms else 0.0,
+    }
+
+
+def print_report(title, results, compare=None):
+    print(f"\n=== {title} ===")
+    for name, stats in results.items():
+        line = ", ".join(f"{k}={v}" for k, v in stats.items())
+        print(f"  {name}: {line}")
+        if compare and name in compare:
+            before = compare[name]
+            deltas = []
+            for key in ("throughput_rps", "p50_ms", "p95_ms"):
+                if key in before and key in stats and before[key]:
+                    change = (stats[key] - before[key]) / before[key] * 100
+                    deltas.append(f"{key} {before[key]} -> {stats[key]} ({change:+.1f}%)")
+            if deltas:
+                print(f"    vs baseline: {'; '.join(deltas)}")
+
+
+def timed(fn, runs):
+    """Runs fn `runs` times; returns (last_result, [ms per run])."""
+    timings, result = [], None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return result, timings
+
+
+def timing_stats(timings):
+    return {
+        "runs": len(timings),
+        "median_ms": round(statistics.median(timings), 1),
+        "min_ms": round(min(timings), 1),
+        "max_ms": round(max(timings), 1),
+    }
+
+
+def finish(args, title, results):
+    compare = None
+    if getattr(args, "compare", None):
+        with open(args.compare) as f:
+            compare = json.load(f).get("results")
+    print_report(title, results, compare)
+    if getattr(args, "json_out", None):
+        with open(args.json_out, "w") as f:
+            json.dump({"benchmark": title, "results": results}, f, indent=2)
+        print(f"\nSaved to {args.json_out}")
+
+
+# =====================================================================
+# --- CONCURRENCY: hot read endpoints under load ---
+# =====================================================================
+# Fires the hot read endpoints at a fixed concurrency while (optionally)
+# keeping a few slow requests in flight to reproduce threadpool starvation.
+# Run once against the old build and once against the new one with the same
+# flags, then use --compare to see the difference.
+DEFAULT_ENDPOINTS = [
+    "/api/pipeline",
+    "/api/notifications",
+    "/api/admin/dashboard-stats",
+]
+
+
+def run_concurrency(args):
+    endpoints = list(args.endpoint or DEFAULT_ENDPOINTS)
+    if args.case_id:
+        endpoints.append(f"/api/pipeline/{args.case_id}/chat")
+    headers = {"Authorization": f"Bearer {args.token}"}
+    session_local = threading.local()
+
+    def session():
+        if not hasattr(session_local, "s"):
+            session_local.s = requests.Session()
+        return session_local.s
+
+    def hit(path):
+        t0 = time.perf_counter()
+        try:
+            r = session().get(args.base_url + path, headers=headers, timeout=args.timeout)
+            ok = r.status_code < 400
+        except requests.RequestException:
+            ok = False
+        return path, (time.perf_counter() - t0) * 1000, ok
+
+    # Background "blockers" — slow calls that hold a worker for a long time.
+    stop = threading.Event()
+
+    def blocker():
+        while not stop.is_set():
+            try:
+                requests.request(
+                    args.slow_method, args.base_url + args.slow_endpoint,
+                    headers=headers, json=json.loads(args.slow_body) if args.slow_body else None,
+                    timeout=args.timeout,
+                )
+            except requests.RequestException:
+                pass
+
+    blockers = []
+    if args.slow_endpoint:
+        for _ in range(args.slow_concurrency):
+            t = threading.Thread(target=blocker, daemon=True)
+            t.start()
+            blockers.append(t)
+        time.sleep(0.5)
+
+    # Warm-up so connection setup isn't measured.
+    for path in endpoints:
+        hit(path)
+
+    per_endpoint = {p: [] for p in endpoints}
+    errors = {p: 0 for p in endpoints}
+    jobs = [endpoints[i % len(endpoints)] for i in range(args.requests)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for path, ms, ok in pool.map(hit, jobs):
+            if ok:
+                per_endpoint[path].append(ms)
+            else:
+                errors[path] += 1
+    elapsed = time.perf_counter() - started
+    stop.set()
+
+    results = {p: summarize(per_endpoint[p], elapsed, errors[p]) for p in endpoints}
+    all_ms = [ms for v in per_endpoint.values() for ms in v]
+    results["ALL"] = summarize(all_ms, elapsed, sum(errors.values()))
+    finish(args, f"concurrency c={args.concurrency} n={args.requests}", results)
+
+
+# =====================================================================
+# --- SCRATCH DATABASE ---
+# =====================================================================
+# Synthetic data lives in its own schema with just the columns the
+# benchmarks touch, so nothing here can collide with real students.
+BRANCHES = ["Jakarta", "Surabaya", "Bandung", "Medan", "Bali"]
+ROLES = ["Individual Agent", "Corporate Agent", "Student Counselor", "Team Manager"]
+
+
+def connect(args):
+    dsn = args.dsn or os.getenv("DATABASE_URL")
+    if not dsn:
+        sys.exit("Set DATABASE_URL or pass --dsn")
+    return psycopg2.connect(dsn, sslmode=args.sslmode)
+
+
+def create_scratch_schema(conn, schema):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f"SET search_path TO {schema}, public")
+        cur.execute(SAFE_JSONB_ARRAY_SQL)
+    conn.commit()
+
+
+def drop_scratch_schema(conn, schema):
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.commit()
+
+
+def seed_users(conn, agents):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE users (
+                id SERIAL PRIMARY KEY,
+                name TEXT UNIQUE,
+                role TEXT,
+                branch TEXT,
+                parent_corporate_id INTEGER REFERENCES users(id)
+            )
+        """)
+        cur.execute("""
+            INSERT INTO users (name, role, branch)
+            SELECT 'Agent ' || g, (%s::text[])[1 + g %% %s], (%s::text[])[1 + g %% %s]
+            FROM generate_series(1, %s) g
+        """, (ROLES, len(ROLES), BRANCHES, len(BRANCHES), agents))
+    conn.commit()
+
+
+def seed_students(conn, students, agents):
+    """~5% unassigned, a mix of statuses/temperatures, 0-3 applications each, 2 years of created_at."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE students (
+                id SERIAL PRIMARY KEY,
+                name TEXT,
+                email TEXT,
+                phone TEXT,
+                assignee TEXT,
+                assignees JSONB DEFAULT '[]'::jsonb,
+                status TEXT,
+                lead_temperature TEXT,
+                commission_earned NUMERIC DEFAULT 0,
+                applications JSONB DEFAULT '[]'::jsonb,
+                documents JSONB DEFAULT '[]'::jsonb,
+                timeline JSONB DEFAULT '[]'::jsonb,
+                created_at TIMESTAMP DEFAULT NOW(),
+                updated_at TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            INSERT INTO students (name, email, phone, assignee, assignees, status, lead_temperature,
+                                  commission_earned, applications, created_at, updated_at)
+            SELECT
+                'Student ' || g,
+                'student' || g || '@example.com',
+                '+62812' || lpad(g::text, 7, '0'),
+                a.name,
+                CASE WHEN a.name IS NULL THEN '[]'::jsonb ELSE jsonb_build_array(a.name) END,
+                (ARRAY['NEW', 'CONSULTATION', 'APPLICATION', 'VISA', 'COMPLETED', 'REJECTED'])[1 + g %% 6],
+                (ARRAY['Hot Leads', 'Warm Leads', 'Cold Leads'])[1 + g %% 3],
+                (g %% 50) * 100,
+                (
+                    SELECT COALESCE(jsonb_agg(jsonb_build_object(
+                        'university', 'University ' || ((g + i) %% 40),
+                        'status', (ARRAY['Submitted', 'Pending', 'Under Review', 'Accepted'])[1 + (g + i) %% 4]
+                    )), '[]'::jsonb)
+                    FROM generate_series(1, g %% 4) i
+                ),
+                NOW() - ((g %% 730) || ' days')::interval - ((g %% 1440) || ' minutes')::interval,
+                CASE WHEN g %% 3 = 0 THEN NOW() - ((g %% 60) || ' days')::interval END
+            FROM generate_series(1, %s) g
+            LEFT JOIN LATERAL (
+                SELECT CASE WHEN g %% 20 = 0 THEN NULL ELSE 'Agent ' || (1 + g %% %s) END AS name
+            ) a ON TRUE
+        """, (students, agents))
+        cur.execute("ANALYZE users")
+        cur.execute("ANALYZE students")
+    conn.commit()
+
+
+def seed_applications(conn):
+    """student_applications from the seeded blobs; half the universities exist as institutions."""
+    with conn.cursor() as cur:
+        cur.execute("CREATE TABLE institutions (id SERIAL PRIMARY KEY, name TEXT DEFAULT '')")
+        cur.execute("INSERT INTO institutions (name) SELECT 'University ' || g FROM generate_series(0, 19) g")
+        cur.execute(STUDENT_APPLICATIONS_SCHEMA_SQL)
+        backfill_by_id_range(conn, STUDENT_APPLICATIONS_BACKFILL_SQL)
+        cur.execute("ANALYZE student_applications")
+    conn.commit()
+
+
+def seed_assignees(conn):
+    """student_assignees from the seeded assignee / assignees names."""
+    with conn.cursor() as cur:
+        cur.execute(STUDENT_ASSIGNEES_SCHEMA_SQL)
+        backfill_by_id_range(conn, STUDENT_ASSIGNEES_BACKFILL_SQL)
+        cur.execute("ANALYZE student_assignees")
+    conn.commit()
+
+
+# =====================================================================
+# --- DASHBOARD: SQL aggregation vs legacy Python loop ---
+# =====================================================================
+def legacy_dashboard_stats(conn, timeframe):
+    """The pre-aggregation implementation: fetch every row, loop in Python."""
+    where, params = timeframe_clause(timeframe)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT name, role, branch FROM users")
+        users_info = {u["name"]: {"role": u["role"], "branch": u["branch"]} for u in cur.fetchall()}
+        cur.execute(
+            f"SELECT assignee, status, applications, commission_earned, lead_temperature, created_at "
+            f"FROM students WHERE {where}", params
+        )
+        students = cur.fetchall()
+
+    totals = {"total": len(students), "completed": 0, "dropped": 0, "qualified": 0, "active_apps": 0, "logged": 0.0}
+    agent_volume, institution_volume, branch_pipeline = {}, {}, {}
+    for s in students:
+        status = (s.get("status") or "").upper()
+        temperature = (s.get("lead_temperature") or "").lower()
+        assignee = s.get("assignee") or "Unassigned"
+        info = users_info.get(assignee, {"role": "Agent", "branch": "Unassigned"})
+        commission = float(s.get("commission_earned") or 0.0)
+        apps = s.get("applications")
+        if isinstance(apps, str):
+            apps = json.loads(apps)
+        if not isinstance(apps, list):
+            apps = []
+        if status == "COMPLETED":
+            totals["completed"] += 1
+            totals["logged"] += commission
+        elif status == "REJECTED":
+            totals["dropped"] += 1
+        if "hot" in temperature or "warm" in temperature:
+            totals["qualified"] += 1
+        active = [a for a in apps if isinstance(a, dict) and a.get("status") in ("Submitted", "Pending", "Under Review")]
+        totals["active_apps"] += len(active)
+        agent_volume[assignee] = agent_volume.get(assignee, 0) + 1
+        for a in active:
+            uni = a.get("university", "Unknown")
+            institution_volume[uni] = institution_volume.get(uni, 0) + 1
+        branch = info["branch"] or "Unassigned"
+        branch_pipeline[branch] = branch_pipeline.get(branch, 0) + 1
+    return totals
+
+
+def sql_dashboard_stats(conn, timeframe):
+    queries = build_dashboard_queries(timeframe)
+    results = {}
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        for name, (sql, params) in queries.items():
+            cur.execute(sql, params)
+            results[name] = cur.fetchall()
+    return assemble_dashboard_stats(results["by_assignee"], results["institutions"], results["growth"][0])
+
+
+def run_dashboard(args):
+    schema = "bench_dashboard"
+    conn = connect(args)
+    try:
+        print(f"Seeding {args.students:,} students / {args.agents} agents into {schema} ...")
+        create_scratch_schema(conn, schema)
+        seed_users(conn, args.agents)
+        seed_students(conn, args.students, args.agents)
+        seed_applications(conn)
+
+        results = {}
+        for timeframe in args.timeframe or ["all", "30days"]:
+            legacy, legacy_ms = timed(lambda: legacy_dashboard_stats(conn, timeframe), args.runs)
+            new, new_ms = timed(lambda: sql_dashboard_stats(conn, timeframe), args.runs)
+
+            m = new["metrics"]
+            assert m["total_students"] == legacy["total"], "total_students mismatch"
+            assert m["completed"] == legacy["completed"], "completed mismatch"
+            assert m["qualified_leads"] == legacy["qualified"], "qualified_leads mismatch"
+            assert m["active_applications"] == legacy["active_apps"], "active_applications mismatch"
+
+            results[f"{timeframe}/legacy_python"] = timing_stats(legacy_ms)
+            results[f"{timeframe}/sql_aggregate"] = timing_stats(new_ms)
+        finish(args, f"dashboard-stats on {args.students:,} students", results)
+    finally:
+        if not args.keep:
+            drop_scratch_schema(conn, schema)
+        conn.close()
+
+
+# =====================================================================
+# --- PLANS: hot queries must use the index meant for them ---
+# =====================================================================
+def run_plans(args):
+    """
+    Regression check for the students indexes. Seeds and ANALYZEs the
+    scratch schema, applies the production index set and EXPLAINs every hot
+    query (see check_hot_query_plans); exits 1 if any plan misses its
+    expected index. --live checks the real schema (read-only) instead.
+    """
+    schema = "bench_plans"
+    conn = connect(args)
+    try:
+        if not args.live:
+            create_scratch_schema(conn, schema)
+            seed_users(conn, args.agents)
+            seed_students(conn, args.students, args.agents)
+            seed_assignees(conn)
+            with conn.cursor() as cur:
+                create_student_indexes(cur)
+                cur.execute("ANALYZE students")
+            conn.commit()
+
+        report = check_hot_query_plans(conn)
+        print()
+        for name, result in report["queries"].items():
+            print(f"[{'OK ' if result['ok'] else 'BAD'}] {name} (expects {' or '.join(result['expected'])})")
+            for line in result["plan"]:
+                print(f"        {line}")
+            if "natural" in result:
+                print(f"      natural plan{'' if result['natural']['ok'] else ' (index not chosen)'}:")
+                for line in result["natural"]["plan"]:
+                    print(f"        {line}")
+        print("\nAll hot queries use their index." if report["ok"] else "\nFAIL: a hot query misses its index.")
+        return 0 if report["ok"] else 1
+    finally:
+        if not args.live and not args.keep:
+            drop_scratch_schema(conn, schema)
+        conn.close()
+
+
+# =====================================================================
+# --- EXTRACT: document fetch + parse, sequential vs pipelined ---
+# =====================================================================
+def make_pdf(pages: int, seed: int) -> bytes:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    for page in range(pages):
+        for line in range(45):
+            c.drawString(40, 800 - line * 17, f"Doc {seed} page {page} line {line}: Mathematics 87, Physics 91, English 78")
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def run_extract(args):
+    """
+    Wall-clock time to fetch and text-extract N documents: the old
+    one-at-a-time loop vs document_pipeline.fetch_and_extract(). Downloads
+    are simulated with a fixed per-file latency (--latency-ms) so the run
+    needs no storage bucket; parsing is real PyPDF2 work on generated PDFs.
+    """
+    blobs = {f"S1_DOC{i}.pdf": make_pdf(args.pages, i) for i in range(max(args.docs))}
+
+    def download(filename):
+        time.sleep(args.latency_ms / 1000.0)
+        return blobs[filename]
+
+    def sequential(docs):
+        out = []
+        for doc in docs:
+            file_bytes = download(doc["filename"])
+            out.append(extract_pdf_text(file_bytes))
+        return out
+
+    def pipelined(docs):
+        result = fetch_and_extract(docs, download)
+        assert not result["failures"], result["failures"]
+        return [item["text"] for item in result["documents"]]
+
+    pipelined([{"filename": "S1_DOC0.pdf"}])  # start the process pool outside the timings
+
+    results = {}
+    for count in args.docs:
+        docs = [{"filename": f"S1_DOC{i}.pdf", "title": f"Doc {i}"} for i in range(count)]
+        old, old_ms = timed(lambda: sequential(docs), args.runs)
+        new, new_ms = timed(lambda: pipelined(docs), args.runs)
+        assert old == new, "extracted text differs"
+        results[f"{count}_docs/sequential"] = timing_stats(old_ms)
+        results[f"{count}_docs/pipelined"] = timing_stats(new_ms)
+    finish(args, f"document fetch+extract ({args.latency_ms:g} ms/download, {args.pages} pages/PDF)", results)
+
+
+# =====================================================================
+# --- IMPORT: bulk lead import, per-row INSERT vs lead_import ---
+# =====================================================================
+def make_lead_csv(rows: int, existing: int) -> bytes:
+    """
+    Marketing-template CSV with a realistic mess: ~2% rows already in
+    students, ~1% repeated within the file, ~1% bad emails, the rest new.
+    """
+    out = io.StringIO()
+    out.write("Name,Email (Active),WA,Program yang diminati\n")
+    for i in range(rows):
+        if i % 50 == 1 and existing:
+            n = 1 + i % existing
+            out.write(f"Student {n},student{n}@example.com,+62812{n:07d},Bachelor of Business\n")
+        elif i % 100 == 2 and i > 2:
+            out.write(f"Lead {i - 2},LEAD{i - 2}@Example.com,0813-{i - 2:08d},Master of IT\n")
+        elif i % 100 == 3:
+            out.write(f"Lead {i},not-an-email,0813{i:08d},Diploma\n")
+        else:
+            out.write(f"Lead {i},lead{i}@example.com,0813 {i:08d},Bachelor of Engineering\n")
+    return out.getvalue().encode()
+
+
+def run_import(args):
+    """
+    Rows/second for a bulk lead file: the legacy loop (one INSERT per row,
+    one transaction; run on the first --legacy-rows rows only and rolled
+    back, since at 100k it takes minutes) vs lead_import.import_leads() on
+    the whole file, against a seeded students table.
+    """
+    schema = "bench_import"
+    conn = connect(args)
+    try:
+        print(f"Seeding {args.students:,} students into {schema} ...")
+        create_scratch_schema(conn, schema)
+        seed_users(conn, 10)
+        seed_students(conn, args.students, 10)
+        with conn.cursor() as cur:
+            cur.execute("ALTER TABLE students ADD COLUMN program_interest TEXT DEFAULT '', "
+                        "ADD COLUMN lead_source TEXT DEFAULT ''")
+            for _, ddl in LEAD_DEDUP_INDEXES:
+                cur.execute(ddl)
+            cur.execute("ANALYZE students")
+        conn.commit()
+
+        blob = make_lead_csv(args.rows, args.students)
+        print(f"Generated {args.rows:,}-row CSV ({len(blob) / 2**20:.1f} MB)")
+
+        legacy_rows = min(args.legacy_rows, args.rows)
+        lines = blob.decode().splitlines()[1:legacy_rows + 1]
+        t0 = time.perf_counter()
+        with conn.cursor() as cur:
+            for line in lines:
+                name, email, phone, program = line.split(",")
+                cur.execute("""
+                    INSERT INTO students (name, email, phone, program_interest, assignee, status, lead_source)
+                    VALUES (%s, %s, %s, %s, %s, 'NEW LEAD', 'Bulk Excel Upload')
+                """, (name, email, phone, program, "Agent 1"))
+        legacy_s = time.perf_counter() - t0
+        conn.rollback()
+
+        results = {f"legacy_per_row/{legacy_rows}_rows": {
+            "elapsed_s": round(legacy_s, 2),
+            "rows_per_second": round(legacy_rows / legacy_s),
+            "projected_s_for_file": round(legacy_s / legacy_rows * args.rows, 1),
+        }}
+        for run in range(args.runs):
+            report = import_leads(conn, io.BytesIO(blob), "leads.csv", assignee="Agent 1")
+            results[f"lead_import/run{run + 1}"] = {
+                "elapsed_s": round(report["elapsed_ms"] / 1000, 2),
+                "rows_per_second": report["rows_per_second"],
+                "imported": report["imported"],
+                "duplicates": report["duplicates"],
+                "invalid": report["invalid"],
+            }
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM students WHERE lead_source = 'Bulk Excel Upload'")
+            conn.commit()
+        finish(args, f"bulk lead import of {args.rows:,} rows into {args.students:,} students", results)
+    finally:
+        if not args.keep:
+            drop_scratch_schema(conn, schema)
+        conn.close()
+
+
+# =====================================================================
+# --- REASSIGN: bulk reassignment, per-student loop vs set-based ---
+# =====================================================================
+DEPARTING_AGENT = "Departing Agent"
+FORMER_AGENT = "Former Agent"
+
+
+def seed_reassign(conn, students, background, agents):
+    """
+    `background` students spread over the agents, plus `students` active ones
+    for DEPARTING_AGENT (every 4th co-assigned to Agent 1, every 10th also
+    naming FORMER_AGENT, who has no user), with the timeline / chat tables
+    and the student_assignees triggers in place.
+    """
+    seed_users(conn, agents)
+    seed_students(conn, background, agents)
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO users (name, role, branch) VALUES (%s, 'Agent', 'Jakarta')", (DEPARTING_AGENT,))
+        cur.execute("""
+            INSERT INTO students (name, email, assignee, assignees, status, lead_temperature, created_at)
+            SELECT 'Book ' || g, 'book' || g || '@example.com', %(agent)s,
+                   CASE WHEN g %% 4 = 0 THEN jsonb_build_array(%(agent)s, 'Agent 1')
+                        ELSE jsonb_build_array(%(agent)s) END
+                   || CASE WHEN g %% 10 = 0 THEN jsonb_build_array(%(former)s) ELSE '[]'::jsonb END,
+                   (ARRAY['NEW', 'CONSULTATION', 'APPLICATION', 'VISA'])[1 + g %% 4],
+                   'Warm Leads', NOW() - ((g %% 365) || ' days')::interval
+            FROM generate_series(1, %(n)s) g
+        """, {"agent": DEPARTING_AGENT, "former": FORMER_AGENT, "n": students})
+        cur.execute("""
+            CREATE TABLE timeline_entries (
+                id BIGSERIAL PRIMARY KEY,
+                student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+                author TEXT,
+                note TEXT NOT NULL DEFAULT '',
+                reminder_date DATE,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+            CREATE INDEX ON timeline_entries (student_id, created_at);
+            CREATE TABLE chat_messages (
+                id SERIAL PRIMARY KEY,
+                student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+                sender TEXT NOT NULL,
+                message TEXT NOT NULL,
+                is_system BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT NOW()
+            );
+            CREATE INDEX ON chat_messages (student_id, id);
+        """)
+        create_student_indexes(cur)
+        cur.execute(STUDENT_ASSIGNEES_SCHEMA_SQL)
+        cur.execute(STUDENT_ASSIGNEES_TRIGGERS_SQL)
+        backfill_by_id_range(conn, STUDENT_ASSIGNEES_BACKFILL_SQL)
+        for table in ("users", "students", "student_assignees"):
+            cur.execute(f"ANALYZE {table}")
+    conn.commit()
+
+
+def legacy_reassign(conn, from_agent, to_agent, actor):
+    """The old endpoint body: one SELECT, then an UPDATE + timeline INSERT + chat INSERT per student."""
+    note = f"Reassigned by {actor}: {from_agent} → {to_agent}"
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id, name, assignee, assignees FROM students
+            WHERE (assignee = %s OR assignees @> %s::jsonb)
+              AND UPPER(COALESCE(status, '')) NOT IN ('COMPLETED', 'REJECTED', 'ARCHIVED')
+        """, (from_agent, json.dumps([from_agent])))
+        students = cur.fetchall()
+        for s in students:
+            current = list(s["assignees"] or [])
+            if s["assignee"] and s["assignee"] != "Unassigned" and s["assignee"] not in current:
+                current.insert(0, s["assignee"])
+            new = [a for a in current if a != from_agent]
+            if to_agent not in new:
+                new.append(to_agent)
+            cur.execute("UPDATE students SET assignee = %s, assignees = %s::jsonb WHERE id = %s",
+                        (new[0] if new else "Unassigned", json.dumps(new), s["id"]))
+            cur.execute("INSERT INTO timeline_entries (student_id, author, note) VALUES (%s, %s, %s)",
+                        (s["id"], actor, note))
+            cur.execute("""
+                INSERT INTO chat_messages (student_id, sender, message, is_system)
+                VALUES (%s, 'System', %s, TRUE)
+            """, (s["id"], note))
+    return len(students)
+
+
+def run_reassign(args):
+    """
+    Moves DEPARTING_AGENT's whole book (--students active students) to
+    Agent 2, the legacy way and through student_assignees.reassign_students().
+    Every run is rolled back so each starts from the same data. Set-based
+    runs alternate between a live and a deleted departing user (whose
+    student_assignees rows are gone). Exits 1 if any set-based run takes
+    longer than --max-ms, moves the wrong count, leaves the departing name
+    anywhere, or drops FORMER_AGENT from the name lists.
+    """
+    schema = "bench_reassign"
+    conn = connect(args)
+    try:
+        print(f"Seeding {args.students:,} + {args.background:,} students into {schema} ...")
+        create_scratch_schema(conn, schema)
+        seed_reassign(conn, args.students, args.background, args.agents)
+
+        def legacy():
+            try:
+                return legacy_reassign(conn, DEPARTING_AGENT, "Agent 2", "Bench")
+            finally:
+                conn.rollback()
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM students WHERE assignees @> jsonb_build_array(%s::text)",
+                        (FORMER_AGENT,))
+            former_before = cur.fetchone()[0]
+        conn.rollback()
+
+        def leftovers(cur):
+            """(students still naming DEPARTING_AGENT, students naming FORMER_AGENT)."""
+            cur.execute("""
+                SELECT COUNT(*) FILTER (WHERE assignee = %(d)s OR assignees @> jsonb_build_array(%(d)s::text)),
+                       COUNT(*) FILTER (WHERE assignees @> jsonb_build_array(%(f)s::text))
+                FROM students
+            """, {"d": DEPARTING_AGENT, "f": FORMER_AGENT})
+            return cur.fetchone()
+
+        checks, run_no = [], [0]
+
+        def set_based():
+            deleted = run_no[0] % 2 == 1
+            run_no[0] += 1
+            with conn.cursor() as cur:
+                if deleted:
+                    cur.execute("DELETE FROM users WHERE name = %s", (DEPARTING_AGENT,))
+                t0 = time.perf_counter()
+                try:
+                    note = f"Reassigned by Bench: {DEPARTING_AGENT} → Agent 2"
+                    moved = len(reassign_students(cur, DEPARTING_AGENT, "Agent 2", "Bench", note))
+                    elapsed = (time.perf_counter() - t0) * 1000
+                    checks.append((deleted, moved, *leftovers(cur)))
+                    return elapsed
+                finally:
+                    conn.rollback()
+
+        results = {}
+        legacy_moved, timings = timed(legacy, args.legacy_runs)
+        results["legacy_per_student"] = {**timing_stats(timings), "students": legacy_moved}
+        timings = [set_based() for _ in range(max(2, args.runs))]
+        moved = min(c[1] for c in checks)
+        results["set_based"] = {**timing_stats(timings), "students": moved}
+
+        ok = max(timings) <= args.max_ms
+        for deleted, n, still_named, former in checks:
+            good = n == args.students and still_named == 0 and former == former_before
+            ok &= good
+            if not good:
+                print(f"[BAD] {'deleted' if deleted else 'live'} departing user: moved {n:,}, "
+                      f"{still_named:,} still name them, {former:,}/{former_before:,} keep {FORMER_AGENT}")
+        finish(args, f"bulk reassignment of {args.students:,} students", results)
+        print(f"\nSet-based reassignment of {moved:,} students: max {max(timings):.0f} ms "
+              f"(target {args.max_ms:.0f} ms) — {'OK' if ok else 'FAIL'}")
+        return 0 if ok else 1
+    finally:
+        if not args.keep:
+            drop_scratch_schema(conn, schema)
+        conn.close()
+
+
+# =====================================================================
+# --- UPLOAD-MEMORY: peak RAM of one upload, buffered vs streamed ---
+# =====================================================================
+class SyntheticUpload:
+    """Stands in for FastAPI's UploadFile: yields `size` bytes of PDF-looking data on demand."""
+
+    def __init__(self, size: int, filename: str = "report.pdf"):
+        self.filename = filename
+        self.content_type = "application/pdf"
+        self.size = size
+        self.sent = 0
+
+    async def read(self, n: int = -1) -> bytes:
+        remaining = self.size - self.sent
+        n = remaining if n is None or n < 0 else min(n, remaining)
+        chunk = b"%PDF-1.4\n".ljust(n, b"0")[:n] if self.sent == 0 else b"0" * n
+        self.sent += n
+        return chunk
+
+
+def peak_bytes(coro_fn):
+    tracemalloc.start()
+    try:
+        result = asyncio.run(coro_fn())
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def run_upload_memory(args):
+    """
+    Regression check for upload_stream: traces peak Python allocations while
+    one upload is consumed the old way (`await file.read()`) and through
+    spool_upload(). Exits 1 if the streamed peak exceeds --max-chunks chunk
+    sizes, or if an oversized upload isn't cut off near the cap.
+    """
+    chunk = UPLOAD_CHUNK_BYTES
+    budget = args.max_chunks * chunk
+    results, ok = {}, True
+
+    for size_mb in args.sizes_mb:
+        size = size_mb * 1024 * 1024
+
+        async def buffered():
+            return len(await SyntheticUpload(size).read())
+
+        async def streamed():
+            spooled = await spool_upload(SyntheticUpload(size), max_bytes=size)
+            spooled.cleanup()
+            return spooled.size
+
+        old_peak, _ = peak_bytes(buffered)
+        new_peak, stored = peak_bytes(streamed)
+        assert stored == size, (stored, size)
+        passed = new_peak <= budget
+        ok &= passed
+        results[f"{size_mb}MB"] = {"buffered_peak_mb": round(old_peak / 2**20, 2),
+                                   "streamed_peak_mb": round(new_peak / 2**20, 2)}
+        print(f"[{'OK ' if passed else 'BIG'}] {size_mb:>5} MB upload: buffered peak "
+              f"{old_peak / 2**20:8.2f} MB, streamed peak {new_peak / 2**20:6.2f} MB")
+
+    cap = args.cap_mb * 1024 * 1024
+    oversized = SyntheticUpload(max(args.sizes_mb) * 1024 * 1024 + cap)
+
+    async def rejected():
+        try:
+            await spool_upload(oversized, max_bytes=cap)
+        except UploadRejected:
+            return True
+        return False
+
+    peak, was_rejected = peak_bytes(rejected)
+    cut_off = was_rejected and oversized.sent <= cap + chunk
+    ok &= cut_off and peak <= budget
+    print(f"[{'OK ' if cut_off else 'BAD'}] oversized upload rejected after reading "
+          f"{oversized.sent / 2**20:.1f} MB (cap {args.cap_mb} MB), peak {peak / 2**20:.2f} MB")
+
+    if args.json_out:
+        with open(args.json_out, "w") as fh:
+            json.dump(results, fh, indent=2)
+    print("\nUpload memory is bounded." if ok else f"\nFAIL: streamed upload peak above {budget / 2**20:.1f} MB.")
+    return 0 if ok else 1
+
+
+# =====================================================================
+# --- CLI ---
+# =====================================================================
+def build_parser():
+    parser = argparse.ArgumentParser(description="Fortrust OS performance benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("concurrency", help="Throughput of the hot read endpoints under concurrent load")
+    p.add_argument("--base-url", default="http://localhost:8000")
+    p.add_argument("--token", required=True, help="JWT of the user to benchmark as (Master Admin for dashboard-stats)")
+    p.add_argument("--endpoint", action="append", help="Override the endpoint list (repeatable)")
+    p.add_argument("--case-id", help="Also hit /api/pipeline/{case_id}/chat")
+    p.add_argument("--requests", type=int, default=400)
+    p.add_argument("--concurrency", type=int, default=32)
+    p.add_argument("--timeout", type=float, default=60)
+    p.add_argument("--slow-endpoint", help="Path kept busy in the background, e.g. /api/ai-strategy")
+    p.add_argument("--slow-method", default="POST")
+    p.add_argument("--slow-body", help='JSON body for the slow endpoint, e.g. \'{"case_id": "12"}\'')
+    p.add_argument("--slow-concurrency", type=int, default=8)
+    p.add_argument("--json-out")
+    p.add_argument("--compare", help="JSON file from a previous --json-out run")
+    p.set_defaults(func=run_concurrency)
+
+    p = sub.add_parser("dashboard", help="Dashboard stats: SQL aggregation vs the legacy Python loop")
+    add_db_args(p)
+    p.add_argument("--students", type=int, default=100_000)
+    p.add_argument("--agents", type=int, default=200)
+    p.add_argument("--timeframe", action="append", help="Timeframe(s) to measure (default: all, 30days)")
+    p.set_defaults(func=run_dashboard)
+
+    p = sub.add_parser("plans", help="Fail if a hot students query doesn't use the index meant for it")
+    add_db_args(p)
+    p.add_argument("--students", type=int, default=20_000)
+    p.add_argument("--agents", type=int, default=100)
+    p.add_argument("--live", action="store_true", help="Check the real schema instead of a seeded scratch copy")
+    p.set_defaults(func=run_plans)
+
+    p = sub.add_parser("extract", help="Document fetch + PDF extraction: sequential vs concurrent pipeline")
+    p.add_argument("--docs", type=int, nargs="+", default=[1, 2, 5, 10, 20], help="Document counts to measure")
+    p.add_argument("--pages", type=int, default=4, help="Pages per generated PDF")
+    p.add_argument("--latency-ms", type=float, default=150, help="Simulated storage round-trip per download")
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--json-out")
+    p.add_argument("--compare", help="JSON file from a previous --json-out run")
+    p.set_defaults(func=run_extract)
+
+    p = sub.add_parser("import", help="Bulk lead import: per-row INSERT vs batched lead_import")
+    add_db_args(p)
+    p.set_defaults(runs=1)
+    p.add_argument("--rows", type=int, default=100_000, help="Rows in the generated lead file")
+    p.add_argument("--students", type=int, default=50_000, help="Existing students to dedup against")
+    p.add_argument("--legacy-rows", type=int, default=5_000, help="Rows to time through the legacy loop")
+    p.set_defaults(func=run_import)
+
+    p = sub.add_parser("reassign", help="Fail if bulk-reassigning an agent's students exceeds --max-ms")
+    add_db_args(p)
+    p.add_argument("--students", type=int, default=5_000, help="Active students on the departing agent")
+    p.add_argument("--background", type=int, default=50_000, help="Other students in the table")
+    p.add_argument("--agents", type=int, default=50)
+    p.add_argument("--legacy-runs", type=int, default=1)
+    p.add_argument("--max-ms", type=float, default=1500, help="Latency target for one set-based run")
+    p.set_defaults(func=run_reassign)
+
+    p = sub.add_parser("upload-memory", help="Fail if an upload's peak memory grows with the file size")
+    p.add_argument("--sizes-mb", type=int, nargs="+", default=[9, 50, 200], help="Upload sizes to trace")
+    p.add_argument("--cap-mb", type=int, default=10, help="Size cap for the oversized-upload check")
+    p.add_argument("--max-chunks", type=float, default=4, help="Allowed streamed peak, in upload chunks")
+    p.add_argument("--json-out")
+    p.set_defaults(func=run_upload_memory)
+
+    return parser
+
+
+def add_db_args(p):
+    p.add_argument("--dsn", help="Postgres DSN (defaults to DATABASE_URL)")
+    p.add_argument("--sslmode", default="require")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--keep", action="store_true", help="Keep the scratch schema afterwards")
+    p.add_argument("--json-out")
+    p.add_argument("--compare", help="JSON file from a previous --json-out run")
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args) or 0)
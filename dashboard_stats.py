@@ -0,0 +1,599 @@
+"""
+Master-admin dashboard metrics, computed in Postgres.
+
+The dashboard used to pull every student row into Python and loop over it.
+The heavy lifting is now GROUP BY / FILTER aggregates over students and
+student_applications (see student_applications.py); Python only folds the
+per-assignee groups (one row per agent) into the response shape the
+frontend already consumes.
+
+Kept free of FastAPI / connection handling so main.py (async pool) and
+bench.py (plain psycopg2) run exactly the same SQL.
+"""
+import time
+from datetime import date, datetime
+from typing import Optional
+
+# Application statuses (application_status enum values) that count as
+# "active" on the dashboard.
+ACTIVE_APPLICATION_STATUSES = ("Submitted", "Pending", "Under Review")
+
+# Active applications per student, for joining onto a students scan.
+_ACTIVE_APPS_SQL = """
+    SELECT student_id, COUNT(*) AS n
+    FROM student_applications
+    WHERE status = ANY(%(active)s::application_status[])
+    GROUP BY student_id
+"""
+
+# Linked applications group under the institution's own name, the rest
+# under what was typed.
+_INSTITUTION_NAME_SQL = "COALESCE(i.name, NULLIF(a.university, ''), 'Unknown')"
+
+# `applications` has historically held arrays, double-encoded JSON strings and
+# the odd malformed blob. safe_jsonb_array() normalises all of them to a jsonb
+# array (or '[]') so the aggregates never trip over a bad row. The jsonb
+# overload is the fast path; only string payloads pay for the EXCEPTION block.
+SAFE_JSONB_ARRAY_SQL = """
+    CREATE OR REPLACE FUNCTION safe_jsonb_array(raw TEXT) RETURNS JSONB
+    LANGUAGE plpgsql IMMUTABLE AS $$
+    DECLARE
+        parsed JSONB;
+    BEGIN
+        IF raw IS NULL OR btrim(raw) = '' THEN
+            RETURN '[]'::jsonb;
+        END IF;
+        parsed := raw::jsonb;
+        IF jsonb_typeof(parsed) = 'string' THEN
+            parsed := (parsed #>> '{}')::jsonb;
+        END IF;
+        IF jsonb_typeof(parsed) = 'array' THEN
+            RETURN parsed;
+        END IF;
+        RETURN '[]'::jsonb;
+    EXCEPTION WHEN others THEN
+        RETURN '[]'::jsonb;
+    END $$;
+
+    CREATE OR REPLACE FUNCTION safe_jsonb_array(raw JSONB) RETURNS JSONB
+    LANGUAGE plpgsql IMMUTABLE AS $$
+    BEGIN
+        IF raw IS NULL THEN
+            RETURN '[]'::jsonb;
+        ELSIF jsonb_typeof(raw) = 'array' THEN
+            RETURN raw;
+        ELSIF jsonb_typeof(raw) = 'string' THEN
+            RETURN safe_jsonb_array(raw #>> '{}');
+        END IF;
+        RETURN '[]'::jsonb;
+    END $$;
+"""
+
+
+def timeframe_clause(timeframe: str, from_date: Optional[str] = None, to_date: Optional[str] = None,
+                     column: str = "created_at") -> tuple:
+    """
+    Returns (sql_fragment, params) restricting `column` (students.created_at,
+    or the rollups' `day`) to the dashboard timeframe. Raises ValueError on
+    malformed custom dates.
+    """
+    if timeframe == "30days":
+        return (f"{column} >= NOW() - INTERVAL '30 days'", [])
+    if timeframe == "3months":
+        return (f"{column} >= NOW() - INTERVAL '3 months'", [])
+    if timeframe == "6months":
+        return (f"{column} >= NOW() - INTERVAL '6 months'", [])
+    if timeframe == "this_year":
+        return (f"EXTRACT(YEAR FROM {column}) = EXTRACT(YEAR FROM NOW())", [])
+    if timeframe == "custom" and from_date and to_date:
+        start, end = date.fromisoformat(from_date), date.fromisoformat(to_date)
+        return (f"{column}::date BETWEEN %s AND %s", [start, end])
+    return ("TRUE", [])
+
+
+def build_dashboard_queries(timeframe: str = "all", from_date: str = None, to_date: str = None) -> dict:
+    """
+    Returns {name: (sql, params)}. The queries are independent, so callers
+    may run them concurrently.
+      - by_assignee:  one row per (assignee, role, branch) with all counters
+      - institutions: top 5 universities by active applications
+      - growth:       qualified leads in the last 30 days vs the 30 before
+    """
+    where, params = timeframe_clause(timeframe, from_date, to_date, column="st.created_at")
+    active = list(ACTIVE_APPLICATION_STATUSES)
+
+    by_assignee = f"""
+        WITH u AS (
+            SELECT DISTINCT ON (name) name, role, branch
+            FROM users
+            ORDER BY name, id DESC
+        ),
+        apps AS ({_ACTIVE_APPS_SQL.replace("%(active)s", "%s")}),
+        s AS (
+            SELECT
+                COALESCE(NULLIF(st.assignee, ''), 'Unassigned') AS assignee,
+                UPPER(COALESCE(st.status, '')) AS status,
+                LOWER(COALESCE(st.lead_temperature, '')) AS temperature,
+                COALESCE(st.commission_earned, 0)::float8 AS commission,
+                COALESCE(apps.n, 0) AS active_apps
+            FROM students st
+            LEFT JOIN apps ON apps.student_id = st.id
+            WHERE {where}
+        )
+        SELECT
+            s.assignee,
+            COALESCE(NULLIF(u.role, ''), 'Agent') AS role,
+            COALESCE(NULLIF(u.branch, ''), 'Unassigned') AS branch,
+            COUNT(*) AS volume,
+            COALESCE(SUM(s.commission), 0) AS revenue,
+            COUNT(*) FILTER (WHERE s.status = 'COMPLETED') AS completed,
+            COUNT(*) FILTER (WHERE s.status = 'REJECTED') AS dropped,
+            COALESCE(SUM(s.commission) FILTER (WHERE s.status = 'COMPLETED'), 0) AS logged_commission,
+            COALESCE(SUM(s.commission) FILTER (WHERE s.status NOT IN ('COMPLETED', 'REJECTED')), 0) AS estimation_commission,
+            COUNT(*) FILTER (WHERE s.temperature LIKE '%%hot%%' OR s.temperature LIKE '%%warm%%') AS qualified,
+            COALESCE(SUM(s.active_apps), 0) AS active_applications
+        FROM s
+        LEFT JOIN u ON u.name = s.assignee
+        GROUP BY 1, 2, 3
+    """
+
+    institutions = f"""
+        SELECT {_INSTITUTION_NAME_SQL} AS name, COUNT(*) AS value
+        FROM student_applications a
+        JOIN students st ON st.id = a.student_id
+        LEFT JOIN institutions i ON i.id = a.institution_id
+        WHERE {where}
+          AND a.status = ANY(%s::application_status[])
+        GROUP BY 1
+        ORDER BY value DESC, name
+        LIMIT 5
+    """
+
+    growth = """
+        SELECT
+            COUNT(*) FILTER (WHERE created_at >= NOW() - INTERVAL '30 days') AS current_qualified,
+            COUNT(*) FILTER (WHERE created_at < NOW() - INTERVAL '30 days') AS prev_qualified
+        FROM students
+        WHERE created_at >= NOW() - INTERVAL '60 days'
+          AND (LOWER(COALESCE(lead_temperature, '')) LIKE '%hot%'
+               OR LOWER(COALESCE(lead_temperature, '')) LIKE '%warm%')
+    """
+
+    return {
+        "by_assignee": (by_assignee, [active] + params),
+        "institutions": (institutions, params + [active]),
+        "growth": (growth, None),
+    }
+
+
+# =====================================================================
+# --- ROLLUPS ---
+# =====================================================================
+# Dashboard reads go through small summary tables instead of `students`:
+#   dashboard_daily_rollup        day x assignee x status x qualified
+#   dashboard_institution_rollup  day x university (active applications)
+# Branch and role are joined from `users` at read time, so re-branching an
+# agent never needs a rebuild. A row trigger on `students` records which
+# created_at days changed in dashboard_rollup_dirty; refresh_dashboard_rollups()
+# (background thread in main.py, or the forced-refresh endpoint) recomputes
+# just those days. Students without created_at roll up under '-infinity'.
+#
+# Because the grain is a day, relative timeframes ("30days", growth) are
+# evaluated on whole days rather than to the second.
+ROLLUP_NULL_DAY = "'-infinity'::date"
+ROLLUP_LOCK_KEY = 7301001  # pg_advisory lock: one refresher at a time across workers
+
+DASHBOARD_ROLLUP_SCHEMA_SQL = f"""
+    CREATE TABLE IF NOT EXISTS dashboard_daily_rollup (
+        day DATE NOT NULL,
+        assignee TEXT NOT NULL,
+        status TEXT NOT NULL,
+        qualified BOOLEAN NOT NULL,
+        students INTEGER NOT NULL DEFAULT 0,
+        commission DOUBLE PRECISION NOT NULL DEFAULT 0,
+        active_applications INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, assignee, status, qualified)
+    );
+
+    CREATE TABLE IF NOT EXISTS dashboard_institution_rollup (
+        day DATE NOT NULL,
+        university TEXT,
+        active_applications INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_dashboard_institution_rollup_day ON dashboard_institution_rollup (day);
+
+    CREATE TABLE IF NOT EXISTS dashboard_rollup_dirty (
+        day DATE PRIMARY KEY,
+        marked_at TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS dashboard_rollup_state (
+        id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        last_refresh_at TIMESTAMP,
+        last_full_rebuild_at TIMESTAMP,
+        last_refresh_ms INTEGER,
+        last_refresh_days INTEGER
+    );
+
+    CREATE OR REPLACE FUNCTION mark_dashboard_rollup_dirty() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO dashboard_rollup_dirty (day)
+            VALUES (COALESCE(OLD.created_at::date, {ROLLUP_NULL_DAY}))
+            ON CONFLICT (day) DO NOTHING;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO dashboard_rollup_dirty (day)
+            VALUES (COALESCE(NEW.created_at::date, {ROLLUP_NULL_DAY}))
+            ON CONFLICT (day) DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END $$;
+
+    DROP TRIGGER IF EXISTS students_dashboard_rollup_dirty ON students;
+    CREATE TRIGGER students_dashboard_rollup_dirty
+        AFTER INSERT OR DELETE
+        OR UPDATE OF assignee, status, lead_temperature, commission_earned, applications, created_at
+        ON students
+        FOR EACH ROW EXECUTE FUNCTION mark_dashboard_rollup_dirty();
+"""
+
+
+def _rollup_source_sql(day_filter: str) -> tuple:
+    """INSERT ... SELECT statements that recompute the rollups for the students matching day_filter."""
+    day_expr = f"COALESCE(created_at::date, {ROLLUP_NULL_DAY})"
+    daily = f"""
+        INSERT INTO dashboard_daily_rollup (day, assignee, status, qualified, students, commission, active_applications)
+        SELECT
+            {day_expr},
+            COALESCE(NULLIF(assignee, ''), 'Unassigned'),
+            UPPER(COALESCE(status, '')),
+            LOWER(COALESCE(lead_temperature, '')) LIKE '%%hot%%'
+                OR LOWER(COALESCE(lead_temperature, '')) LIKE '%%warm%%',
+            COUNT(*),
+            COALESCE(SUM(COALESCE(commission_earned, 0)::float8), 0),
+            COALESCE(SUM(apps.n), 0)
+        FROM students
+        LEFT JOIN ({_ACTIVE_APPS_SQL}) apps ON apps.student_id = students.id
+        WHERE {day_filter}
+        GROUP BY 1, 2, 3, 4
+    """
+    institutions = f"""
+        INSERT INTO dashboard_institution_rollup (day, university, active_applications)
+        SELECT s.day, {_INSTITUTION_NAME_SQL}, COUNT(*)
+        FROM (
+            SELECT id, {day_expr} AS day FROM students WHERE {day_filter}
+        ) s
+        JOIN student_applications a ON a.student_id = s.id
+        LEFT JOIN institutions i ON i.id = a.institution_id
+        WHERE a.status = ANY(%(active)s::application_status[])
+        GROUP BY 1, 2
+    """
+    return daily, institutions
+
+
+def refresh_dashboard_rollups(conn, full: bool = False) -> Optional[dict]:
+    """
+    Brings the rollups up to date on a psycopg2 connection and commits.
+    full=True rebuilds everything; otherwise only days queued in
+    dashboard_rollup_dirty are recomputed. Returns None when another worker
+    already holds the refresh lock.
+
+    The queued days are claimed in a short transaction of their own, so a
+    student write that marks one of them never waits for the recompute
+    (a full rebuild can take a while); if the recompute fails they are
+    queued again.
+    """
+    started = time.perf_counter()
+    active = list(ACTIVE_APPLICATION_STATUSES)
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (ROLLUP_LOCK_KEY,))
+        locked = cur.fetchone()[0]
+    conn.commit()
+    if not locked:
+        return None
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT last_full_rebuild_at FROM dashboard_rollup_state WHERE id = 1")
+            state = cur.fetchone()
+            full = full or not state or state[0] is None
+
+            # Claim the queue first: anything marked after this point is picked
+            # up by the next refresh, so no change can slip through.
+            # (as text: psycopg2 would turn '-infinity' into date.min)
+            cur.execute("DELETE FROM dashboard_rollup_dirty RETURNING day::text, marked_at")
+            claimed = cur.fetchall()
+        conn.commit()
+
+        days = [r[0] for r in claimed]
+        try:
+            _recompute_rollups(conn, days, full, active)
+            elapsed_ms = int((time.perf_counter() - started) * 1000)
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO dashboard_rollup_state (id, last_refresh_at, last_full_rebuild_at, last_refresh_ms, last_refresh_days)
+                    VALUES (1, NOW(), CASE WHEN %(full)s THEN NOW() END, %(ms)s, %(days)s)
+                    ON CONFLICT (id) DO UPDATE SET
+                        last_refresh_at = NOW(),
+                        last_full_rebuild_at = CASE WHEN %(full)s THEN NOW() ELSE dashboard_rollup_state.last_full_rebuild_at END,
+                        last_refresh_ms = EXCLUDED.last_refresh_ms,
+                        last_refresh_days = EXCLUDED.last_refresh_days
+                """, {"full": full, "ms": elapsed_ms, "days": len(days)})
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            if claimed:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO dashboard_rollup_dirty (day, marked_at)
+                        SELECT * FROM unnest(%s::date[], %s::timestamp[])
+                        ON CONFLICT (day) DO NOTHING
+                    """, (days, [r[1] for r in claimed]))
+                conn.commit()
+            raise
+    finally:
+        try:
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (ROLLUP_LOCK_KEY,))
+            conn.commit()
+        except Exception:
+            pass  # a broken connection releases the lock when it is closed
+    return {"full_rebuild": full, "days_refreshed": len(days), "duration_ms": elapsed_ms}
+
+
+def _recompute_rollups(conn, days: list, full: bool, active: list):
+    """Replaces the rollup rows for `days` (every row when full) in the current transaction."""
+    finite = [date.fromisoformat(d) for d in days if d != "-infinity"]
+    with conn.cursor() as cur:
+        if full:
+            cur.execute("DELETE FROM dashboard_daily_rollup")
+            cur.execute("DELETE FROM dashboard_institution_rollup")
+            day_filter = "TRUE"
+        elif days:
+            cur.execute("DELETE FROM dashboard_daily_rollup WHERE day = ANY(%s::date[])", (days,))
+            cur.execute("DELETE FROM dashboard_institution_rollup WHERE day = ANY(%s::date[])", (days,))
+            clauses = []
+            if finite:
+                # Range first so an index on created_at can narrow the scan.
+                clauses.append(
+                    "(created_at >= %(lo)s AND created_at < %(hi)s::date + 1 AND created_at::date = ANY(%(days)s))"
+                )
+            if len(finite) < len(days):
+                clauses.append("created_at IS NULL")
+            day_filter = " OR ".join(clauses)
+        else:
+            return
+
+        params = {"active": active}
+        if not full and finite:
+            params.update({"lo": min(finite), "hi": max(finite), "days": finite})
+        for sql in _rollup_source_sql(f"({day_filter})"):
+            cur.execute(sql, params)
+
+
+ROLLUP_FRESHNESS_SQL = """
+    SELECT
+        s.last_refresh_at,
+        s.last_full_rebuild_at,
+        s.last_refresh_ms,
+        (SELECT COUNT(*) FROM dashboard_rollup_dirty) AS pending_days,
+        (SELECT MIN(marked_at) FROM dashboard_rollup_dirty) AS oldest_pending_at,
+        NOW()::timestamp AS db_now
+    FROM (SELECT 1) one
+    LEFT JOIN dashboard_rollup_state s ON s.id = 1
+"""
+
+
+def describe_freshness(row: Optional[dict], source: str) -> dict:
+    """Staleness metadata attached to rollup-backed responses."""
+    row = row or {}
+    now = row.get("db_now") or datetime.now()
+    oldest = row.get("oldest_pending_at")
+
+    def iso(v):
+        return v.isoformat() if v else None
+
+    return {
+        "source": source,
+        "refreshed_at": iso(row.get("last_refresh_at")),
+        "last_full_rebuild_at": iso(row.get("last_full_rebuild_at")),
+        "last_refresh_ms": row.get("last_refresh_ms"),
+        "pending_days": int(row.get("pending_days") or 0),
+        # How long the oldest unapplied change has been waiting (0 = fully current)
+        "stale_seconds": round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+    }
+
+
+def build_rollup_queries(timeframe: str = "all", from_date: str = None, to_date: str = None) -> dict:
+    """Same contract/row shapes as build_dashboard_queries(), served from the rollup tables."""
+    where, params = timeframe_clause(timeframe, from_date, to_date, column="day")
+
+    by_assignee = f"""
+        WITH u AS (
+            SELECT DISTINCT ON (name) name, role, branch
+            FROM users
+            ORDER BY name, id DESC
+        )
+        SELECT
+            r.assignee,
+            COALESCE(NULLIF(u.role, ''), 'Agent') AS role,
+            COALESCE(NULLIF(u.branch, ''), 'Unassigned') AS branch,
+            SUM(r.students) AS volume,
+            COALESCE(SUM(r.commission), 0) AS revenue,
+            COALESCE(SUM(r.students) FILTER (WHERE r.status = 'COMPLETED'), 0) AS completed,
+            COALESCE(SUM(r.students) FILTER (WHERE r.status = 'REJECTED'), 0) AS dropped,
+            COALESCE(SUM(r.commission) FILTER (WHERE r.status = 'COMPLETED'), 0) AS logged_commission,
+            COALESCE(SUM(r.commission) FILTER (WHERE r.status NOT IN ('COMPLETED', 'REJECTED')), 0) AS estimation_commission,
+            COALESCE(SUM(r.students) FILTER (WHERE r.qualified), 0) AS qualified,
+            COALESCE(SUM(r.active_applications), 0) AS active_applications
+        FROM dashboard_daily_rollup r
+        LEFT JOIN u ON u.name = r.assignee
+        WHERE {where}
+        GROUP BY 1, 2, 3
+    """
+
+    institutions = f"""
+        SELECT university AS name, SUM(active_applications) AS value
+        FROM dashboard_institution_rollup
+        WHERE {where}
+        GROUP BY 1
+        ORDER BY value DESC, name
+        LIMIT 5
+    """
+
+    growth = """
+        SELECT
+            COALESCE(SUM(students) FILTER (WHERE day > CURRENT_DATE - 30), 0) AS current_qualified,
+            COALESCE(SUM(students) FILTER (WHERE day <= CURRENT_DATE - 30), 0) AS prev_qualified
+        FROM dashboard_daily_rollup
+        WHERE qualified AND day > CURRENT_DATE - 60
+    """
+
+    return {
+        "by_assignee": (by_assignee, params),
+        "institutions": (institutions, params),
+        "growth": (growth, None),
+    }
+
+
+# Changes to student_applications dirty their student's created_at day, just
+# like writes to students do. (Installed by migration 16.)
+APPLICATIONS_ROLLUP_TRIGGER_SQL = f"""
+    CREATE OR REPLACE FUNCTION mark_application_rollup_dirty() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO dashboard_rollup_dirty (day)
+        SELECT COALESCE(created_at::date, {ROLLUP_NULL_DAY})
+        FROM students
+        WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.student_id ELSE NEW.student_id END
+        ON CONFLICT (day) DO NOTHING;
+        RETURN NULL;
+    END $$;
+
+    DROP TRIGGER IF EXISTS student_applications_rollup_dirty ON student_applications;
+    CREATE TRIGGER student_applications_rollup_dirty
+        AFTER INSERT OR DELETE OR UPDATE OF student_id, status, institution_id, university
+        ON student_applications
+        FOR EACH ROW EXECUTE FUNCTION mark_application_rollup_dirty();
+"""
+
+# Applications per status for each institution (or one, with %(institution_id)s
+# set): a GROUP BY on the (institution_id, status) index.
+INSTITUTION_FUNNEL_SQL = """
+    SELECT i.id AS institution_id, i.name, a.status::text AS status, COUNT(*) AS applications
+    FROM student_applications a
+    JOIN institutions i ON i.id = a.institution_id
+    WHERE %(institution_id)s::int IS NULL OR a.institution_id = %(institution_id)s::int
+    GROUP BY i.id, i.name, a.status
+    ORDER BY i.id, a.status
+"""
+
+
+def assemble_institution_funnels(rows: list) -> list:
+    """Folds INSTITUTION_FUNNEL_SQL rows into one entry per institution, busiest first."""
+    funnels = {}
+    for row in rows:
+        entry = funnels.setdefault(row["institution_id"], {
+            "institution_id": row["institution_id"],
+            "name": row["name"],
+            "total": 0,
+            "active": 0,
+            "by_status": {},
+        })
+        count = int(row["applications"])
+        entry["by_status"][row["status"]] = count
+        entry["total"] += count
+        if row["status"] in ACTIVE_APPLICATION_STATUSES:
+            entry["active"] += count
+    return sorted(funnels.values(), key=lambda f: (-f["total"], f["name"] or ""))
+
+
+ROLLUP_STATUS_COUNTS_SQL = """
+    SELECT
+        COALESCE(SUM(students) FILTER (WHERE status NOT IN ('ARCHIVED', 'COMPLETED', 'REJECTED')), 0) AS active_count,
+        COALESCE(SUM(students) FILTER (WHERE status = 'COMPLETED'), 0) AS completed_count,
+        COALESCE(SUM(students) FILTER (WHERE status = 'ARCHIVED'), 0) AS archived_count,
+        COALESCE(SUM(students), 0) AS total_count
+    FROM dashboard_daily_rollup
+"""
+
+
+def _is_counsellor(role: str) -> bool:
+    return role.upper() == "COUNSELLOR" or "counselor" in role.lower()
+
+
+def _top5(d: dict) -> list:
+    return [{"name": k, "value": v} for k, v in sorted(d.items(), key=lambda x: x[1], reverse=True)[:5]]
+
+
+def assemble_dashboard_stats(by_assignee: list, institutions: list, growth: dict) -> dict:
+    """Folds the query results into the `data` payload of /api/admin/dashboard-stats."""
+    metrics = {
+        "total_students": 0,
+        "in_progress": 0,
+        "completed": 0,
+        "dropped": 0,
+        "qualified_leads": 0,
+        "active_applications": 0,
+        "estimation_commission": 0.0,
+        "logged_commission": 0.0,
+    }
+    agent_volume, agent_revenue = {}, {}
+    counsellor_volume, counsellor_revenue = {}, {}
+    branch_pipeline = {}
+
+    for row in by_assignee:
+        volume = int(row["volume"])
+        metrics["total_students"] += volume
+        metrics["completed"] += int(row["completed"])
+        metrics["dropped"] += int(row["dropped"])
+        metrics["in_progress"] += volume - int(row["completed"]) - int(row["dropped"])
+        metrics["qualified_leads"] += int(row["qualified"])
+        metrics["active_applications"] += int(row["active_applications"])
+        metrics["estimation_commission"] += float(row["estimation_commission"])
+        metrics["logged_commission"] += float(row["logged_commission"])
+
+        name = row["assignee"]
+        if _is_counsellor(row["role"]):
+            volume_map, revenue_map = counsellor_volume, counsellor_revenue
+        else:
+            volume_map, revenue_map = agent_volume, agent_revenue
+        volume_map[name] = volume_map.get(name, 0) + volume
+        revenue_map[name] = revenue_map.get(name, 0.0) + float(row["revenue"])
+        branch_pipeline[row["branch"]] = branch_pipeline.get(row["branch"], 0) + volume
+
+    current_qualified = int((growth or {}).get("current_qualified") or 0)
+    prev_qualified = int((growth or {}).get("prev_qualified") or 0)
+    if prev_qualified > 0:
+        qualified_growth = round(((current_qualified - prev_qualified) / prev_qualified) * 100, 1)
+    elif current_qualified > 0:
+        qualified_growth = 100.0
+    else:
+        qualified_growth = 0.0
+
+    return {
+        "metrics": {
+            "total_students": metrics["total_students"],
+            "in_progress": metrics["in_progress"],
+            "completed": metrics["completed"],
+            "dropped": metrics["dropped"],
+            "qualified_leads": metrics["qualified_leads"],
+            "qualified_growth": qualified_growth,
+            "active_applications": metrics["active_applications"],
+            "estimation_commission": metrics["estimation_commission"],
+            "logged_commission": metrics["logged_commission"],
+            "total_business": metrics["logged_commission"],
+            "avg_days_to_close": 24
+        },
+        "performance": {
+            "top_agents_volume": _top5(agent_volume),
+            "top_agents_revenue": _top5(agent_revenue),
+            "top_counsellors_volume": _top5(counsellor_volume),
+            "top_counsellors_revenue": _top5(counsellor_revenue),
+            "top_institutions": [{"name": r["name"], "value": int(r["value"])} for r in institutions],
+            "branch_pipeline": [{"branch": k, "value": v} for k, v in sorted(branch_pipeline.items(), key=lambda x: x[1], reverse=True)]
+        }
+    }
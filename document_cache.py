@@ -0,0 +1,422 @@
+"""
+Streaming, range-capable reads of student-documents objects.
+
+/api/documents/{filename} used to download the whole object through the
+Supabase client into memory and return it as one Response. Large scanned
+PDFs were slow to first byte, and counsellors and the AI endpoints fetched
+the same files again and again. DocumentProxy.open() now:
+
+  1. resolves the object's current etag/size with a HEAD request. The
+     answer is remembered for DOC_ETAG_TTL_SECONDS, so a burst of reads
+     (e.g. a PDF viewer issuing Range requests) costs a single round-trip;
+  2. serves it from a bounded on-disk LRU cache keyed by (filename, etag)
+     when present. A new upload under the same name changes the etag, so
+     a stale copy is never served;
+  3. otherwise streams it from storage in DOC_STREAM_CHUNK_BYTES chunks,
+     writing a copy into the cache as it goes when the object is small
+     enough (DOC_CACHE_MAX_OBJECT_MB).
+
+Single `Range: bytes=...` requests get a 206, both from the cache and by
+passing the range upstream on a miss. A ranged miss also fetches the
+whole object into the cache in the background (DOC_CACHE_FILL_WORKERS at
+a time), so a PDF viewer's follow-up ranges are served from disk.
+Multi-range requests are answered with the full body, which RFC 9110
+allows.
+
+The cache directory is shared by every API process, so there is no
+in-memory index: a file's mtime is its last use, and eviction scans the
+directory under an exclusive lock on <root>/.lock, keeping the total
+under DOC_CACHE_MAX_MB however many workers write to it. A file another
+process evicts mid-read stays readable through the already-open handle.
+
+No FastAPI imports: main.py wraps the results in its responses, and
+bench.py can drive the proxy directly.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+from urllib.parse import quote
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: one process, the thread lock is enough
+    fcntl = None
+
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "fortrust-doc-cache")
+DOC_CACHE_MAX_MB = float(os.getenv("DOC_CACHE_MAX_MB", "512"))  # 0 disables the cache
+DOC_CACHE_MAX_OBJECT_MB = float(os.getenv("DOC_CACHE_MAX_OBJECT_MB", "50"))
+DOC_CACHE_FILL_WORKERS = int(os.getenv("DOC_CACHE_FILL_WORKERS", "2"))
+DOC_CACHE_PART_MAX_AGE_SECONDS = 3600  # older .part- files were left by a crashed writer
+DOC_STREAM_CHUNK_BYTES = int(os.getenv("DOC_STREAM_CHUNK_BYTES", str(256 * 1024)))
+DOC_ETAG_TTL_SECONDS = float(os.getenv("DOC_ETAG_TTL_SECONDS", "30"))
+DOC_STORAGE_TIMEOUT_SECONDS = float(os.getenv("DOC_STORAGE_TIMEOUT_SECONDS", "30"))
+
+
+class DocumentNotFound(Exception):
+    pass
+
+
+class RangeNotSatisfiable(Exception):
+    def __init__(self, size: int):
+        super().__init__(f"range not satisfiable for {size} bytes")
+        self.size = size
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    (start, end) inclusive for a single `bytes=` range, or None to serve the
+    whole body (no header, multiple ranges, other units, bad syntax).
+    Raises RangeNotSatisfiable when the range lies outside the object.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(size)
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(size)
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+# =====================================================================
+# --- ON-DISK LRU ---
+# =====================================================================
+class DocumentCache:
+    """
+    Bounded LRU of object bodies on disk, laid out as
+    <root>/<sha(filename)>/<sha(etag)> so every version of a filename can
+    be dropped at once. Safe to share between threads and processes.
+    """
+
+    LOCK_FILE = ".lock"
+
+    def __init__(self, root: str = DOC_CACHE_DIR, max_bytes: int = int(DOC_CACHE_MAX_MB * 1024 * 1024)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+            self._evict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _dir(filename: str) -> str:
+        return hashlib.sha256(filename.encode()).hexdigest()[:32]
+
+    def _relpath(self, filename: str, etag: str) -> str:
+        return os.path.join(self._dir(filename), hashlib.sha256(etag.encode()).hexdigest()[:32])
+
+    def _count(self, stat: str, n: int = 1):
+        with self._lock:
+            self._stats[stat] += n
+
+    @contextmanager
+    def _dir_lock(self):
+        """Exclusive lock on the cache directory, across threads and processes."""
+        if fcntl is None:
+            with self._lock:
+                yield
+            return
+        with open(os.path.join(self.root, self.LOCK_FILE), "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            yield  # closing the file releases the flock
+
+    def _scan(self) -> tuple:
+        """([(mtime, path, size), ...] of committed bodies, bytes on disk including partial writes)."""
+        entries, total = [], 0
+        now = time.time()
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith("."):
+                    if now - st.st_mtime > DOC_CACHE_PART_MAX_AGE_SECONDS:
+                        _unlink(entry.path)
+                    else:
+                        total += st.st_size  # in-flight write: counts, but isn't ours to evict
+                    continue
+                entries.append((st.st_mtime, entry.path, st.st_size))
+                total += st.st_size
+        return entries, total
+
+    def _evict(self):
+        """Deletes least recently used bodies until the directory fits max_bytes."""
+        with self._dir_lock():
+            entries, total = self._scan()
+            evicted = 0
+            for _, path, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                _unlink(path)
+                total -= size
+                evicted += 1
+        if evicted:
+            self._count("evictions", evicted)
+
+    def get(self, filename: str, etag: str) -> Optional[str]:
+        """Path of the cached body, marking it recently used, or None."""
+        if not self.enabled:
+            return None
+        path = os.path.join(self.root, self._relpath(filename, etag))
+        try:
+            os.utime(path)  # mtime is the LRU clock
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return path
+
+    def writer(self, filename: str, etag: str) -> "CacheWriter":
+        return CacheWriter(self, filename, etag)
+
+    def _commit(self, filename: str, etag: str, tmp_path: str, size: int):
+        os.replace(tmp_path, os.path.join(self.root, self._relpath(filename, etag)))
+        self._count("stores")
+        self._evict()
+
+    def invalidate(self, filename: str):
+        """Drops every cached version of filename (after a delete)."""
+        if not self.enabled:
+            return
+        with self._dir_lock():
+            shutil.rmtree(os.path.join(self.root, self._dir(filename)), ignore_errors=True)
+
+    def stats(self) -> dict:
+        entries, total = self._scan() if self.enabled else ([], 0)
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(entries),
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "root": self.root,
+            }
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class CacheWriter:
+    """Accumulates a body in a hidden temp file; commit() publishes it, abort() discards it."""
+
+    def __init__(self, cache: DocumentCache, filename: str, etag: str):
+        self.cache = cache
+        self.filename = filename
+        self.etag = etag
+        subdir = os.path.join(cache.root, cache._dir(filename))
+        os.makedirs(subdir, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".part-", dir=subdir)
+        self._out = os.fdopen(fd, "wb")
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self._out.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        self._out.close()
+        self.cache._commit(self.filename, self.etag, self.tmp_path, self.size)
+
+    def abort(self):
+        self._out.close()
+        _unlink(self.tmp_path)
+
+
+# =====================================================================
+# --- STORAGE + PROXY ---
+# =====================================================================
+class StorageObjects:
+    """Minimal Supabase Storage REST client: HEAD and streaming GET with Range."""
+
+    def __init__(self, supabase_url: str, service_key: str, bucket: str,
+                 timeout: float = DOC_STORAGE_TIMEOUT_SECONDS):
+        self.base = f"{supabase_url.rstrip('/')}/storage/v1/object/authenticated/{bucket}/"
+        self.headers = {"Authorization": f"Bearer {service_key}", "apikey": service_key}
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _url(self, filename: str) -> str:
+        return self.base + quote(filename)
+
+    def head(self, filename: str) -> dict:
+        res = self.session.head(self._url(filename), headers=self.headers, timeout=self.timeout)
+        if res.status_code in (400, 404):
+            raise DocumentNotFound(filename)
+        res.raise_for_status()
+        return {
+            "etag": (res.headers.get("ETag") or "").strip('"') or res.headers.get("Last-Modified", ""),
+            "size": int(res.headers.get("Content-Length") or 0),
+        }
+
+    def get(self, filename: str, byte_range: Optional[tuple] = None) -> requests.Response:
+        headers = dict(self.headers)
+        if byte_range:
+            headers["Range"] = f"bytes={byte_range[0]}-{byte_range[1]}"
+        res = self.session.get(self._url(filename), headers=headers, stream=True, timeout=self.timeout)
+        if res.status_code in (400, 404):
+            res.close()
+            raise DocumentNotFound(filename)
+        res.raise_for_status()
+        return res
+
+
+class ServedDocument:
+    """What the proxy hands back: status, size/range headers and a body iterator."""
+
+    def __init__(self, status: int, size: int, byte_range: Optional[tuple], body: Iterator[bytes], source: str):
+        self.status = status
+        self.size = size
+        self.byte_range = byte_range
+        self.body = body
+        self.source = source  # "cache" | "storage"
+
+    @property
+    def headers(self) -> dict:
+        headers = {"Accept-Ranges": "bytes"}
+        if self.byte_range:
+            start, end = self.byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{self.size}"
+            headers["Content-Length"] = str(end - start + 1)
+        else:
+            headers["Content-Length"] = str(self.size)
+        return headers
+
+
+def _file_chunks(path: str, start: int, length: int, chunk_size: int) -> Iterator[bytes]:
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+class DocumentProxy:
+    """Ties StorageObjects and DocumentCache together; see the module docstring."""
+
+    def __init__(self, storage: StorageObjects, cache: DocumentCache,
+                 max_object_bytes: int = int(DOC_CACHE_MAX_OBJECT_MB * 1024 * 1024),
+                 chunk_size: int = DOC_STREAM_CHUNK_BYTES, etag_ttl: float = DOC_ETAG_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.storage = storage
+        self.cache = cache
+        self.max_object_bytes = max_object_bytes
+        self.chunk_size = chunk_size
+        self.etag_ttl = etag_ttl
+        self.clock = clock
+        self._meta = {}  # filename -> (checked_at, {"etag", "size"})
+        self._meta_lock = threading.Lock()
+        self._filling = set()  # (filename, etag) being fetched in the background
+        self._fill_pool = ThreadPoolExecutor(max_workers=max(1, DOC_CACHE_FILL_WORKERS),
+                                             thread_name_prefix="doc-cache-fill")
+
+    def _object_info(self, filename: str) -> dict:
+        now = self.clock()
+        with self._meta_lock:
+            hit = self._meta.get(filename)
+        if hit and now - hit[0] < self.etag_ttl:
+            return hit[1]
+        info = self.storage.head(filename)
+        with self._meta_lock:
+            self._meta[filename] = (now, info)
+        return info
+
+    def forget(self, filename: str):
+        """Call after deleting or replacing an object."""
+        with self._meta_lock:
+            self._meta.pop(filename, None)
+        self.cache.invalidate(filename)
+
+    def open(self, filename: str, range_header: Optional[str] = None) -> ServedDocument:
+        """Raises DocumentNotFound / RangeNotSatisfiable; the body streams lazily."""
+        info = self._object_info(filename)
+        size, etag = info["size"], info["etag"]
+        byte_range = parse_range(range_header, size)
+        status = 206 if byte_range else 200
+        start, end = byte_range or (0, size - 1)
+
+        cached = self.cache.get(filename, etag) if etag else None
+        if cached:
+            body = _file_chunks(cached, start, end - start + 1, self.chunk_size)
+            return ServedDocument(status, size, byte_range, body, "cache")
+
+        upstream = self.storage.get(filename, byte_range)
+        cacheable = etag and self.cache.enabled and 0 < size <= self.max_object_bytes
+        if cacheable and byte_range:
+            self._fill_in_background(filename, etag)
+        body = self._stream(upstream, filename, etag if cacheable and not byte_range else None)
+        return ServedDocument(status, size, byte_range, body, "storage")
+
+    def _fill_in_background(self, filename: str, etag: str):
+        key = (filename, etag)
+        with self._meta_lock:
+            if key in self._filling:
+                return
+            self._filling.add(key)
+        self._fill_pool.submit(self._fill, filename, etag)
+
+    def _fill(self, filename: str, etag: str):
+        try:
+            for _ in self._stream(self.storage.get(filename), filename, etag):
+                pass
+        except Exception as e:
+            print(f"[doc-cache] background fill of {filename} failed: {e}")
+        finally:
+            with self._meta_lock:
+                self._filling.discard((filename, etag))
+
+    def _stream(self, upstream: requests.Response, filename: str, etag: Optional[str]) -> Iterator[bytes]:
+        writer = self.cache.writer(filename, etag) if etag else None
+        complete = False
+        try:
+            for chunk in upstream.iter_content(chunk_size=self.chunk_size):
+                if writer:
+                    writer.write(chunk)
+                yield chunk
+            complete = True
+        finally:
+            upstream.close()
+            if writer:
+                # A client that disconnects mid-download leaves a partial body; drop it.
+                if complete:
+                    writer.commit()
+                else:
+                    writer.abort()
+
+    def read_bytes(self, filename: str) -> bytes:
+        """Whole object as bytes (document_pipeline downloads), filling the cache on a miss."""
+        return b"".join(self.open(filename).body)
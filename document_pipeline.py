@@ -0,0 +1,481 @@
+"""
+Concurrent fetch + extraction for a student's documents.
+
+The AI strategy report and the application-form auto-fill both need every
+document a student uploaded. Fetching them one after another paid one
+Supabase round-trip per file, and PyPDF2 then parsed each one on the
+request thread. Now:
+
+  1. fetch: downloads run on a bounded thread pool (DOC_FETCH_CONCURRENCY),
+     because they are I/O-bound;
+  2. extract: each PDF is handed to a shared process pool
+     (DOC_EXTRACT_PROCESSES) as soon as its download lands, so parsing
+     overlaps with the remaining downloads and is CPU-bound off the GIL.
+     Submissions take one of DOC_EXTRACT_PROCESSES slots, shared by every
+     request, so nothing queues inside the pool: a submitted PDF is being
+     parsed, and the rest wait their turn in the caller.
+
+Every document gets its own deadline per stage (DOC_FETCH_TIMEOUT_SECONDS,
+DOC_EXTRACT_TIMEOUT_SECONDS). A slow or broken file is reported in
+`failures` rather than failing the whole batch. A running pool task can't
+be cancelled, so a timed-out extraction recycles the pool: its workers
+are killed and the next submission starts a fresh one. Extractions that
+were running alongside it are resubmitted once. A timed-out download
+can't be interrupted; its thread finishes in the background and the
+result is discarded.
+
+Extraction results are persisted in `document_extractions`, one row per
+storage filename, holding the content hash, per-page text, page count,
+method and a no-text (scanned) flag. Uploads write the row once.
+Consumers pass the stored rows as `known=`; a file whose bytes still hash
+to the stored value isn't parsed again.
+
+No FastAPI or Supabase imports: callers pass a `download(filename) -> bytes`
+function, which keeps the module usable from bench.py.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from psycopg2.extras import RealDictCursor
+
+DOC_FETCH_CONCURRENCY = int(os.getenv("DOC_FETCH_CONCURRENCY", "6"))
+DOC_FETCH_TIMEOUT_SECONDS = float(os.getenv("DOC_FETCH_TIMEOUT_SECONDS", "30"))
+DOC_EXTRACT_PROCESSES = int(os.getenv("DOC_EXTRACT_PROCESSES", str(min(4, os.cpu_count() or 1))))
+DOC_EXTRACT_TIMEOUT_SECONDS = float(os.getenv("DOC_EXTRACT_TIMEOUT_SECONDS", "20"))
+
+# Extension -> MIME type Gemini accepts as an attachment.
+SUPPORTED_MEDIA = {
+    ".pdf":  "application/pdf",
+    ".jpg":  "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png":  "image/png",
+    ".webp": "image/webp",
+    ".heic": "image/heic",
+    ".heif": "image/heif",
+}
+
+
+def media_type_for(filename: str) -> Optional[str]:
+    ext = "." + filename.lower().rsplit(".", 1)[-1] if "." in filename else ""
+    return SUPPORTED_MEDIA.get(ext)
+
+
+def extract_pdf_text(file_bytes: bytes) -> str:
+    """Text of every readable page. Runs in a worker process, so it must stay top-level."""
+    return extraction_text(extract_document(file_bytes, "application/pdf"))
+
+
+def extract_document(file_bytes: bytes, mime_type: str) -> dict:
+    """
+    One document_extractions record for `file_bytes`. PDFs are parsed page
+    by page with PyPDF2; other types only get hash and size. Never raises:
+    a PDF PyPDF2 can't open comes back with method "failed" and `error`.
+    Top-level so it can run in the extraction process pool.
+    """
+    return _extract(io.BytesIO(file_bytes), mime_type,
+                    hashlib.sha256(file_bytes).hexdigest(), len(file_bytes))
+
+
+def extract_document_file(path: str, mime_type: str, content_sha256: str, byte_size: int) -> dict:
+    """
+    Same, reading a file on disk (a spooled upload) whose hash and size
+    are already known, so the bytes never pass through the caller's memory.
+    """
+    with open(path, "rb") as stream:
+        return _extract(stream, mime_type, content_sha256, byte_size)
+
+
+def _new_record(content_sha256: str, mime_type: str, byte_size: int) -> dict:
+    return {
+        "content_sha256": content_sha256,
+        "mime_type": mime_type,
+        "byte_size": byte_size,
+        "page_count": 0,
+        "pages": [],
+        "method": "none",
+        "has_text": False,
+        "error": None,
+    }
+
+
+def _extract(stream, mime_type: str, content_sha256: str, byte_size: int) -> dict:
+    record = _new_record(content_sha256, mime_type, byte_size)
+    if mime_type != "application/pdf":
+        return record
+
+    try:
+        import PyPDF2
+
+        reader = PyPDF2.PdfReader(stream)
+        pages = []
+        for page in reader.pages:
+            try:
+                pages.append(page.extract_text() or "")
+            except Exception:
+                pages.append("")
+        record.update(
+            method="pypdf2",
+            page_count=len(pages),
+            pages=pages,
+            has_text=any(t.strip() for t in pages),
+        )
+    except Exception as e:
+        record.update(method="failed", error=str(e) or type(e).__name__)
+    return record
+
+
+def extraction_text(record: Optional[dict]) -> str:
+    """Non-empty pages joined, i.e. what used to go into students.pdf_text."""
+    if not record:
+        return ""
+    return "\n".join(t for t in record.get("pages") or [] if t.strip()).strip()
+
+
+async def extract_file_async(path: str, mime_type: str, content_sha256: str, byte_size: int,
+                             timeout: float = DOC_EXTRACT_TIMEOUT_SECONDS) -> dict:
+    """
+    extract_document_file() on the shared process pool, for async upload
+    handlers. A timeout or a crashed worker comes back as a "failed" record.
+    Without a pool the PDF is parsed in a thread, never on the event loop.
+    """
+    args = (path, mime_type, content_sha256, byte_size)
+    if mime_type != "application/pdf":
+        return extract_document_file(*args)  # no parsing: a "none" record
+    if DOC_EXTRACT_PROCESSES <= 0:
+        return await asyncio.to_thread(extract_document_file, *args)
+    error = None
+    for _ in range(2):  # once more if another extraction's timeout recycled the pool
+        try:
+            pool, future = await asyncio.to_thread(_submit_extraction, extract_document_file, *args)
+        except (BrokenProcessPool, RuntimeError):
+            return await asyncio.to_thread(extract_document_file, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            _recycle_extract_pool(pool)
+            error = f"extraction timed out after {timeout:g}s"
+            break
+        except BrokenProcessPool as e:
+            error = f"extraction worker crashed: {e}"
+    record = _new_record(content_sha256, mime_type, byte_size)
+    record.update(method="failed", error=error)
+    return record
+
+
+# =====================================================================
+# --- document_extractions ---
+# =====================================================================
+DOCUMENT_EXTRACTIONS_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS document_extractions (
+        filename TEXT PRIMARY KEY,
+        content_sha256 TEXT NOT NULL,
+        student_id INTEGER,
+        mime_type TEXT,
+        byte_size BIGINT NOT NULL,
+        page_count INTEGER NOT NULL DEFAULT 0,
+        pages JSONB NOT NULL DEFAULT '[]'::jsonb,
+        method TEXT NOT NULL,
+        has_text BOOLEAN NOT NULL DEFAULT FALSE,
+        error TEXT,
+        extracted_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_document_extractions_student
+        ON document_extractions (student_id);
+    CREATE INDEX IF NOT EXISTS idx_document_extractions_sha
+        ON document_extractions (content_sha256);
+"""
+
+
+def save_extraction(conn, filename: str, record: dict, student_id: int = None):
+    """Upserts the record for a storage filename. Doesn't commit."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO document_extractions
+                (filename, content_sha256, student_id, mime_type, byte_size,
+                 page_count, pages, method, has_text, error)
+            VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s, %s)
+            ON CONFLICT (filename) DO UPDATE
+            SET content_sha256 = EXCLUDED.content_sha256,
+                student_id = COALESCE(EXCLUDED.student_id, document_extractions.student_id),
+                mime_type = EXCLUDED.mime_type,
+                byte_size = EXCLUDED.byte_size,
+                page_count = EXCLUDED.page_count,
+                pages = EXCLUDED.pages,
+                method = EXCLUDED.method,
+                has_text = EXCLUDED.has_text,
+                error = EXCLUDED.error,
+                extracted_at = NOW()
+        """, (
+            filename, record["content_sha256"], student_id, record["mime_type"],
+            record["byte_size"], record["page_count"], json.dumps(record["pages"]),
+            record["method"], record["has_text"], record["error"],
+        ))
+
+
+def load_extractions(conn, filenames: list) -> dict:
+    """{filename: record} for the filenames that have one."""
+    if not filenames:
+        return {}
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT filename, content_sha256, mime_type, byte_size, page_count,
+                   pages, method, has_text, error
+            FROM document_extractions
+            WHERE filename = ANY(%s)
+        """, (list(filenames),))
+        return {row.pop("filename"): dict(row) for row in cur.fetchall()}
+
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+# One slot per pool worker, shared by every request in the process.
+_extract_slots = threading.BoundedSemaphore(max(1, DOC_EXTRACT_PROCESSES))
+
+
+def _get_extract_pool():
+    """
+    Process pool shared by all requests; created on first use. "spawn"
+    rather than fork: the API process has DB pool and worker threads that
+    a forked child would inherit in whatever state they were in.
+    """
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None and DOC_EXTRACT_PROCESSES > 0:
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=DOC_EXTRACT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _extract_pool
+
+
+def _recycle_extract_pool(pool):
+    """
+    Kills `pool`'s workers so a hung parse stops using CPU, and drops the
+    pool so the next submission starts a fresh one. Whatever else was
+    running on it fails with BrokenProcessPool.
+    """
+    global _extract_pool
+    if pool is None:
+        return
+    with _extract_pool_lock:
+        if _extract_pool is pool:
+            _extract_pool = None
+    terminate = getattr(pool, "terminate_workers", None)  # Python 3.14+
+    if terminate is not None:
+        terminate()
+        return
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit_extraction(fn, *args, block: bool = True):
+    """
+    Submits fn(*args) to the pool once an extraction slot is free and
+    returns (pool, future); the slot is released when the future is done.
+    With block=False, returns None instead of waiting for a slot.
+    """
+    if not _extract_slots.acquire(blocking=block):
+        return None
+    pool = _get_extract_pool()
+    try:
+        future = pool.submit(fn, *args)
+    except BaseException:
+        _extract_slots.release()
+        _recycle_extract_pool(pool)
+        raise
+    future.add_done_callback(lambda _: _extract_slots.release())
+    return pool, future
+
+
+def fetch_and_extract(
+    docs: list,
+    download: Callable[[str], bytes],
+    extract_text: bool = True,
+    max_bytes: Optional[int] = None,
+    fetch_concurrency: int = DOC_FETCH_CONCURRENCY,
+    fetch_timeout: float = DOC_FETCH_TIMEOUT_SECONDS,
+    extract_timeout: float = DOC_EXTRACT_TIMEOUT_SECONDS,
+    known: Optional[dict] = None,
+    extractor: Callable[[bytes, str], dict] = extract_document,
+) -> dict:
+    """
+    Downloads (and, for PDFs, text-extracts) `docs` -- student_documents
+    entries as list_documents() returns them, i.e. {"filename", "title", ...}. Unsupported
+    types are skipped silently, as before.
+
+    Returns:
+        {
+          "documents": [{"doc", "filename", "label", "mime_type", "bytes",
+                         "extraction", "from_store", "text", "text_error"}, ...],   # input order
+          "failures":  [{"filename", "label", "stage", "error"}, ...],  # stage: fetch | extract
+          "elapsed_ms": float,
+        }
+    "extraction" is the document_extractions record. It comes from `known`
+    (from_store=True) when the downloaded bytes still match its hash, and
+    is freshly extracted otherwise; it is None when extract_text=False.
+    "text" is the joined page text. A file whose extraction fails is still
+    returned (Gemini can read the raw bytes) with "text_error" set, and is
+    also listed in failures.
+    """
+    known = known or {}
+    started = time.perf_counter()
+    wanted = []
+    for doc in docs:
+        filename = doc.get("filename")
+        if not filename:
+            continue
+        mime_type = media_type_for(filename)
+        if not mime_type:
+            continue
+        wanted.append({
+            "doc": doc,
+            "filename": filename,
+            "label": doc.get("title") or filename,
+            "mime_type": mime_type,
+            "bytes": None,
+            "extraction": None,
+            "from_store": False,
+            "text": None,
+            "text_error": None,
+        })
+
+    failures = []
+    if not wanted:
+        return {"documents": [], "failures": failures, "elapsed_ms": 0.0}
+
+    def fail(item, stage, error):
+        failures.append({"filename": item["filename"], "label": item["label"], "stage": stage, "error": error})
+        item["failed"] = True
+
+    def timed_download(item):
+        item["fetch_started"] = time.monotonic()
+        return download(item["filename"])
+
+    fetch_pool = ThreadPoolExecutor(max_workers=max(1, fetch_concurrency), thread_name_prefix="doc-fetch")
+    use_pool = extract_text and DOC_EXTRACT_PROCESSES > 0
+    fetching = {fetch_pool.submit(timed_download, item): item for item in wanted}
+    waiting = deque()  # PDFs waiting for an extraction slot
+    extracting = {}  # future -> (item, pool, submitted_at)
+
+    def set_extraction(item, record, from_store=False):
+        item["extraction"] = record
+        item["from_store"] = from_store
+        item["text"] = extraction_text(record)
+        item["text_error"] = record.get("error")
+
+    def extract_inline(item):
+        try:
+            set_extraction(item, extractor(item["bytes"], item["mime_type"]))
+        except Exception as e:
+            item["text_error"] = str(e) or type(e).__name__
+
+    def start_extraction(item):
+        stored = known.get(item["filename"])
+        if stored and stored.get("content_sha256") == hashlib.sha256(item["bytes"]).hexdigest():
+            set_extraction(item, stored, from_store=True)
+        elif use_pool and item["mime_type"] == "application/pdf":
+            waiting.append(item)
+        else:
+            extract_inline(item)
+
+    def submit_waiting():
+        nonlocal use_pool
+        while waiting and use_pool:
+            item = waiting[0]
+            try:
+                submitted = _submit_extraction(extractor, item["bytes"], item["mime_type"], block=False)
+            except (BrokenProcessPool, RuntimeError) as e:
+                print(f"[doc-pipeline] extraction pool unavailable, parsing inline: {e}")
+                use_pool = False
+                break
+            if submitted is None:
+                return
+            waiting.popleft()
+            pool, future = submitted
+            extracting[future] = (item, pool, time.monotonic())
+        while waiting:
+            extract_inline(waiting.popleft())
+
+    try:
+        while fetching or waiting or extracting:
+            submit_waiting()
+            done, _ = wait(list(fetching) + list(extracting), timeout=0.1, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+
+            for future in done:
+                if future in fetching:
+                    item = fetching.pop(future)
+                    try:
+                        file_bytes = future.result()
+                    except Exception as e:
+                        fail(item, "fetch", str(e) or type(e).__name__)
+                        continue
+                    if not file_bytes:
+                        fail(item, "fetch", "empty file")
+                        continue
+                    if max_bytes and len(file_bytes) > max_bytes:
+                        fail(item, "fetch", f"{len(file_bytes):,} bytes exceeds the {max_bytes:,} byte limit")
+                        continue
+                    item["bytes"] = file_bytes
+                    if extract_text:
+                        start_extraction(item)
+                else:
+                    item, _, _ = extracting.pop(future)
+                    try:
+                        set_extraction(item, future.result())
+                    except BrokenProcessPool as e:
+                        # Usually another extraction's timeout recycling the pool.
+                        if item.pop("resubmitted", False):
+                            item["text_error"] = f"extraction worker crashed: {e}"
+                        else:
+                            item["resubmitted"] = True
+                            waiting.append(item)
+                    except Exception as e:
+                        item["text_error"] = str(e) or type(e).__name__
+
+            # Per-document deadlines: a download's clock starts when a
+            # fetch thread picks it up, an extraction's when it gets a slot.
+            # A timed-out extraction is still running, so its pool is
+            # recycled to stop it.
+            for future, item in list(fetching.items()):
+                begun = item.get("fetch_started")
+                if begun is not None and now - begun > fetch_timeout:
+                    future.cancel()
+                    fetching.pop(future)
+                    fail(item, "fetch", f"timed out after {fetch_timeout:g}s")
+            for future, (item, pool, submitted) in list(extracting.items()):
+                if future in extracting and now - submitted > extract_timeout:
+                    extracting.pop(future)
+                    item["text_error"] = f"extraction timed out after {extract_timeout:g}s"
+                    _recycle_extract_pool(pool)
+    finally:
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+
+    documents = [item for item in wanted if not item.get("failed")]
+    for item in wanted:
+        item.pop("failed", None)
+        item.pop("fetch_started", None)
+        item.pop("resubmitted", None)
+    for item in documents:
+        if item["text_error"]:
+            failures.append({"filename": item["filename"], "label": item["label"],
+                             "stage": "extract", "error": item["text_error"]})
+    return {
+        "documents": documents,
+        "failures": failures,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
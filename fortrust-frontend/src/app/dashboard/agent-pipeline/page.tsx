@@ -10,6 +10,7 @@ import {
   Archive, RefreshCcw, Phone, Landmark, Percent, Building, FileText, LogIn, Network, Loader2, ArrowRight, Timer,
   Megaphone
 } from "lucide-react";
+import { fetchAllPipeline } from "@/lib/pipeline";
 
 const BRANCH_OPTIONS = ["Jakarta", "Surabaya", "Bandung", "Bali", "Medan", "Headquarters"];
 const ROLE_OPTIONS = ["Corporate Agent", "Individual Agent", "Student Counselor", "MASTER_ADMIN", "Team Manager"];
@@ -124,14 +125,13 @@ export default function AgentManagement() {
     const headers = { "Authorization": `Bearer ${token}` };
 
     try {
-      const [usersRes, studentsRes, logsRes] = await Promise.all([
+      const [usersRes, studentsData, logsRes] = await Promise.all([
         fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/users`, { headers }),
-        fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/pipeline?role=MASTER_ADMIN`, { headers }),
+        fetchAllPipeline(token),
         fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/admin/audit-logs`, { headers })
       ]);
       
       const usersData = await usersRes.json();
-      const studentsData = await studentsRes.json();
       const logsData = await logsRes.json();
 
       if (usersData.status === "success") setSystemUsers(usersData.data);
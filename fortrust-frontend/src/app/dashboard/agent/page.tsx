@@ -6,6 +6,7 @@ import {
   Target, Users, DollarSign, TrendingUp, GraduationCap, Search,
   Loader2, ArrowRight, Sparkles, FileText, ChevronRight, Award, Globe
 } from "lucide-react";
+import { fetchAllPipeline } from "@/lib/pipeline";
 
 export default function AgentWorkspacePage() {
   const [user, setUser] = useState<any>(null);
@@ -30,11 +31,7 @@ export default function AgentWorkspacePage() {
     setLoading(true);
     try {
       const token = localStorage.getItem("fortrust_token");
-      const res = await fetch(
-        `${process.env.NEXT_PUBLIC_API_URL}/api/pipeline?role=${u.role}&agent_code=${encodeURIComponent(u.name)}`,
-        { headers: { Authorization: `Bearer ${token}` } }
-      );
-      const data = await res.json();
+      const data = await fetchAllPipeline(token);
       if (data.status === "success") setMyStudents(data.data || []);
     } catch (e) { console.error(e); }
     finally { setLoading(false); }
@@ -152,6 +152,7 @@ export default function DashboardLayout({ children }: { children: ReactNode }) {
   }, []);
  
   useEffect(() => {
+    let lastId = 0;
     const fetchNotifications = async () => {
       const token = localStorage.getItem("fortrust_token");
       if (!token) return;
@@ -163,14 +164,49 @@ export default function DashboardLayout({ children }: { children: ReactNode }) {
         if (data.status === "success") {
           setNotifications(data.data);
           setUnreadCount(data.data.length);
+          lastId = data.data.reduce((max: number, n: any) => Math.max(max, Number(n.id) || 0), lastId);
         }
       } catch (error) {}
     };
  
     if (isLoaded && user) {
-      fetchNotifications();
-      const interval = setInterval(fetchNotifications, 10000);
-      return () => clearInterval(interval);
+      // New notifications are pushed over SSE; poll only if the stream can't be used.
+      let cancelled = false;
+      let source: EventSource | null = null;
+      let interval: NodeJS.Timeout | null = null;
+      const startPolling = () => {
+        if (!cancelled && !interval) interval = setInterval(fetchNotifications, 10000);
+      };
+
+      fetchNotifications().then(() => {
+        const token = localStorage.getItem("fortrust_token");
+        if (cancelled || !token) return;
+        if (typeof EventSource === "undefined") {
+          startPolling();
+          return;
+        }
+        source = new EventSource(
+          `${process.env.NEXT_PUBLIC_API_URL}/api/notifications/stream?after_id=${lastId}&access_token=${encodeURIComponent(token)}`
+        );
+        source.addEventListener("notification", (e) => {
+          const note = JSON.parse((e as MessageEvent).data);
+          setNotifications((prev: any[]) => prev.some((n) => n.id === note.id) ? prev : [note, ...prev]);
+          setUnreadCount((c: number) => c + 1);
+        });
+        source.addEventListener("unavailable", () => {
+          source?.close();
+          startPolling();
+        });
+        source.onerror = () => {
+          if (source?.readyState === EventSource.CLOSED) startPolling();
+        };
+      });
+
+      return () => {
+        cancelled = true;
+        source?.close();
+        if (interval) clearInterval(interval);
+      };
     }
   }, [isLoaded, user]);
   useEffect(() => {
@@ -7,6 +7,7 @@ import {
   AlertCircle, Search, Filter, Globe2, Copy, QrCode,
   Network, Link as LinkIcon, Megaphone
 } from "lucide-react";
+import { fetchAllPipeline } from "@/lib/pipeline";
 
 export default function LeadsMarketingHub() {
   const [activeTab, setActiveTab] = useState<"routing" | "import" | "entry">("routing");
@@ -25,7 +26,7 @@ export default function LeadsMarketingHub() {
   const [file, setFile] = useState<File | null>(null);
   const [fileError, setFileError] = useState("");
   const [isUploading, setIsUploading] = useState(false);
-  const [uploadResult, setUploadResult] = useState<{status: string, message: string} | null>(null);
+  const [uploadResult, setUploadResult] = useState<{status: string, message: string, errors?: {row: number, field: string, message: string}[]} | null>(null);
 
   // QR Code State
   const [showQR, setShowQR] = useState(false);
@@ -48,10 +49,7 @@ export default function LeadsMarketingHub() {
     setIsLoading(true);
     try {
       const token = localStorage.getItem("fortrust_token");
-      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/pipeline?role=MASTER_ADMIN`, {
-        headers: { "Authorization": `Bearer ${token}` }
-      });
-      const data = await res.json();
+      const data = await fetchAllPipeline(token);
       if (data.status === "success") {
         setLeads(data.data);
       }
@@ -113,8 +111,8 @@ export default function LeadsMarketingHub() {
       setFileError("Invalid format. Please upload an Excel (.xlsx) or CSV file.");
       return;
     }
-    if (selectedFile.size > 10 * 1024 * 1024) {
-      setFileError("File is too large. Maximum size is 10MB.");
+    if (selectedFile.size > 25 * 1024 * 1024) {
+      setFileError("File is too large. Maximum size is 25MB.");
       return;
     }
     setFile(selectedFile);
@@ -145,7 +143,7 @@ export default function LeadsMarketingHub() {
       });
       const result = await res.json();
       if (res.ok) {
-        setUploadResult({ status: "success", message: result.message });
+        setUploadResult({ status: "success", message: result.message, errors: result.report?.errors });
         setFile(null); 
         fetchLeads(); 
       } else {
@@ -394,6 +392,14 @@ export default function LeadsMarketingHub() {
               {uploadResult && (
                 <div className="p-4 bg-emerald-50 text-emerald-700 rounded-xl border border-emerald-200 text-center">
                   <p className="text-sm font-bold">{uploadResult.message}</p>
+                  {uploadResult.errors && uploadResult.errors.length > 0 && (
+                    <ul className="mt-2 text-xs text-left text-amber-700 space-y-0.5">
+                      {uploadResult.errors.slice(0, 5).map((err, i) => (
+                        <li key={i}>Row {err.row}: {err.message}</li>
+                      ))}
+                      {uploadResult.errors.length > 5 && <li>…and {uploadResult.errors.length - 5} more</li>}
+                    </ul>
+                  )}
                 </div>
               )}
               
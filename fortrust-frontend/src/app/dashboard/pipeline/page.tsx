@@ -3,6 +3,7 @@
 import { useState, useEffect } from "react";
 import { useRouter } from "next/navigation";
 import { X, AlertTriangle, Loader2, ArrowRight, User, Mail, Thermometer, MapPin, Target, Trophy, Medal, TrendingUp, Eye } from "lucide-react";
+import { fetchAllPipeline } from "@/lib/pipeline";
 
 // Pipeline Configuration
 const PIPELINE_STAGES = ["NEW LEAD", "QUALIFIED", "CONSULTING", "APPLICATION", "VISA", "COMPLETED", "DROPPED"];
@@ -41,16 +42,9 @@ export default function StudentPipeline() {
       const storedUser = localStorage.getItem("fortrust_user");
       
       if (!storedUser) return;
-      const currentUser = JSON.parse(storedUser);
 
-      // FIX 1: Pass role and agent_code in URL
-      const url = `${process.env.NEXT_PUBLIC_API_URL}/api/pipeline?role=${currentUser.role}&agent_code=${encodeURIComponent(currentUser.name)}`;
-      
-      const res = await fetch(url, { 
-        headers: { "Authorization": `Bearer ${token}` } 
-      });
-      
-      const data = await res.json();
+      // Visibility comes from the JWT; the list is paged server-side
+      const data = await fetchAllPipeline(token);
       if (data.status === "success") {
         setStudents(data.data);
       } else {
@@ -6,6 +6,8 @@ import {
   Send, FileText, Loader2, X, User, RefreshCcw, UploadCloud, 
   Sparkles, Compass, Trophy, TrendingUp, DollarSign
 } from "lucide-react";
+import { fetchAllPipeline } from "@/lib/pipeline";
+import { runAiStrategy } from "@/lib/aiStrategy";
 
 export default function ProfilingTestHub() {
   const [students, setStudents] = useState<any[]>([]);
@@ -26,10 +28,7 @@ export default function ProfilingTestHub() {
     setLoading(true);
     try {
       const token = localStorage.getItem("fortrust_token");
-      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/pipeline?role=MASTER_ADMIN`, {
-        headers: { "Authorization": `Bearer ${token}` }
-      });
-      const data = await res.json();
+      const data = await fetchAllPipeline(token, { fields: ["documents"] });
       if (data.status === "success") setStudents(data.data || []);
     } catch (error) {
       console.error("Failed to load students");
@@ -75,18 +74,13 @@ export default function ProfilingTestHub() {
     }
   };
 
-  const runAiAnalysis = async (studentId: string) => {
+  const runAiAnalysis = async (studentId: string, forceRegenerate: boolean = false) => {
     setIsGenerating(true);
     setAiReport("");
     try {
       const token = localStorage.getItem("fortrust_token");
-      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/ai-strategy`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json", "Authorization": `Bearer ${token}` },
-        body: JSON.stringify({ case_id: studentId })
-      });
-      const data = await res.json();
-      if (res.ok && data.status === "success") {
+      const data = await runAiStrategy(token, studentId, forceRegenerate);
+      if (data.status === "success" && data.report) {
         setAiReport(data.report);
       } else {
         setAiReport('{"error": "Analysis failed."}');
@@ -435,7 +429,7 @@ export default function ProfilingTestHub() {
 
             <div className="p-5 border-t border-slate-200 bg-white flex justify-between items-center shrink-0">
               <button 
-                onClick={() => runAiAnalysis(selectedStudent.id)}
+                onClick={() => runAiAnalysis(selectedStudent.id, true)}
                 disabled={isGenerating}
                 className="text-sm font-bold text-blue-600 hover:text-blue-800 transition-colors flex items-center gap-2 disabled:opacity-50"
               >
@@ -13,6 +13,8 @@ import {
   ChevronRight, ChevronLeft, CheckCircle, Award, Briefcase, Sparkles, Target, ChevronDown, Archive,
   Download,DollarSign, School, ShieldCheck
 } from "lucide-react";
+import { fetchAllPipeline } from "@/lib/pipeline";
+import { runAiStrategy } from "@/lib/aiStrategy";
 
 const DOC_TYPES = [
   "Passport",
@@ -455,11 +457,11 @@ export default function GlobalStudentDatabase() {
     try {
       const token = localStorage.getItem("fortrust_token");
       const headers = { "Authorization": `Bearer ${token}` };
-      const [studentsRes, usersRes] = await Promise.all([
-        fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/pipeline?role=MASTER_ADMIN`, { headers }),
+      // The dossier reads documents + timeline straight off these rows
+      const [studentsData, usersRes] = await Promise.all([
+        fetchAllPipeline(token, { fields: ["documents", "timeline"] }),
         fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/users`, { headers })
       ]);
-      const studentsData = await studentsRes.json();
       const usersData = await usersRes.json();
       if (studentsData.status === "success") {
         setAllStudents(studentsData.data);
@@ -749,19 +751,14 @@ export default function GlobalStudentDatabase() {
     }
   };
 
-  const generateAIReport = async () => {
+  const generateAIReport = async (forceRegenerate: boolean = false) => {
     if (!editingStudent) return;
     setIsGeneratingAI(true);
     setAiReport("");
     try {
       const token = localStorage.getItem("fortrust_token");
-      const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/ai-strategy`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json", "Authorization": `Bearer ${token}` },
-        body: JSON.stringify({ case_id: editingStudent.id })
-      });
-      const data = await res.json();
-      if (res.ok && data.status === "success") setAiReport(data.report);
+      const data = await runAiStrategy(token, editingStudent.id, forceRegenerate);
+      if (data.status === "success" && data.report) setAiReport(data.report);
       else setAiReport("AI Analysis failed. Please ensure the student has valid PDF documents attached.");
     } catch (error) {
       setAiReport("Network Error. Could not connect to Gemini API.");
@@ -2193,7 +2190,7 @@ export default function GlobalStudentDatabase() {
                           ⚠️ Tip: Select Field of Interest in Profile tab for richer AI analysis.
                         </p>
                       )}
-                      <button onClick={generateAIReport} className="bg-[#BAD133] hover:bg-[#a3b827] text-[#1b1b42] font-black px-8 py-4 rounded-xl shadow-lg transition-transform active:scale-95 flex items-center gap-3">
+                      <button onClick={() => generateAIReport()} className="bg-[#BAD133] hover:bg-[#a3b827] text-[#1b1b42] font-black px-8 py-4 rounded-xl shadow-lg transition-transform active:scale-95 flex items-center gap-3">
                         <Activity size={20} /> Run AI Analysis
                       </button>
                     </div>
@@ -2230,7 +2227,7 @@ export default function GlobalStudentDatabase() {
                           </button>
                           <button
                             type="button"
-                            onClick={generateAIReport}
+                            onClick={() => generateAIReport(true)}
                             className="text-xs font-bold text-blue-600 hover:underline flex items-center gap-1"
                           >
                             <RefreshCcw size={12}/> Regenerate
@@ -6,6 +6,7 @@ import {
   CheckCircle2, ShieldAlert, MapPin, DollarSign,
   FileText, Archive
 } from "lucide-react";
+import { fetchAllPipeline } from "@/lib/pipeline";
 
 interface Student {
   id: number;
@@ -71,10 +72,7 @@ export default function AgentStudentsList({
   // Fetch ALL students (for the Assign modal picker)
   const fetchAllStudents = async () => {
     try {
-      const res = await fetch(`${apiUrl}/api/pipeline?role=MASTER_ADMIN`, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
-      const data = await res.json();
+      const data = await fetchAllPipeline(token, {}, apiUrl);
       if (data.status === "success") {
         setAllStudents(data.data || []);
       }
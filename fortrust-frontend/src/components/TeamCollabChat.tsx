@@ -79,6 +79,10 @@ const [messages, setMessages] = useState<ChatMessage[]>([]);
   const messagesContainerRef = useRef<HTMLDivElement>(null);
   const inputRef = useRef<HTMLTextAreaElement>(null);
   const pollTimer = useRef<NodeJS.Timeout | null>(null);
+  const lastServerIdRef = useRef(0);
+  const markReadTimer = useRef<NodeJS.Timeout | null>(null);
+  const [hasOlder, setHasOlder] = useState(false);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
   const userIsAtBottomRef = useRef(true);
 
   // Quick client-side access check (server is the source of truth)
@@ -99,12 +103,58 @@ const [messages, setMessages] = useState<ChatMessage[]>([]);
     messagesEndRef.current?.scrollIntoView({ behavior, block: "end" });
   }, []);
 
+  // Read receipts are a single high-water mark server-side; debounce so a
+  // burst of pushed messages costs one request.
+  const markRead = useCallback(() => {
+    if (markReadTimer.current) clearTimeout(markReadTimer.current);
+    markReadTimer.current = setTimeout(() => {
+      fetch(`${apiUrl}/api/pipeline/${studentId}/chat/read`, {
+        method: "POST",
+        headers: { Authorization: `Bearer ${token}`, "Content-Type": "application/json" },
+        body: JSON.stringify({ up_to_id: lastServerIdRef.current || null }),
+      }).catch(() => {});
+    }, 1000);
+  }, [apiUrl, studentId, token]);
+
+  useEffect(() => () => {
+    if (markReadTimer.current) clearTimeout(markReadTimer.current);
+  }, []);
+
+  // Merge server messages into the list, replacing optimistic copies and
+  // skipping ids we already have (a pushed message may also arrive by fetch).
+  const mergeIncoming = useCallback((incoming: ChatMessage[]) => {
+    for (const m of incoming) {
+      const n = Number(m.id);
+      if (!Number.isNaN(n) && n > lastServerIdRef.current) lastServerIdRef.current = n;
+    }
+    setMessages((prev) => {
+      const known = new Set(prev.filter((m) => !m._optimistic).map((m) => String(m.id)));
+      let next = prev;
+      for (const msg of incoming) {
+        if (known.has(String(msg.id))) continue;
+        known.add(String(msg.id));
+        const optIdx = next.findIndex(
+          (m) => m._optimistic && m.sender === msg.sender && m.message === msg.message
+        );
+        next = optIdx >= 0
+          ? next.map((m, i) => (i === optIdx ? { ...msg, _optimistic: false } : m))
+          : [...next, msg];
+      }
+      return next;
+    });
+    if (incoming.length) markRead();
+  }, [markRead]);
+
   // ============================================================
   // FETCH CHAT MESSAGES
+  // Initial load: the latest page. Silent refreshes (polling fallback)
+  // only ask for messages after the newest one we have.
   // ============================================================
   const fetchMessages = useCallback(async (silent: boolean = false) => {
     try {
-      const res = await fetch(`${apiUrl}/api/pipeline/${studentId}/chat`, {
+      const delta = silent && lastServerIdRef.current > 0;
+      const query = delta ? `?after_id=${lastServerIdRef.current}` : "";
+      const res = await fetch(`${apiUrl}/api/pipeline/${studentId}/chat${query}`, {
         headers: { Authorization: `Bearer ${token}` },
       });
       
@@ -118,6 +168,16 @@ const [messages, setMessages] = useState<ChatMessage[]>([]);
       if (data.status !== "success") return;
 
       const fetched: ChatMessage[] = data.data || [];
+      if (delta) {
+        mergeIncoming(fetched);
+        return;
+      }
+      for (const m of fetched) {
+        const n = Number(m.id);
+        if (!Number.isNaN(n) && n > lastServerIdRef.current) lastServerIdRef.current = n;
+      }
+      setHasOlder(Boolean(data.has_more));
+      if (fetched.length) markRead();
 
       setMessages((prev) => {
         const serverIds = new Set(fetched.map((m) => String(m.id)));
@@ -151,7 +211,31 @@ const [messages, setMessages] = useState<ChatMessage[]>([]);
         setIsInitialLoad(false);
       }
     }
-  }, [apiUrl, studentId, token]);
+  }, [apiUrl, studentId, token, mergeIncoming, markRead]);
+
+  const loadOlderMessages = useCallback(async () => {
+    const oldest = messages.find((m) => !m._optimistic);
+    if (!oldest || isLoadingOlder) return;
+    setIsLoadingOlder(true);
+    try {
+      const res = await fetch(`${apiUrl}/api/pipeline/${studentId}/chat?before_id=${oldest.id}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      const data = await res.json();
+      if (data.status === "success") {
+        const older: ChatMessage[] = data.data || [];
+        setMessages((prev) => {
+          const known = new Set(prev.map((m) => String(m.id)));
+          return [...older.filter((m) => !known.has(String(m.id))), ...prev];
+        });
+        setHasOlder(Boolean(data.has_more));
+      }
+    } catch (e) {
+      console.warn("Could not load older messages");
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  }, [apiUrl, studentId, token, messages, isLoadingOlder]);
 
   // ============================================================
   // FETCH AUDIT TRAIL
@@ -205,7 +289,8 @@ const [messages, setMessages] = useState<ChatMessage[]>([]);
 
 
   // ============================================================
-  // POLLING — only when on chat tab
+  // LIVE UPDATES — server push (SSE) on the chat tab; polling only
+  // when the stream is unavailable (old browser, listener down)
   // ============================================================
   useEffect(() => {
     if (!hasAccessClient) {
@@ -214,20 +299,52 @@ const [messages, setMessages] = useState<ChatMessage[]>([]);
       return;
     }
     
-    if (activeSubtab === "chat") {
-      fetchMessages(false);
-      pollTimer.current = setInterval(() => fetchMessages(true), pollInterval);
-    } else if (activeSubtab === "audit") {
+    if (activeSubtab === "audit") {
       fetchAuditTrail();
+      return;
     }
 
+    let cancelled = false;
+    let source: EventSource | null = null;
+    const startPolling = () => {
+      if (cancelled || pollTimer.current) return;
+      pollTimer.current = setInterval(() => fetchMessages(true), pollInterval);
+    };
+
+    fetchMessages(false).then(() => {
+      if (cancelled) return;
+      if (typeof EventSource === "undefined") {
+        startPolling();
+        return;
+      }
+      // EventSource can't send headers, hence the token in the query string.
+      // It reconnects by itself and resumes from the last id it saw.
+      source = new EventSource(
+        `${apiUrl}/api/pipeline/${studentId}/chat/stream?after_id=${lastServerIdRef.current}&access_token=${encodeURIComponent(token)}`
+      );
+      source.onmessage = (e) => mergeIncoming([JSON.parse(e.data)]);
+      source.addEventListener("unavailable", () => {
+        source?.close();
+        startPolling();
+      });
+      source.addEventListener("revoked", () => {
+        source?.close();
+        setAccessDenied(true);
+      });
+      source.onerror = () => {
+        if (source?.readyState === EventSource.CLOSED) startPolling();
+      };
+    });
+
     return () => {
+      cancelled = true;
+      source?.close();
       if (pollTimer.current) {
         clearInterval(pollTimer.current);
         pollTimer.current = null;
       }
     };
-  }, [fetchMessages, fetchAuditTrail, pollInterval, activeSubtab, hasAccessClient]);
+  }, [fetchMessages, fetchAuditTrail, mergeIncoming, apiUrl, studentId, token, pollInterval, activeSubtab, hasAccessClient]);
 
   useEffect(() => {
     if (isInitialLoad) {
@@ -584,6 +701,17 @@ const [messages, setMessages] = useState<ChatMessage[]>([]);
               </div>
             ) : (
               <div className="space-y-3">
+                {hasOlder && (
+                  <div className="flex justify-center">
+                    <button
+                      onClick={loadOlderMessages}
+                      disabled={isLoadingOlder}
+                      className="text-[11px] font-bold text-slate-500 hover:text-slate-700 bg-white border border-slate-200 rounded-full px-3 py-1 shadow-sm disabled:opacity-50"
+                    >
+                      {isLoadingOlder ? "Loading..." : "Load older messages"}
+                    </button>
+                  </div>
+                )}
                 {messageGroups.map((group, gIdx) => {
                   const first = group[0];
                   const isMe = first.sender === currentUserName;
@@ -0,0 +1,45 @@
+/**
+ * POST /api/ai-strategy only queues the report and returns a job id; the
+ * Gemini run happens on a background worker. runAiStrategy submits the job
+ * and polls GET /api/ai-strategy/jobs/{id} until it is done, resolving to
+ * the same `{ status, report, stats }` shape the endpoint used to return.
+ * Reports are cached server-side by their inputs; pass forceRegenerate to
+ * bypass the cache ("Regenerate" buttons).
+ */
+const POLL_INTERVAL_MS = 2000;
+const MAX_WAIT_MS = 10 * 60 * 1000;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+export async function runAiStrategy(
+  token: string | null,
+  caseId: string | number,
+  forceRegenerate: boolean = false,
+  apiUrl: string = process.env.NEXT_PUBLIC_API_URL || ""
+): Promise<{ status: string; report?: string; stats?: any; detail?: string }> {
+  const headers = { "Content-Type": "application/json", Authorization: `Bearer ${token}` };
+
+  const submit = await fetch(`${apiUrl}/api/ai-strategy`, {
+    method: "POST",
+    headers,
+    body: JSON.stringify({ case_id: String(caseId), force_regenerate: forceRegenerate })
+  });
+  const queued = await submit.json().catch(() => ({}));
+  if (!submit.ok || !queued.job_id) {
+    return { status: "error", detail: queued.detail || "Could not queue AI analysis." };
+  }
+
+  const deadline = Date.now() + MAX_WAIT_MS;
+  while (Date.now() < deadline) {
+    await sleep(POLL_INTERVAL_MS);
+    const res = await fetch(`${apiUrl}/api/ai-strategy/jobs/${queued.job_id}`, { headers });
+    if (!res.ok) continue;
+    const { job } = await res.json();
+    if (!job?.done) continue;
+    if (job.status === "succeeded") {
+      return { status: "success", report: job.result?.report, stats: job.result?.stats };
+    }
+    return { status: "error", detail: job.last_error || "AI analysis failed." };
+  }
+  return { status: "error", detail: "AI analysis is taking longer than expected. Please check back shortly." };
+}
@@ -0,0 +1,44 @@
+/**
+ * GET /api/pipeline is keyset-paginated and, by default, leaves out the
+ * heavy per-student columns (documents, timeline, pdf_text, ai_report).
+ * Screens that need the whole list call fetchAllPipeline, which follows
+ * `next_cursor` page by page and merges the result back into the usual
+ * `{ status, data }` shape.
+ */
+export interface PipelineQuery {
+  fields?: Array<"documents" | "timeline" | "pdf_text" | "ai_report">;
+  status?: string;
+  temperature?: string;
+  assignee?: string;
+}
+
+const PAGE_SIZE = 500;
+
+export async function fetchAllPipeline(
+  token: string | null,
+  query: PipelineQuery = {},
+  apiUrl: string = process.env.NEXT_PUBLIC_API_URL || ""
+): Promise<{ status: string; data: any[]; detail?: string }> {
+  const rows: any[] = [];
+  let cursor: string | null = null;
+
+  do {
+    const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+    if (query.fields?.length) params.set("fields", query.fields.join(","));
+    if (query.status) params.set("status", query.status);
+    if (query.temperature) params.set("temperature", query.temperature);
+    if (query.assignee) params.set("assignee", query.assignee);
+    if (cursor) params.set("cursor", cursor);
+
+    const res = await fetch(`${apiUrl}/api/pipeline?${params.toString()}`, {
+      headers: { Authorization: `Bearer ${token}` }
+    });
+    const page = await res.json();
+    if (page.status !== "success") return page;
+
+    rows.push(...(page.data || []));
+    cursor = page.next_cursor || null;
+  } while (cursor);
+
+  return { status: "success", data: rows };
+}
@@ -1,11 +1,47 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Header, Depends
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from psycopg2.extras import RealDictCursor
-from fastapi.responses import Response, StreamingResponse
+from psycopg2.extras import RealDictCursor, execute_values
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
-from ai_report import generate_strategic_report
+from ai_report import generate_strategic_report, report_cache_key
+from ai_report_cache import (
+    evict_stale_reports, lookup_cached_report, report_cache_stats, store_cached_report,
+)
+from dashboard_stats import (
+    INSTITUTION_FUNNEL_SQL, ROLLUP_FRESHNESS_SQL, ROLLUP_STATUS_COUNTS_SQL,
+    build_dashboard_queries, build_rollup_queries, assemble_dashboard_stats,
+    assemble_institution_funnels, describe_freshness, refresh_dashboard_rollups,
+)
+from query_plans import check_hot_query_plans
+from migrations import run_migrations, migration_status
+from document_pipeline import (
+    extract_file_async, fetch_and_extract, load_extractions,
+    media_type_for, save_extraction,
+)
+from upload_stream import UploadRejected, UploadSizeLimitMiddleware, spool_upload, upload_to_storage
+from lead_import import ImportFileError, import_leads
+from mentions import MentionIndex
+from student_applications import (
+    applications_for_students_async, link_institution, replace_applications,
+)
+from student_assignees import (
+    ASSIGNED_TO_USER_IDS_SQL, ASSIGNED_TO_USER_NAMES_SQL, reassign_students,
+)
+from student_documents import (
+    add_document, documents_for_students_async, list_documents, remove_document,
+)
+from realtime_events import EventHub, REALTIME_HEARTBEAT_SECONDS, RESYNC, sse_message
+from document_cache import (
+    DocumentCache, DocumentNotFound, DocumentProxy, RangeNotSatisfiable, StorageObjects,
+)
+from ai_jobs import (
+    PermanentJobError, enqueue_job, get_job, queue_stats, run_worker, serialize_job,
+)
 import psycopg2
+import asyncio
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
 import os
 import shutil
 import bcrypt
@@ -14,13 +50,17 @@ import io
 import base64
 import jwt
 import PyPDF2
-import pandas as pd
 import requests
 from datetime import datetime, date, timedelta
 from dotenv import load_dotenv
 from google import genai
 from supabase import create_client, Client
 import traceback
+import threading
+import contextvars
+import time
+from collections import deque
+from contextlib import asynccontextmanager
 from fortrust_form_generator import generate_application_form_pdf
 
 # ============================================================
@@ -48,6 +88,119 @@ def _get_user_id(user_data: dict) -> int | None:
         return None
 
 
+# ------------------------------------------------------------
+# Directory cache — hierarchy / user-list lookups
+# ------------------------------------------------------------
+# RBAC helpers ask for the same reporting tree several times per request,
+# and it rarely changes. Two layers:
+#   1. a per-request memo (contextvar, set by the middleware below), and
+#   2. a process-level TTL cache (USER_CACHE_TTL_SECONDS, default 60).
+# Writes to users / assignments call invalidate_user_cache(). Other uvicorn
+# workers pick the change up when their TTL expires.
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+_request_memo: contextvars.ContextVar = contextvars.ContextVar("request_memo", default=None)
+
+
+class UserDirectoryCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries = {}  # key -> (expires_at, value)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {"request_hits": 0, "ttl_hits": 0, "misses": 0, "invalidations": 0}
+
+    def _lookup(self, key):
+        memo = _request_memo.get()
+        if memo is not None and key in memo:
+            with self._lock:
+                self._stats["request_hits"] += 1
+            return True, memo[key], self._generation
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._stats["ttl_hits"] += 1
+                value = entry[1]
+                found = True
+            else:
+                self._stats["misses"] += 1
+                value, found = None, False
+            generation = self._generation
+        if found and memo is not None:
+            memo[key] = value
+        return found, value, generation
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            # Skip the store if an invalidation raced with the load.
+            if generation == self._generation and self.ttl > 0:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+        memo = _request_memo.get()
+        if memo is not None:
+            memo[key] = value
+
+    def get(self, key, loader):
+        found, value, generation = self._lookup(key)
+        if not found:
+            value = loader()
+            self._store(key, value, generation)
+        return value
+
+    async def aget(self, key, loader):
+        found, value, generation = self._lookup(key)
+        if not found:
+            value = await loader()
+            self._store(key, value, generation)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._stats["invalidations"] += 1
+        memo = _request_memo.get()
+        if memo is not None:
+            memo.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["request_hits"] + self._stats["ttl_hits"] + self._stats["misses"]
+            hits = self._stats["request_hits"] + self._stats["ttl_hits"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+user_cache = UserDirectoryCache(USER_CACHE_TTL_SECONDS)
+
+
+def invalidate_user_cache():
+    """Call after any write to `users` or to student assignments."""
+    user_cache.invalidate()
+
+
+# The whole reporting tree under a manager in one round-trip. UNION (not
+# UNION ALL) de-duplicates, which also stops the walk on a cyclic hierarchy.
+_SUBORDINATES_CTE = """
+    WITH RECURSIVE subordinates AS (
+        SELECT id FROM users WHERE parent_corporate_id = %s
+        UNION
+        SELECT u.id FROM users u
+        JOIN subordinates s ON u.parent_corporate_id = s.id
+    )
+"""
+
+
+_SUBORDINATE_IDS_SQL = _SUBORDINATES_CTE + "SELECT id FROM subordinates"
+
+# The RBAC helpers below come in sync (psycopg2) and async (psycopg 3)
+# pairs. Everything but running the query lives in the shared builders
+# (_team_manager_id, _visible_student_clause, _accessible_ids_query), so
+# each twin is only the execute/fetch layer for its driver.
+
+
 def _get_subordinate_ids(conn, manager_id: int) -> set:
     """
     Returns IDs of all users who report to the given manager
@@ -56,45 +209,25 @@ def _get_subordinate_ids(conn, manager_id: int) -> set:
     if not manager_id:
         return set()
     
-    subordinates = set()
-    to_check = [manager_id]
-    visited = set()
-    
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        while to_check:
-            parent_id = to_check.pop()
-            if parent_id in visited:
-                continue
-            visited.add(parent_id)
-            
-            cur.execute(
-                "SELECT id FROM users WHERE parent_corporate_id = %s",
-                (parent_id,)
-            )
-            for row in cur.fetchall():
-                child_id = row["id"]
-                if child_id not in subordinates:
-                    subordinates.add(child_id)
-                    to_check.append(child_id)
+    def load():
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(_SUBORDINATE_IDS_SQL, (manager_id,))
+            return frozenset(row["id"] for row in cur.fetchall())
     
-    return subordinates
+    return set(user_cache.get(("subordinate_ids", manager_id), load))
 
 
-def _get_subordinate_names(conn, manager_id: int) -> set:
-    """Same as above but returns names (for matching against student.assignee)."""
+async def _get_subordinate_ids_async(conn, manager_id: int) -> set:
+    """Async twin of _get_subordinate_ids (psycopg 3 connection, dict rows)."""
     if not manager_id:
         return set()
     
-    sub_ids = _get_subordinate_ids(conn, manager_id)
-    if not sub_ids:
-        return set()
+    async def load():
+        async with conn.cursor() as cur:
+            await cur.execute(_SUBORDINATE_IDS_SQL, (manager_id,))
+            return frozenset(row["id"] for row in await cur.fetchall())
     
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            "SELECT name FROM users WHERE id = ANY(%s)",
-            (list(sub_ids),)
-        )
-        return {row["name"] for row in cur.fetchall() if row.get("name")}
+    return set(await user_cache.aget(("subordinate_ids", manager_id), load))
 
 
 def is_master_admin(user_data: dict) -> bool:
@@ -114,44 +247,10 @@ def can_view_student(conn, student_id, user_data: dict) -> bool:
     Returns True if this user can VIEW the student.
     Rules:
     - Master Admin: yes
-    - Solo agent: only if they're in assignees array or legacy assignee
+    - Solo agent: only if they're one of the student's assignees
     - Manager: if assigned to themselves OR to any of their subordinates
     """
-    if is_master_admin(user_data):
-        return True
-    
-    user_name = user_data.get("name", "")
-    user_id = _get_user_id(user_data)
-    if not user_name:
-        return False
-    
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            "SELECT assignee, assignees FROM students WHERE id = %s",
-            (student_id,)
-        )
-        row = cur.fetchone()
-        if not row:
-            return False
-        
-        # Build set of names with access: self + any subordinates (for managers)
-        allowed_names = {user_name}
-        if is_manager_role(user_data) and user_id:
-            allowed_names |= _get_subordinate_names(conn, user_id)
-        
-        # Check legacy single assignee
-        if row.get("assignee") in allowed_names:
-            return True
-        
-        # Check assignees JSONB array
-        assignees = row.get("assignees") or []
-        if isinstance(assignees, str):
-            try:
-                assignees = json.loads(assignees)
-            except Exception:
-                assignees = []
-        
-        return bool(set(assignees) & allowed_names)
+    return bool(filter_accessible_student_ids(conn, [student_id], user_data))
 
 
 def can_edit_student(conn, student_id, user_data: dict) -> bool:
@@ -228,30 +327,99 @@ def get_visible_student_filter(user_data: dict, conn) -> tuple:
         clause, params = get_visible_student_filter(user_data, conn)
         cur.execute(f"SELECT * FROM students WHERE {clause}", params)
     """
+    manager_id = _team_manager_id(user_data)
+    subordinate_ids = _get_subordinate_ids(conn, manager_id) if manager_id else ()
+    return _visible_student_clause(user_data, subordinate_ids)
+
+
+async def get_visible_student_filter_async(user_data: dict, conn) -> tuple:
+    """Async twin of get_visible_student_filter for psycopg 3 connections."""
+    manager_id = _team_manager_id(user_data)
+    subordinate_ids = await _get_subordinate_ids_async(conn, manager_id) if manager_id else ()
+    return _visible_student_clause(user_data, subordinate_ids)
+
+
+def _team_manager_id(user_data: dict) -> Optional[int]:
+    """The user whose subordinates widen the student filter, or None when they don't."""
+    if is_master_admin(user_data) or not is_manager_role(user_data):
+        return None
+    return _get_user_id(user_data) or None
+
+
+def _visible_student_clause(user_data: dict, subordinate_ids) -> tuple:
+    """Shared SQL builder for the sync/async visibility filters."""
     if is_master_admin(user_data):
         return ("TRUE", [])
     
-    user_name = user_data.get("name", "")
     user_id = _get_user_id(user_data)
+    allowed_ids = ([user_id] if user_id else []) + list(subordinate_ids)
+    if not allowed_ids:
+        return ("FALSE", [])
     
-    allowed_names = [user_name] if user_name else []
-    if is_manager_role(user_data) and user_id:
-        allowed_names.extend(_get_subordinate_names(conn, user_id))
+    # One predicate regardless of team size: a semi-join on
+    # student_assignees (user_id, student_id).
+    return (ASSIGNED_TO_USER_IDS_SQL, [list(dict.fromkeys(allowed_ids))])
+
+
+def _normalize_student_ids(student_ids) -> list:
+    """Ints, de-duplicated, order kept; anything non-numeric is dropped (it can't match a row)."""
+    ids = []
+    for sid in student_ids or []:
+        try:
+            ids.append(int(sid))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(ids))
+
+
+_ACCESSIBLE_IDS_SQL = "SELECT id FROM students WHERE id = ANY(%s::int[]) AND {clause}"
+
+
+def _accessible_ids_query(ids: list, visible_filter: tuple) -> Optional[tuple]:
+    """(sql, params) for filter_accessible_student_ids*, or None when nothing can match."""
+    clause, params = visible_filter
+    if not ids or clause == "FALSE":
+        return None
+    return _ACCESSIBLE_IDS_SQL.format(clause=clause), [ids] + params
+
+
+def filter_accessible_student_ids(conn, student_ids, user_data: dict) -> set:
+    """
+    Returns the subset of `student_ids` (as ints) this user can access, in
+    one query. Every per-student check (view/edit, chat, audit trail,
+    documents) goes through here so they all apply the same rule as
+    get_visible_student_filter.
     
-    if not allowed_names:
-        return ("FALSE", [])
+    Usage:
+        allowed = filter_accessible_student_ids(conn, ids, user_data)
+        denied = [i for i in ids if int(i) not in allowed]
+    """
+    ids = _normalize_student_ids(student_ids)
+    if not ids:
+        return set()
     
-    # Build SQL: matches if assignee = ANY name OR assignees array contains ANY name
-    placeholders = ",".join(["%s"] * len(allowed_names))
+    query = _accessible_ids_query(ids, get_visible_student_filter(user_data, conn))
+    if query is None:
+        return set()
     
-    # JSONB containment check — assignees @> '["name"]'::jsonb for each name
-    # We use OR semantics: "any name in the allowed list appears in assignees"
-    or_clauses = " OR ".join([f"assignees @> %s::jsonb" for _ in allowed_names])
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(*query)
+        return {row["id"] for row in cur.fetchall()}
+
+
+async def filter_accessible_student_ids_async(conn, student_ids, user_data: dict) -> set:
+    """Async twin of filter_accessible_student_ids for psycopg 3 connections."""
+    ids = _normalize_student_ids(student_ids)
+    if not ids:
+        return set()
     
-    clause = f"(assignee IN ({placeholders}) OR {or_clauses})"
-    params = list(allowed_names) + [json.dumps([n]) for n in allowed_names]
+    query = _accessible_ids_query(ids, await get_visible_student_filter_async(user_data, conn))
+    if query is None:
+        return set()
     
-    return (clause, params)
+    async with conn.cursor() as cur:
+        await cur.execute(*query)
+        return {row["id"] for row in await cur.fetchall()}
 
 
 def get_visible_agent_filter(user_data: dict, conn) -> tuple:
@@ -377,6 +545,24 @@ if SUPABASE_URL:
 else:
     supabase = None
 
+
+# Reads of student-documents go through a streaming proxy with an on-disk
+# LRU (see document_cache.py). Signed-URL redirects hand the download off to
+# storage entirely; the URL lives DOC_SIGNED_URL_TTL_SECONDS (0 disables them).
+DOC_SIGNED_URL_TTL_SECONDS = int(os.getenv("DOC_SIGNED_URL_TTL_SECONDS", "60"))
+
+if supabase:
+    document_proxy = DocumentProxy(
+        StorageObjects(SUPABASE_URL, SUPABASE_KEY, "student-documents"), DocumentCache()
+    )
+else:
+    document_proxy = None
+
+
+def download_student_document(filename: str) -> bytes:
+    """Raw bytes of a file in the student-documents bucket (served from the local cache when warm)."""
+    return document_proxy.read_bytes(filename)
+
 if API_KEY:
     client = genai.Client(api_key=API_KEY)
 else:
@@ -392,169 +578,406 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],
 )
 
+
+class RequestMemoMiddleware:
+    """Gives every HTTP request a fresh per-request memo for user_cache."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _request_memo.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_memo.reset(token)
+
+
+app.add_middleware(RequestMemoMiddleware)
+
+# Multipart bodies are spooled to disk by the form parser before any
+# endpoint runs, so the request as a whole is capped while it streams in
+# (UploadSizeLimitMiddleware, chunked bodies included). Per-file caps
+# (MAX_FILE_SIZE_BYTES) are enforced while streaming in spool_upload().
+MAX_UPLOAD_REQUEST_MB = int(os.getenv("MAX_UPLOAD_REQUEST_MB", "60"))
+
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=MAX_UPLOAD_REQUEST_MB * 1024 * 1024)
+
 # =====================================================================
 # --- DATABASE CONNECTION ---
 # =====================================================================
+# Every request used to open (and TLS-handshake) a brand new Postgres
+# connection. Connections are now handed out from a bounded pool:
+#   - DB_POOL_MAX_SIZE              hard cap on open connections
+#   - DB_POOL_TIMEOUT_SECONDS       how long a request waits for a free slot (then 503)
+#   - DB_POOL_MAX_LIFETIME_SECONDS  connections older than this are recycled
+#   - DB_POOL_HEALTHCHECK_SECONDS   idle connections older than this get a `SELECT 1`
+# get_db_connection() keeps its old contract: callers still `conn.close()`,
+# which now returns the connection to the pool instead of dropping it.
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", "1800"))
+DB_POOL_HEALTHCHECK_SECONDS = float(os.getenv("DB_POOL_HEALTHCHECK_SECONDS", "30"))
+
+
+class DatabasePool:
+    """Thread-safe bounded pool of psycopg2 connections."""
+
+    def __init__(self, dsn, max_size, timeout, max_lifetime, healthcheck_after):
+        self.dsn = dsn
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_after = healthcheck_after
+        self._idle = deque()  # (raw_conn, created_at, last_used_at)
+        self._born = {}       # id(raw_conn) -> created_at, for checked-out connections
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "failed_healthchecks": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        }
+        self._waiting = 0
+
+    def _count(self, stat):
+        """Bumps a counter from code running outside self._cond."""
+        with self._cond:
+            self._stats[stat] += 1
+
+    def _connect(self):
+        raw = psycopg2.connect(self.dsn, sslmode='require')
+        self._count("created")
+        return raw
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, raw, last_used_at):
+        if raw.closed:
+            return False
+        if time.monotonic() - last_used_at < self.healthcheck_after:
+            return True
+        try:
+            with raw.cursor() as cur:
+                cur.execute("SELECT 1")
+            raw.rollback()
+            return True
+        except Exception:
+            self._count("failed_healthchecks")
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw, created_at, last_used_at = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    # Reserve the slot now, connect outside the lock.
+                    self._open += 1
+                    raw = None
+                    created_at = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise HTTPException(status_code=503, detail="Database is busy. Please retry shortly.")
+                waited = True
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        # Validate / open outside the lock so a slow network never blocks other checkouts.
+        if raw is not None:
+            expired = time.monotonic() - created_at > self.max_lifetime
+            if expired or not self._is_healthy(raw, last_used_at):
+                if expired:
+                    self._count("recycled")
+                self._discard(raw)
+                raw = None
+        if raw is None:
+            try:
+                raw = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+            created_at = time.monotonic()
+
+        wait_ms = (time.monotonic() - started) * 1000
+        with self._cond:
+            self._born[id(raw)] = created_at
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["total_wait_ms"] += wait_ms
+            self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+        return PooledConnection(self, raw)
+
+    def putconn(self, raw):
+        with self._cond:
+            created_at = self._born.pop(id(raw), time.monotonic())
+        keep = not raw.closed and time.monotonic() - created_at <= self.max_lifetime
+        recycled = not keep and not raw.closed
+        if keep:
+            try:
+                # Never hand the next request a half-finished transaction.
+                if raw.status != psycopg2.extensions.STATUS_READY:
+                    raw.rollback()
+                if raw.autocommit:
+                    raw.autocommit = False
+            except Exception:
+                keep = False
+        with self._cond:
+            if recycled:
+                self._stats["recycled"] += 1
+            if keep:
+                self._idle.append((raw, created_at, time.monotonic()))
+            else:
+                self._open -= 1
+            self._cond.notify()
+        if not keep:
+            self._discard(raw)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                "max_size": self.max_size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "waiting": self._waiting,
+                "timeout_seconds": self.timeout,
+                "max_lifetime_seconds": self.max_lifetime,
+                **self._stats,
+                "total_wait_ms": round(self._stats["total_wait_ms"], 2),
+                "max_wait_ms": round(self._stats["max_wait_ms"], 2),
+                "avg_wait_ms": round(self._stats["total_wait_ms"] / checkouts, 2) if checkouts else 0.0,
+            }
+
+
+class PooledConnection:
+    """Wraps a psycopg2 connection so `close()` returns it to the pool."""
+
+    def __init__(self, pool, raw):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_raw", raw)
+
+    def close(self):
+        raw = self._raw
+        if raw is None:
+            return
+        object.__setattr__(self, "_raw", None)
+        self._pool.putconn(raw)
+
+    @property
+    def closed(self):
+        return 1 if self._raw is None else self._raw.closed
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(self._raw, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._raw, name, value)
+
+    def __enter__(self):
+        return self._raw.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+    def __del__(self):
+        # Safety net for code paths that forget to close.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+db_pool = DatabasePool(
+    DATABASE_URL,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT_SECONDS,
+    max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS,
+    healthcheck_after=DB_POOL_HEALTHCHECK_SECONDS,
+)
+
+
 def get_db_connection():
-    return psycopg2.connect(DATABASE_URL, sslmode='require')
+    return db_pool.getconn()
 
 
-# =====================================================================
-# --- AUTO SCHEMA UPGRADE ---
-# =====================================================================
-def verify_schema():
+def get_db():
+    """FastAPI dependency: `conn = Depends(get_db)` — returned to the pool after the response."""
     conn = get_db_connection()
     try:
-        with conn.cursor() as cur:
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS pdf_text TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS notes TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS commission_earned NUMERIC DEFAULT 0.0;")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS program_interest TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS lead_source TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS lead_temperature TEXT DEFAULT 'Cold Leads';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS currency VARCHAR(10) DEFAULT 'USD';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS payout_status TEXT DEFAULT 'PENDING_CENSUS';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS agent_cut NUMERIC DEFAULT 0;")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS documents JSONB DEFAULT '[]'::jsonb;")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS loss_reason TEXT DEFAULT '';")
-
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS agent_type TEXT DEFAULT 'Individual Agent';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS corporation_name TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS office_address TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bank_name TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bank_branch TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bank_address TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bank_account TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS swift_code TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE;")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS max_capacity INTEGER DEFAULT 50;")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS commission_rate NUMERIC DEFAULT 0;")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS parent_corporate_id INTEGER REFERENCES users(id) ON DELETE SET NULL;")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS training_points INTEGER DEFAULT 0;")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_archived BOOLEAN DEFAULT FALSE;")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS emergency_contact TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS email TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS field_interests TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS budget TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS archive_reason TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS father_name TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS father_email TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS father_whatsapp TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS mother_name TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS mother_email TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS mother_whatsapp TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS academic_field TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS career_goal TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS campus_env TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS country_interest TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS assignees JSONB DEFAULT '[]'::jsonb;")
-            # Backfill: copy existing single assignee values into the new JSONB array
-            cur.execute("""
-                UPDATE students 
-                SET assignees = jsonb_build_array(assignee)
-                WHERE (assignees IS NULL OR assignees = '[]'::jsonb)
-                AND assignee IS NOT NULL 
-                AND assignee != '' 
-                AND assignee != 'Unassigned'
-            """)
+        yield conn
+    finally:
+        conn.close()
 
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS chat_messages (
-                    id SERIAL PRIMARY KEY,
-                    student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
-                    sender TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    mentioned_users JSONB DEFAULT '[]'::jsonb,
-                    read_by JSONB DEFAULT '[]'::jsonb,
-                    is_system BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            """)
 
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS notifications (
-                    id SERIAL PRIMARY KEY,
-                    recipient_username TEXT NOT NULL,
-                    sender TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    is_read BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            """)
+@asynccontextmanager
+async def checkout_db_connection():
+    """
+    get_db_connection() for `async def` routes: waiting for a free pooled
+    connection happens off the event loop, and it is returned on exit
+    (rolling back anything uncommitted). Keep the block to the DB work --
+    awaiting storage or extraction inside it pins a connection that the
+    rest of the pool's callers may be waiting for.
 
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS institutions (
-                    id SERIAL PRIMARY KEY,
-                    name TEXT DEFAULT '',
-                    type TEXT DEFAULT '',
-                    country TEXT DEFAULT '',
-                    city TEXT DEFAULT '',
-                    status TEXT DEFAULT 'Active',
-                    website TEXT DEFAULT '',
-                    establishment_year TEXT DEFAULT '',
-                    student_intake TEXT DEFAULT '',
-                    programs_offered TEXT DEFAULT '',
-                    agreement_id TEXT DEFAULT '',
-                    agreement_date TEXT DEFAULT '',
-                    agreement_type TEXT DEFAULT '',
-                    base_commission TEXT DEFAULT '',
-                    performance_bonus TEXT DEFAULT '',
-                    tiered_levels TEXT DEFAULT '',
-                    duration_start TEXT DEFAULT '',
-                    duration_end TEXT DEFAULT '',
-                    terms_conditions TEXT DEFAULT '',
-                    contacts JSONB DEFAULT '[]',
-                    total_referrals INTEGER DEFAULT 0,
-                    total_enrollment INTEGER DEFAULT 0,
-                    total_base_commission TEXT DEFAULT '',
-                    total_payable TEXT DEFAULT '',
-                    commission_status TEXT DEFAULT 'Pending',
-                    payment_date TEXT DEFAULT '',
-                    commission_notes TEXT DEFAULT '',
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            """)
-            cur.execute("ALTER TABLE institutions ADD COLUMN IF NOT EXISTS document_link TEXT;")
-            cur.execute("ALTER TABLE institutions ADD COLUMN IF NOT EXISTS commission_programs JSONB DEFAULT '[]'::jsonb;")
-            cur.execute("ALTER TABLE institutions ADD COLUMN IF NOT EXISTS ai_extracted_at TIMESTAMP;")
+    Usage:
+        async with checkout_db_connection() as conn:
+            ...
+    """
+    conn = await asyncio.to_thread(get_db_connection)
+    try:
+        yield conn
+    finally:
+        conn.close()
 
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS audit_logs (
-                    id SERIAL PRIMARY KEY,
-                    action TEXT,
-                    entity TEXT,
-                    entity_id TEXT,
-                    changed_by TEXT,
-                    details JSONB DEFAULT '{}',
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            """)
 
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS broadcasts (
-                    id SERIAL PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    target_role TEXT DEFAULT 'ALL',
-                    target_branch TEXT DEFAULT 'ALL',
-                    send_email BOOLEAN DEFAULT FALSE,
-                    created_by TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            """)
+# ---------------------------------------------------------------------
+# Async pool (psycopg 3) for hot read endpoints.
+# Plain `def` routes run on Starlette's small threadpool; when a few of them
+# block on Gemini / Supabase every other request queues behind them. Routes
+# that `await` this pool stay on the event loop instead.
+# Same sizing knobs as the sync pool, with an ASYNC_ prefix to override.
+# ---------------------------------------------------------------------
+ASYNC_DB_POOL_MIN_SIZE = int(os.getenv("ASYNC_DB_POOL_MIN_SIZE", "1"))
+ASYNC_DB_POOL_MAX_SIZE = int(os.getenv("ASYNC_DB_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+
+async_db_pool = AsyncConnectionPool(
+    DATABASE_URL or "",
+    min_size=ASYNC_DB_POOL_MIN_SIZE,
+    max_size=max(ASYNC_DB_POOL_MIN_SIZE, ASYNC_DB_POOL_MAX_SIZE),
+    timeout=DB_POOL_TIMEOUT_SECONDS,
+    max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS,
+    max_idle=DB_POOL_MAX_LIFETIME_SECONDS,
+    check=AsyncConnectionPool.check_connection,
+    # prepare_threshold=None: Supabase's transaction pooler can't share
+    # server-side prepared statements between clients.
+    kwargs={"sslmode": "require", "row_factory": dict_row, "prepare_threshold": None},
+    open=False,
+)
 
-            conn.commit()
+
+@asynccontextmanager
+async def get_async_db_connection():
+    """
+    Usage:
+        async with get_async_db_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(...)
+    Rows come back as dicts (same shape as RealDictCursor). The transaction
+    is committed on clean exit and rolled back on error.
+    """
+    try:
+        async with async_db_pool.connection() as conn:
+            yield conn
+    except PoolTimeout:
+        raise HTTPException(status_code=503, detail="Database is busy. Please retry shortly.")
+
+
+@app.on_event("startup")
+async def open_async_db_pool():
+    if DATABASE_URL:
+        await async_db_pool.open()
+
+
+@app.on_event("shutdown")
+async def close_async_db_pool():
+    await async_db_pool.close()
+
+
+# =====================================================================
+# --- AUTO SCHEMA UPGRADE ---
+# =====================================================================
+# Versioned migrations live in migrations.py. When nothing changed this is
+# a single SELECT; set RUN_MIGRATIONS_ON_STARTUP=false to apply them only
+# from a deploy step (`python migrations.py`).
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "true").lower() != "false"
+
+
+def verify_schema():
+    conn = get_db_connection()
+    try:
+        applied = run_migrations(conn)
+        if applied:
+            print(f"[migrations] applied {applied}")
     except Exception as e:
+        # Serving against a half-migrated schema only turns one clear error
+        # into many confusing ones, so refuse to start.
         print(f"Schema upgrade error: {e}")
         conn.rollback()
+        raise
     finally:
         conn.close()
 
 
-verify_schema()
+if DATABASE_URL and RUN_MIGRATIONS_ON_STARTUP:
+    verify_schema()
+
+
+# =====================================================================
+# --- DASHBOARD ROLLUP REFRESHER ---
+# =====================================================================
+# Keeps dashboard_* rollups current in the background: every interval it
+# recomputes the created_at days the students trigger marked dirty. The
+# first pass does a full rebuild if the rollups have never been built.
+DASHBOARD_ROLLUP_REFRESH_SECONDS = float(os.getenv("DASHBOARD_ROLLUP_REFRESH_SECONDS", "30"))
+_rollup_refresher_stop = threading.Event()
+
+
+def _dashboard_rollup_refresher():
+    while not _rollup_refresher_stop.is_set():
+        conn = None
+        try:
+            conn = get_db_connection()
+            result = refresh_dashboard_rollups(conn)
+            if result and (result["full_rebuild"] or result["days_refreshed"]):
+                print(f"[rollups] refreshed {result}")
+        except Exception as e:
+            print(f"[rollups] refresh failed: {e}")
+            if conn is not None:
+                conn.rollback()
+        finally:
+            if conn is not None:
+                conn.close()
+        _rollup_refresher_stop.wait(DASHBOARD_ROLLUP_REFRESH_SECONDS)
+
+
+@app.on_event("startup")
+def start_dashboard_rollup_refresher():
+    if DATABASE_URL and DASHBOARD_ROLLUP_REFRESH_SECONDS > 0:
+        threading.Thread(target=_dashboard_rollup_refresher, name="dashboard-rollups", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def stop_dashboard_rollup_refresher():
+    _rollup_refresher_stop.set()
 
 
 # =====================================================================
@@ -635,41 +1058,13 @@ def sanitize_filename(filename: str) -> str:
 def check_student_access(conn, case_id: str, user_data: dict) -> bool:
     """
     Returns True if this user can access this student's documents.
-    Rules:
-      - MASTER_ADMIN: always yes
-      - Corporate Agent / Team Manager: yes if any sub-agent is assigned
-      - Anyone else: yes ONLY if they are the assignee
+    Same rule as can_view_student (see filter_accessible_student_ids).
     """
-    role = user_data.get("role")
-    user_name = user_data.get("name")
-    user_id = user_data.get("id")
-
-    if role == "MASTER_ADMIN":
-        return True
-
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT assignee FROM students WHERE id = %s", (case_id,))
-            row = cur.fetchone()
-            if not row:
-                return False
-            assignee = row.get("assignee")
-
-            if assignee == user_name:
-                return True
-
-            if role in ("Corporate Agent", "Team Manager"):
-                cur.execute(
-                    "SELECT name FROM users WHERE parent_corporate_id = %s",
-                    (user_id,)
-                )
-                sub_agents = [r['name'] for r in cur.fetchall()]
-                if assignee in sub_agents:
-                    return True
-
-        return False
+        return bool(filter_accessible_student_ids(conn, [case_id], user_data))
     except Exception as e:
         print(f"[access-check] Error: {e}")
+        conn.rollback()
         return False
 
 
@@ -715,43 +1110,27 @@ def get_current_master_admin(authorization: str = Header(None)):
         raise HTTPException(status_code=401, detail="Token has expired. Please log in again.")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token.")
-    
+
+
+def verify_stream_token(authorization: str = Header(None), access_token: Optional[str] = None):
+    """verify_token for EventSource streams, which can't send headers: also accepts ?access_token=."""
+    if not authorization and access_token:
+        authorization = f"Bearer {access_token}"
+    return verify_token(authorization)
+
+
 def can_access_student_chat(conn, student_id, user_data: dict) -> bool:
     """
     Returns True if user can view/post in this student's chat.
-    Rules:
-    - Master Admin: always yes
-    - Other users: must be in the student's `assignees` array OR be the legacy `assignee`
+    Same rule as can_view_student: Master Admin, the student's assignees,
+    and managers of those assignees.
     """
-    if user_data.get("role") == "MASTER_ADMIN":
-        return True
-    
-    user_name = user_data.get("name", "")
-    if not user_name:
-        return False
-    
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            "SELECT assignee, assignees FROM students WHERE id = %s",
-            (student_id,)
-        )
-        row = cur.fetchone()
-        if not row:
-            return False
-        
-        # Check legacy single assignee
-        if row.get("assignee") == user_name:
-            return True
-        
-        # Check assignees array
-        assignees = row.get("assignees") or []
-        if isinstance(assignees, str):
-            try:
-                assignees = json.loads(assignees)
-            except Exception:
-                assignees = []
-        
-        return user_name in assignees
+    return bool(filter_accessible_student_ids(conn, [student_id], user_data))
+
+
+async def can_access_student_chat_async(conn, student_id, user_data: dict) -> bool:
+    """Async twin of can_access_student_chat (psycopg 3 connection)."""
+    return bool(await filter_accessible_student_ids_async(conn, [student_id], user_data))
 
 
 # =====================================================================
@@ -879,6 +1258,7 @@ class ApplicationData(BaseModel):
 
 class AIRequest(BaseModel):
     case_id: str
+    force_regenerate: bool = False  # skip the report cache and call Gemini again
 
 
 class ForgotPasswordRequest(BaseModel):
@@ -1008,8 +1388,7 @@ class AIChatRequest(BaseModel):
 # --- EMERGENCY BACKDOOR ---
 # =====================================================================
 @app.get("/api/emergency-admin")
-def create_emergency_admin():
-    conn = get_db_connection()
+def create_emergency_admin(conn=Depends(get_db)):
     fresh_hash = bcrypt.hashpw(b"admin123", bcrypt.gensalt()).decode('utf-8')
     try:
         with conn.cursor() as cur:
@@ -1019,78 +1398,73 @@ def create_emergency_admin():
                 VALUES ('Master Admin', 'admin@fortrust.com', %s, 'MASTER_ADMIN', 'Global')
             """, (fresh_hash,))
             conn.commit()
+            invalidate_user_cache()
             return {"status": "success", "message": "Emergency Admin created successfully!"}
     except Exception as e:
         conn.rollback()
         return {"status": "error", "message": str(e)}
-    finally:
-        conn.close()
 
 
 # =====================================================================
 # --- 0. AUTHENTICATION ---
 # =====================================================================
 @app.post("/api/login")
-def login_user(req: LoginRequest):
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, name, role, password, branch, phone, corporation_name,
-                       bank_name, bank_account, bank_branch, swift_code,
-                       COALESCE(is_active, true) as is_active 
-                FROM users WHERE email=%s
-            """, (req.email,))
-            user = cur.fetchone()
-
-            if not user or not bcrypt.checkpw(req.password.encode('utf-8'), user['password'].encode('utf-8')):
-                raise HTTPException(status_code=401, detail="Invalid email or password.")
-            if user['is_active'] is False:
-                raise HTTPException(status_code=403, detail="Account frozen.")
-
-            try:
-                cur.execute("""
-                    INSERT INTO audit_logs (action, entity, entity_id, changed_by, details)
-                    VALUES (%s, %s, %s, %s, %s::jsonb)
-                """, ("LOGIN", "System Access", str(user['id']), user['name'], json.dumps({"action": "Agent logged into Fortrust OS"})))
-                conn.commit()
-            except Exception as e:
-                print(f"CCTV Tracking Error: {e}")
+def login_user(req: LoginRequest, conn=Depends(get_db)):
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id, name, role, password, branch, phone, corporation_name,
+                   bank_name, bank_account, bank_branch, swift_code,
+                   COALESCE(is_active, true) as is_active 
+            FROM users WHERE email=%s
+        """, (req.email,))
+        user = cur.fetchone()
+
+        if not user or not bcrypt.checkpw(req.password.encode('utf-8'), user['password'].encode('utf-8')):
+            raise HTTPException(status_code=401, detail="Invalid email or password.")
+        if user['is_active'] is False:
+            raise HTTPException(status_code=403, detail="Account frozen.")
 
-            expire_hours = 24 * 30 if req.remember_me else 24
-            token_data = {
+        try:
+            cur.execute("""
+                INSERT INTO audit_logs (action, entity, entity_id, changed_by, details)
+                VALUES (%s, %s, %s, %s, %s::jsonb)
+            """, ("LOGIN", "System Access", str(user['id']), user['name'], json.dumps({"action": "Agent logged into Fortrust OS"})))
+            conn.commit()
+        except Exception as e:
+            print(f"CCTV Tracking Error: {e}")
+
+        expire_hours = 24 * 30 if req.remember_me else 24
+        token_data = {
+            "id": user['id'],
+            "name": user['name'],
+            "role": user['role'],
+            "exp": datetime.utcnow() + timedelta(hours=expire_hours)
+        }
+        token = jwt.encode(token_data, JWT_SECRET, algorithm="HS256")
+        return {
+            "status": "success",
+            "token": token,
+            "user": {
                 "id": user['id'],
                 "name": user['name'],
+                "email": req.email,
                 "role": user['role'],
-                "exp": datetime.utcnow() + timedelta(hours=expire_hours)
-            }
-            token = jwt.encode(token_data, JWT_SECRET, algorithm="HS256")
-            return {
-                "status": "success",
-                "token": token,
-                "user": {
-                    "id": user['id'],
-                    "name": user['name'],
-                    "email": req.email,
-                    "role": user['role'],
-                    "branch": user['branch'],
-                    "phone": user['phone'],
-                    "corporation_name": user['corporation_name'],
-                    "bank_name": user['bank_name'],
-                    "bank_account": user['bank_account'],
-                    "bank_branch": user['bank_branch'],
-                    "swift_code": user['swift_code']
-                }
+                "branch": user['branch'],
+                "phone": user['phone'],
+                "corporation_name": user['corporation_name'],
+                "bank_name": user['bank_name'],
+                "bank_account": user['bank_account'],
+                "bank_branch": user['bank_branch'],
+                "swift_code": user['swift_code']
             }
-    finally:
-        conn.close()
+        }
 
 
 # =====================================================================
 # --- 1. USER MANAGEMENT ---
 # =====================================================================
 @app.post("/api/users")
-def create_user_legacy(req: NewUserRequest, user_data: dict = Depends(verify_token)):
+def create_user_legacy(req: NewUserRequest, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     # ⬇️ RBAC GUARD — only Master Admin and Corporate Agents can create new users
     role = user_data.get("role")
     if role not in (Roles.MASTER_ADMIN, Roles.CORPORATE_AGENT):
@@ -1098,7 +1472,6 @@ def create_user_legacy(req: NewUserRequest, user_data: dict = Depends(verify_tok
     # ⬆️ END GUARD
     
     hashed_password = bcrypt.hashpw(req.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("""
@@ -1117,6 +1490,7 @@ def create_user_legacy(req: NewUserRequest, user_data: dict = Depends(verify_tok
                 req.parent_corporate_id, req.emergency_contact
             ))
             conn.commit()
+            invalidate_user_cache()
             return {"status": "success", "message": "User account created securely!"}
     except psycopg2.IntegrityError:
         conn.rollback()
@@ -1124,38 +1498,31 @@ def create_user_legacy(req: NewUserRequest, user_data: dict = Depends(verify_tok
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.get("/api/users")
-def get_all_users_legacy(user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
-    try:
-        # ⬇️ RBAC SCOPING — only show agents this user is allowed to see
-        clause, params = get_visible_agent_filter(user_data, conn)
-        # ⬆️ END SCOPING
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(f"""
-                SELECT id, name, email, role, branch, phone, agent_type, corporation_name,
-                       office_address, bank_name, bank_branch, bank_address, bank_account,
-                       swift_code, max_capacity, commission_rate, parent_corporate_id,
-                       emergency_contact, training_points,
-                       COALESCE(is_active, true) as is_active,
-                       COALESCE(is_archived, false) as is_archived
-                FROM users 
-                WHERE {clause}
-                ORDER BY id DESC
-            """, params)
-            return {"status": "success", "data": cur.fetchall()}
-    finally:
-        conn.close()
+def get_all_users_legacy(user_data: dict = Depends(verify_token), conn=Depends(get_db)):
+    # ⬇️ RBAC SCOPING — only show agents this user is allowed to see
+    clause, params = get_visible_agent_filter(user_data, conn)
+    # ⬆️ END SCOPING
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT id, name, email, role, branch, phone, agent_type, corporation_name,
+                   office_address, bank_name, bank_branch, bank_address, bank_account,
+                   swift_code, max_capacity, commission_rate, parent_corporate_id,
+                   emergency_contact, training_points,
+                   COALESCE(is_active, true) as is_active,
+                   COALESCE(is_archived, false) as is_archived
+            FROM users 
+            WHERE {clause}
+            ORDER BY id DESC
+        """, params)
+        return {"status": "success", "data": cur.fetchall()}
 
 
 @app.put("/api/users/{user_id}")
-def update_system_user(user_id: int, req: UpdateSystemUser, user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
+def update_system_user(user_id: int, req: UpdateSystemUser, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             data = req.dict(exclude_unset=True)
@@ -1176,41 +1543,37 @@ def update_system_user(user_id: int, req: UpdateSystemUser, user_data: dict = De
             params = list(data.values()) + [user_id]
             cur.execute(f"UPDATE users SET {', '.join(updates)} WHERE id = %s", tuple(params))
             conn.commit()
+            invalidate_user_cache()
             return {"status": "success", "message": "User updated"}
     except HTTPException:
         raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.delete("/api/users/{user_id}")
-def delete_system_user(user_id: int, user_data: dict = Depends(verify_token)):
+def delete_system_user(user_id: int, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     # ⬇️ RBAC GUARD — only Master Admin can permanently delete users
     require_master_admin(user_data)
     # ⬆️ END GUARD
     
-    conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
             conn.commit()
+            invalidate_user_cache()
             return {"status": "success", "message": "User deleted."}
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.post("/api/users/{user_id}/award-training-point")
-def award_training_point(user_id: int, user_data: dict = Depends(verify_token)):
+def award_training_point(user_id: int, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     if user_data.get("role") != "MASTER_ADMIN" and user_data.get("id") != user_id:
         raise HTTPException(status_code=403, detail="Unauthorized")
 
-    conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("""
@@ -1225,15 +1588,13 @@ def award_training_point(user_id: int, user_data: dict = Depends(verify_token)):
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail="Failed to award point")
-    finally:
-        conn.close()
 
 
 # =====================================================================
 # --- 2. MASTER ADMIN DASHBOARD ---
 # =====================================================================
 @app.get("/api/admin/dashboard-stats")
-def get_dashboard_stats(
+async def get_dashboard_stats(
     timeframe: str = "all",
     from_date: str = None,
     to_date: str = None,
@@ -1242,157 +1603,83 @@ def get_dashboard_stats(
     if user_data.get("role") != "MASTER_ADMIN":
         raise HTTPException(status_code=403, detail="Master Admin access required.")
 
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT name, role, branch FROM users")
-            users_info = {u['name']: {'role': u['role'], 'branch': u['branch']} for u in cur.fetchall()}
-
-            base_query = "SELECT assignee, status, applications, commission_earned, lead_temperature, created_at FROM students"
-            where_clause = ""
-
-            if timeframe == "30days":
-                where_clause = " WHERE created_at >= NOW() - INTERVAL '30 days'"
-            elif timeframe == "3months":
-                where_clause = " WHERE created_at >= NOW() - INTERVAL '3 months'"
-            elif timeframe == "6months":
-                where_clause = " WHERE created_at >= NOW() - INTERVAL '6 months'"
-            elif timeframe == "this_year":
-                where_clause = " WHERE EXTRACT(YEAR FROM created_at) = EXTRACT(YEAR FROM NOW())"
-            elif timeframe == "custom" and from_date and to_date:
-                where_clause = f" WHERE created_at::date BETWEEN '{from_date}' AND '{to_date}'"
-
-            cur.execute(base_query + where_clause)
-            students = cur.fetchall()
-
-            cur.execute("""
-                SELECT lead_temperature, status FROM students
-                WHERE created_at >= NOW() - INTERVAL '30 days'
-            """)
-            last_30_days = cur.fetchall()
+    # Aggregation happens in Postgres (see dashboard_stats.py); the queries
+    # are independent, so run them on separate pooled connections.
+    async def run(sql, params):
+        async with get_async_db_connection() as conn, conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchall()
 
-            cur.execute("""
-                SELECT lead_temperature, status FROM students
-                WHERE created_at >= NOW() - INTERVAL '60 days'
-                AND created_at < NOW() - INTERVAL '30 days'
-            """)
-            prev_30_days = cur.fetchall()
+    try:
+        freshness_rows = await run(ROLLUP_FRESHNESS_SQL, None)
+        freshness = freshness_rows[0] if freshness_rows else {}
+        # Served from the rollups once they've been built; until the first
+        # refresh completes, fall back to aggregating `students` directly.
+        source = "rollup" if freshness.get("last_full_rebuild_at") else "live"
+        build = build_rollup_queries if source == "rollup" else build_dashboard_queries
+        try:
+            queries = build(timeframe, from_date, to_date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="from_date and to_date must be YYYY-MM-DD.")
+
+        by_assignee, institutions, growth = await asyncio.gather(
+            run(*queries["by_assignee"]),
+            run(*queries["institutions"]),
+            run(*queries["growth"]),
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Database Query Error in Stats: {e}")
         raise HTTPException(status_code=500, detail="Database query failed.")
-    finally:
-        conn.close()
-
-    total_students = len(students)
-    in_progress = 0
-    completed = 0
-    dropped = 0
-    qualified_leads = 0
-    active_applications = 0
-    estimation_commission = 0.0
-    logged_commission = 0.0
-
-    agent_volume, agent_revenue = {}, {}
-    counsellor_volume, counsellor_revenue = {}, {}
-    institution_volume = {}
-    branch_pipeline = {}
-
-    for s in students:
-        status = (s.get("status") or "").upper()
-        temperature = (s.get("lead_temperature") or "").lower()
-        assignee = s.get("assignee") or "Unassigned"
-        info = users_info.get(assignee, {'role': 'Agent', 'branch': 'Unassigned'})
-        role = info['role'] or "Agent"
-        branch = info['branch'] or "Unassigned"
 
-        try:
-            commission = float(s.get("commission_earned") or 0.0)
-        except (ValueError, TypeError):
-            commission = 0.0
-
-        apps = s.get("applications")
-        if isinstance(apps, str):
-            try:
-                apps = json.loads(apps)
-            except Exception:
-                apps = []
-        if not isinstance(apps, list):
-            apps = []
-
-        if status == "COMPLETED":
-            completed += 1
-            logged_commission += commission
-        elif status == "REJECTED":
-            dropped += 1
-        else:
-            in_progress += 1
-            estimation_commission += commission
-
-        if "hot" in temperature or "warm" in temperature:
-            qualified_leads += 1
-
-        active_apps = [a for a in apps if isinstance(a, dict) and a.get("status") in ("Submitted", "Pending", "Under Review")]
-        active_applications += len(active_apps)
-
-        if role.upper() == "COUNSELLOR" or "counselor" in role.lower():
-            counsellor_volume[assignee] = counsellor_volume.get(assignee, 0) + 1
-            counsellor_revenue[assignee] = counsellor_revenue.get(assignee, 0.0) + commission
-        else:
-            agent_volume[assignee] = agent_volume.get(assignee, 0) + 1
-            agent_revenue[assignee] = agent_revenue.get(assignee, 0.0) + commission
-
-        for app in active_apps:
-            uni = app.get("university", "Unknown")
-            institution_volume[uni] = institution_volume.get(uni, 0) + 1
+    data = assemble_dashboard_stats(by_assignee, institutions, growth[0] if growth else {})
+    data["freshness"] = describe_freshness(freshness, source)
+    return {"status": "success", "data": data}
 
-        branch_pipeline[branch] = branch_pipeline.get(branch, 0) + 1
 
-    current_qualified = sum(1 for s in last_30_days if "hot" in (s.get("lead_temperature") or "").lower() or "warm" in (s.get("lead_temperature") or "").lower())
-    prev_qualified = sum(1 for s in prev_30_days if "hot" in (s.get("lead_temperature") or "").lower() or "warm" in (s.get("lead_temperature") or "").lower())
-
-    if prev_qualified > 0:
-        qualified_growth = round(((current_qualified - prev_qualified) / prev_qualified) * 100, 1)
-    elif current_qualified > 0:
-        qualified_growth = 100.0
-    else:
-        qualified_growth = 0.0
+@app.post("/api/admin/dashboard-rollups/refresh", dependencies=[Depends(get_current_master_admin)])
+def force_refresh_dashboard_rollups(full: bool = False, conn=Depends(get_db)):
+    """
+    Applies pending rollup changes now (full=true rebuilds from scratch)
+    instead of waiting for the background refresher.
+    """
+    try:
+        result = refresh_dashboard_rollups(conn, full=full)
+        if result is None:
+            raise HTTPException(status_code=409, detail="A rollup refresh is already running. Try again shortly.")
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(ROLLUP_FRESHNESS_SQL)
+            freshness = describe_freshness(cur.fetchone(), "rollup")
+        return {"status": "success", "data": {**result, "freshness": freshness}}
+    except HTTPException:
+        raise
+    except Exception as e:
+        conn.rollback()
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
 
-    def top5(d):
-        return [{"name": k, "value": v} for k, v in sorted(d.items(), key=lambda x: x[1], reverse=True)[:5]]
 
-    return {
-        "status": "success",
-        "data": {
-            "metrics": {
-                "total_students": total_students,
-                "in_progress": in_progress,
-                "completed": completed,
-                "dropped": dropped,
-                "qualified_leads": qualified_leads,
-                "qualified_growth": qualified_growth,
-                "active_applications": active_applications,
-                "estimation_commission": estimation_commission,
-                "logged_commission": logged_commission,
-                "total_business": logged_commission,
-                "avg_days_to_close": 24
-            },
-            "performance": {
-                "top_agents_volume": top5(agent_volume),
-                "top_agents_revenue": top5(agent_revenue),
-                "top_counsellors_volume": top5(counsellor_volume),
-                "top_counsellors_revenue": top5(counsellor_revenue),
-                "top_institutions": top5(institution_volume),
-                "branch_pipeline": [{"branch": k, "value": v} for k, v in sorted(branch_pipeline.items(), key=lambda x: x[1], reverse=True)]
-            }
-        }
-    }
+@app.get("/api/admin/institution-funnels", dependencies=[Depends(get_current_master_admin)])
+async def get_institution_funnels(institution_id: Optional[int] = None):
+    """
+    Applications per status for each institution (or just ?institution_id=),
+    busiest first. Only applications linked to an institution are counted.
+    """
+    try:
+        async with get_async_db_connection() as conn, conn.cursor() as cur:
+            await cur.execute(INSTITUTION_FUNNEL_SQL, {"institution_id": institution_id})
+            rows = await cur.fetchall()
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "success", "data": assemble_institution_funnels(rows)}
 
 
 @app.get("/api/admin/audit-logs")
-def get_audit_logs(limit: int = 100, user_data: dict = Depends(verify_token)):
+def get_audit_logs(limit: int = 100, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     if user_data.get("role") != "MASTER_ADMIN":
         raise HTTPException(status_code=403, detail="Not authorized to view audit logs")
-    conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
@@ -1406,13 +1693,10 @@ def get_audit_logs(limit: int = 100, user_data: dict = Depends(verify_token)):
             return {"status": "success", "data": logs}
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to load audit logs")
-    finally:
-        conn.close()
 
 
 @app.post("/api/admin/users", dependencies=[Depends(get_current_master_admin)])
-def create_admin_user(user: UserCreate):
-    conn = get_db_connection()
+def create_admin_user(user: UserCreate, conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             cur.execute("SELECT id FROM users WHERE email = %s", (user.email,))
@@ -1424,30 +1708,24 @@ def create_admin_user(user: UserCreate):
             """, (user.name, user.email, hashed, user.role))
             new_id = cur.fetchone()[0]
             conn.commit()
+            invalidate_user_cache()
             return {"status": "success", "message": "User created successfully", "user_id": new_id}
     except HTTPException:
         raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.get("/api/admin/users", dependencies=[Depends(get_current_master_admin)])
-def get_admin_users():
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT id, name, email, role FROM users ORDER BY name ASC")
-            return {"status": "success", "data": cur.fetchall()}
-    finally:
-        conn.close()
+def get_admin_users(conn=Depends(get_db)):
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT id, name, email, role FROM users ORDER BY name ASC")
+        return {"status": "success", "data": cur.fetchall()}
 
 
 @app.put("/api/admin/users/{user_id}", dependencies=[Depends(get_current_master_admin)])
-def update_admin_user(user_id: int, user: UserUpdate):
-    conn = get_db_connection()
+def update_admin_user(user_id: int, user: UserUpdate, conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             data = user.dict(exclude_unset=True)
@@ -1460,19 +1738,17 @@ def update_admin_user(user_id: int, user: UserUpdate):
                 conn.rollback()
                 raise HTTPException(status_code=404, detail="User not found.")
             conn.commit()
+            invalidate_user_cache()
             return {"status": "success", "message": "Agent profile updated successfully."}
     except HTTPException:
         raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.delete("/api/admin/users/{user_id}", dependencies=[Depends(get_current_master_admin)])
-def delete_admin_user(user_id: int):
-    conn = get_db_connection()
+def delete_admin_user(user_id: int, conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
@@ -1480,25 +1756,58 @@ def delete_admin_user(user_id: int):
                 conn.rollback()
                 raise HTTPException(status_code=404, detail="User not found.")
             conn.commit()
+            invalidate_user_cache()
             return {"status": "success", "message": "User permanently deleted."}
     except HTTPException:
         raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+
+# =====================================================================
+# --- DATABASE POOL METRICS ---
+# =====================================================================
+@app.get("/api/admin/db-pool", dependencies=[Depends(get_current_master_admin)])
+def get_db_pool_stats():
+    """Live connection-pool gauges (in use / idle / waiting) and checkout counters."""
+    return {"status": "success", "data": db_pool.stats()}
+
+
+@app.get("/api/admin/cache-stats", dependencies=[Depends(get_current_master_admin)])
+def get_cache_stats():
+    """Hit / miss counters for the user hierarchy cache (this worker only)."""
+    return {"status": "success", "data": {"user_directory": user_cache.stats()}}
+
+
+@app.get("/api/admin/schema-version", dependencies=[Depends(get_current_master_admin)])
+def get_schema_version(conn=Depends(get_db)):
+    """Applied / pending migrations (see migrations.py)."""
+    try:
+        return {"status": "success", "data": migration_status(conn)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/admin/query-plans", dependencies=[Depends(get_current_master_admin)])
+def get_hot_query_plans(conn=Depends(get_db)):
+    """
+    EXPLAINs the hot students queries against the live schema and flags any
+    whose plan doesn't use the index meant for it.
+    """
+    try:
+        return {"status": "success", "data": check_hot_query_plans(conn)}
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
 
 # =====================================================================
 # --- ACTIONABLE DASHBOARD QUEUE ---
 # =====================================================================
 @app.get("/api/admin/action-queue", dependencies=[Depends(get_current_master_admin)])
-def get_action_queue(user_data: dict = Depends(verify_token)):
+def get_action_queue(user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     """
     Returns 6 categories of actionable items for the Master Admin command center.
     Each category includes: count, sample items (max 3), label, description.
     """
-    conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
  
@@ -1521,11 +1830,10 @@ def get_action_queue(user_data: dict = Depends(verify_token)):
             # 2. STUDENTS WITH MISSING DOCUMENTS (< 3 docs on file)
             # ============================================================
             cur.execute("""
-                SELECT id, name, assignee,
-                       COALESCE(jsonb_array_length(documents), 0) as doc_count
+                SELECT id, name, assignee, doc_count
                 FROM students
                 WHERE UPPER(COALESCE(status, '')) NOT IN ('COMPLETED', 'REJECTED', 'ARCHIVED')
-                  AND COALESCE(jsonb_array_length(documents), 0) < 3
+                  AND doc_count < 3
                 ORDER BY created_at DESC
                 LIMIT 50
             """)
@@ -1599,37 +1907,19 @@ def get_action_queue(user_data: dict = Depends(verify_token)):
             # ============================================================
             # 6. TODAY'S REMINDERS (timeline notes with reminder_date = today)
             # ============================================================
+            # Indexed lookup on timeline_entries.reminder_date; the earliest
+            # note per student keeps the list clean.
             cur.execute("""
-                SELECT id, name, assignee, timeline
-                FROM students
-                WHERE timeline IS NOT NULL
-                  AND UPPER(COALESCE(status, '')) != 'ARCHIVED'
-            """)
-            all_with_timeline = cur.fetchall()
- 
-            today_iso = today.isoformat()
-            todays_reminders = []
-            for s in all_with_timeline:
-                timeline = s.get('timeline')
-                if not timeline:
-                    continue
-                if isinstance(timeline, str):
-                    try:
-                        timeline = json.loads(timeline)
-                    except Exception:
-                        continue
-                if not isinstance(timeline, list):
-                    continue
-                for note in timeline:
-                    if isinstance(note, dict) and note.get('reminder_date') == today_iso:
-                        todays_reminders.append({
-                            'student_id': s['id'],
-                            'student_name': s['name'],
-                            'assignee': s.get('assignee'),
-                            'note': (note.get('note') or note.get('content') or '')[:120],
-                            'author': note.get('author', 'Unknown')
-                        })
-                        break  # only one reminder per student to keep list clean
+                SELECT DISTINCT ON (t.student_id)
+                       t.student_id, s.name AS student_name, s.assignee,
+                       LEFT(t.note, 120) AS note, t.author
+                FROM timeline_entries t
+                JOIN students s ON s.id = t.student_id
+                WHERE t.reminder_date = %s
+                  AND UPPER(COALESCE(s.status, '')) != 'ARCHIVED'
+                ORDER BY t.student_id, t.created_at, t.id
+            """, (today,))
+            todays_reminders = [dict(r) for r in cur.fetchall()]
  
             # ============================================================
             # HELPER: serialize dates / datetime for JSON
@@ -1686,8 +1976,6 @@ def get_action_queue(user_data: dict = Depends(verify_token)):
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Action queue error: {str(e)}")
-    finally:
-        conn.close()
 
 # =====================================================================
 # --- 3. AI PROGRAM SEARCH ---
@@ -1719,33 +2007,197 @@ def ai_program_search(query: str = "Popular business degrees in Australia"):
 # =====================================================================
 # --- 4. PIPELINE ---
 # =====================================================================
+# Large per-student blobs are left out of the pipeline list unless asked for
+# with ?fields=documents,timeline (or fields=* for everything).
+PIPELINE_HEAVY_COLUMNS = ("pdf_text", "ai_report", "timeline", "documents")
+PIPELINE_DEFAULT_LIMIT = 100
+PIPELINE_MAX_LIMIT = 500
+_students_columns_cache: list = []
+
+
+async def _get_students_columns(conn) -> list:
+    """Column names of `students`, read once per process."""
+    if not _students_columns_cache:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_name = 'students' AND table_schema = current_schema()
+                ORDER BY ordinal_position
+            """)
+            _students_columns_cache.extend(r["column_name"] for r in await cur.fetchall())
+    return _students_columns_cache
+
+
+def _encode_pipeline_cursor(row: dict) -> str:
+    created = row.get("created_at")
+    payload = {"c": created.isoformat() if created else None, "i": int(row["id"])}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def _decode_pipeline_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created = datetime.fromisoformat(payload["c"]) if payload.get("c") else None
+        return created, int(payload["i"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pipeline cursor.")
+
+
+def _split_param(value: Optional[str]) -> list:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+# ---------------------------------------------------------------------
+# Timeline notes live in the append-only timeline_entries table (migration
+# 14). Adding one is a single-row INSERT rather than rewriting the
+# students.timeline JSONB array. Readers still get the old list shape:
+# {date, author, note, reminder_date}, oldest first.
+# ---------------------------------------------------------------------
+TIMELINE_ENTRY_JSON_SQL = """
+    json_build_object(
+        'date', to_char(created_at, 'YYYY-MM-DD HH24:MI'), 'author', author,
+        'note', note, 'reminder_date', reminder_date
+    )
+"""
+
+
+def add_timeline_entry(cur, student_id, author: str, note: str, reminder_date=None):
+    """Appends a note to a student's timeline inside the caller's transaction."""
+    cur.execute("""
+        INSERT INTO timeline_entries (student_id, author, note, reminder_date)
+        VALUES (%s, %s, %s, %s)
+    """, (int(student_id), author or "Unknown", note or "", reminder_date or None))
+
+
+async def _timelines_async(conn, student_ids: list) -> dict:
+    """student_id -> timeline list, for a page of students in one query."""
+    if not student_ids:
+        return {}
+    async with conn.cursor() as cur:
+        await cur.execute(f"""
+            SELECT student_id, json_agg({TIMELINE_ENTRY_JSON_SQL} ORDER BY created_at, id) AS timeline
+            FROM timeline_entries
+            WHERE student_id = ANY(%s)
+            GROUP BY student_id
+        """, (student_ids,))
+        return {r["student_id"]: r["timeline"] for r in await cur.fetchall()}
+
+
 @app.get("/api/pipeline")
-def get_pipeline(
+async def get_pipeline(
+    response: Response,
     role: str = None,           # ⚠️ IGNORED — kept only for backward compat
     agent_code: str = None,     # ⚠️ IGNORED — kept only for backward compat  
+    limit: int = PIPELINE_DEFAULT_LIMIT,
+    cursor: str = None,
+    fields: str = None,
+    status: str = None,
+    temperature: str = None,
+    assignee: str = None,
     user_data: dict = Depends(verify_token)
 ):
     """
-    Return students visible to the authenticated user.
-    Authorization derived from JWT — query params are ignored.
-    Uses get_visible_student_filter which correctly checks BOTH
-    the legacy `assignee` column AND the `assignees` JSONB array.
+    Return students visible to the authenticated user, newest first.
+    Authorization derived from JWT — role/agent_code params are ignored.
+    Uses get_visible_student_filter, which matches on the student_assignees
+    join table (so the primary and every co-assignee count).
+
+    Pagination is keyset on (created_at, id): pass back `next_cursor`
+    (also in the X-Next-Cursor header) as ?cursor= for the next page; it is
+    null on the last page. The first page also carries X-Total-Count.
+    Filters (comma-separated for several values): status, temperature, assignee.
     """
-    conn = get_db_connection()
-    try:
-        clause, params = get_visible_student_filter(user_data, conn)
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                f"SELECT * FROM students WHERE {clause} ORDER BY created_at DESC",
-                params
+    limit = max(1, min(limit, PIPELINE_MAX_LIMIT))
+    requested = set(_split_param(fields))
+
+    async with get_async_db_connection() as conn:
+        columns = await _get_students_columns(conn)
+        if "*" in requested:
+            selected = columns
+        else:
+            unknown = requested - set(PIPELINE_HEAVY_COLUMNS)
+            if unknown:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Unknown fields: {', '.join(sorted(unknown))}. Allowed: {', '.join(PIPELINE_HEAVY_COLUMNS)} or *."
+                )
+            selected = [c for c in columns if c not in PIPELINE_HEAVY_COLUMNS or c in requested]
+        # The legacy columns are frozen; timelines, documents and applications
+        # come from timeline_entries, student_documents and student_applications.
+        with_timeline = "timeline" in selected
+        with_documents = "documents" in selected
+        with_applications = "applications" in selected
+        selected = [c for c in selected if c not in ("timeline", "documents", "applications")]
+
+        clause, params = await get_visible_student_filter_async(user_data, conn)
+        where, where_params = [clause], list(params)
+
+        statuses = [s.upper() for s in _split_param(status)]
+        if statuses:
+            where.append("UPPER(COALESCE(status, '')) = ANY(%s)")
+            where_params.append(statuses)
+        temperatures = [t.lower() for t in _split_param(temperature)]
+        if temperatures:
+            where.append("LOWER(COALESCE(lead_temperature, '')) = ANY(%s)")
+            where_params.append(temperatures)
+        assignee_names = _split_param(assignee)
+        if assignee_names:
+            where.append(ASSIGNED_TO_USER_NAMES_SQL)
+            where_params.append(list(dict.fromkeys(assignee_names)))
+
+        # Keyset predicate matching ORDER BY created_at DESC, id DESC
+        # (Postgres sorts NULL created_at first in DESC order).
+        page_where, page_params = list(where), list(where_params)
+        if cursor:
+            after_created, after_id = _decode_pipeline_cursor(cursor)
+            if after_created is None:
+                page_where.append("((created_at IS NULL AND id < %s) OR created_at IS NOT NULL)")
+                page_params.append(after_id)
+            else:
+                page_where.append("(created_at, id) < (%s, %s)")
+                page_params.extend([after_created, after_id])
+
+        column_sql = ", ".join(f'"{c}"' for c in selected)
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"SELECT {column_sql} FROM students WHERE {' AND '.join(page_where)} "
+                f"ORDER BY created_at DESC, id DESC LIMIT %s",
+                page_params + [limit + 1]
             )
-            students = cur.fetchall()
-            for s in students:
-                s['id'] = str(s['id'])
-            return {"status": "success", "data": students}
-    finally:
-        conn.close()
+            students = await cur.fetchall()
+
+            # Count once, on the first page only; later pages reuse the client's copy.
+            if not cursor:
+                await cur.execute(
+                    f"SELECT COUNT(*) AS total FROM students WHERE {' AND '.join(where)}",
+                    where_params
+                )
+                response.headers["X-Total-Count"] = str((await cur.fetchone())["total"])
+
+        page = students[:limit]
+        if with_timeline:
+            timelines = await _timelines_async(conn, [s["id"] for s in page])
+            for s in page:
+                s["timeline"] = timelines.get(s["id"], [])
+        if with_documents:
+            documents = await documents_for_students_async(conn, [s["id"] for s in page])
+            for s in page:
+                s["documents"] = documents.get(s["id"], [])
+        if with_applications:
+            applications = await applications_for_students_async(conn, [s["id"] for s in page])
+            for s in page:
+                s["applications"] = applications.get(s["id"], [])
+
+    next_cursor = None
+    if len(students) > limit:
+        students = students[:limit]
+        next_cursor = _encode_pipeline_cursor(students[-1])
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    for s in students:
+        s['id'] = str(s['id'])
+    return {"status": "success", "data": students, "next_cursor": next_cursor}
 
 # 🔒 SECURED create_lead — auth required, file validation, two-phase save
 @app.post("/api/pipeline")
@@ -1760,23 +2212,22 @@ async def create_lead(
     psych_tests: List[UploadFile] = File(default=[]),
     user_data: dict = Depends(verify_token)
 ):
-    conn = None
     try:
-        conn = get_db_connection()
-
         # Phase 1: INSERT student first to get a stable ID for filenames
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO students (name, email, phone, assignee, status, notes, documents, pdf_text, budget)
-                VALUES (%s, %s, %s, %s, 'NEW LEAD', %s, '[]'::jsonb, '', %s)
-                RETURNING id
-            """, (name, email, phone, assignee, notes, budget))
-            new_id = cur.fetchone()[0]
+        async with checkout_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO students (name, email, phone, assignee, status, notes, pdf_text, budget)
+                    VALUES (%s, %s, %s, %s, 'NEW LEAD', %s, '', %s)
+                    RETURNING id
+                """, (name, email, phone, assignee, notes, budget))
+                new_id = cur.fetchone()[0]
             conn.commit()
 
-        # Phase 2: process files with proper S{id}_ prefix
+        # Phase 2: process files with proper S{id}_ prefix (no connection held)
         extracted_pdf_text = ""
         saved_documents = []
+        extractions = []  # (storage filename, document_extractions record)
         upload_errors = []
         all_files = [(f, "REPORT CARD") for f in report_cards] + [(f, "PSYCHOLOGY TEST") for f in psych_tests]
 
@@ -1795,64 +2246,67 @@ async def create_lead(
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
             safe_filename = f"S{new_id}_{title.replace(' ', '_')}_{timestamp}_{clean_original}"
 
+            # ✅ Stream to disk: size cap, MIME sniff and sha256 in one pass
             try:
-                file_bytes = await file.read()
+                spooled = await spool_upload(file, MAX_FILE_SIZE_BYTES)
+            except UploadRejected as rejected:
+                upload_errors.append(f"{file.filename}: {rejected}")
+                continue
             except Exception:
                 upload_errors.append(f"{file.filename}: could not read")
                 continue
 
-            # ✅ Size check
-            if len(file_bytes) > MAX_FILE_SIZE_BYTES:
-                upload_errors.append(f"{file.filename}: too large (max {MAX_FILE_SIZE_MB}MB)")
-                continue
-            if len(file_bytes) == 0:
-                upload_errors.append(f"{file.filename}: empty file")
-                continue
-
-            if supabase:
-                try:
-                    supabase.storage.from_("student-documents").upload(
-                        path=safe_filename,
-                        file=file_bytes,
-                        file_options={"content-type": file.content_type or "application/octet-stream"}
-                    )
-                except Exception as supa_err:
-                    print(f"[create_lead] Supabase error: {supa_err}")
-                    upload_errors.append(f"{file.filename}: cloud storage failed")
+            with spooled:
+                if supabase:
+                    try:
+                        await asyncio.to_thread(
+                            upload_to_storage, supabase.storage.from_("student-documents"),
+                            safe_filename, spooled
+                        )
+                    except Exception as supa_err:
+                        print(f"[create_lead] Supabase error: {supa_err}")
+                        upload_errors.append(f"{file.filename}: cloud storage failed")
+                        continue
+                else:
+                    upload_errors.append(f"{file.filename}: cloud storage not configured")
                     continue
-            else:
-                upload_errors.append(f"{file.filename}: cloud storage not configured")
-                continue
 
-            saved_documents.append({
-                "title": f"{title} - {file.filename}",
-                "filename": safe_filename,
-                "uploaded_by": user_data.get("name", "Unknown"),
-                "uploaded_at": datetime.now().isoformat(),
-                "size_bytes": len(file_bytes)
-            })
+                saved_documents.append({
+                    "title": f"{title} - {file.filename}",
+                    "filename": safe_filename,
+                    "size_bytes": spooled.size,
+                    "sha256": spooled.sha256
+                })
 
-            if file.filename.lower().endswith('.pdf'):
-                try:
-                    reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
+                # Extract once here; AI consumers read document_extractions
+                record = await extract_file_async(
+                    spooled.path, media_type_for(safe_filename) or spooled.content_type,
+                    spooled.sha256, spooled.size
+                )
+                extractions.append((safe_filename, record))
+                if record["method"] == "pypdf2":
                     extracted_pdf_text += f"\n\n--- [BEGIN {title} - {file.filename}] ---\n"
-                    extracted_pdf_text += "\n".join([page.extract_text() or "" for page in reader.pages])
-                except Exception:
-                    pass
+                    extracted_pdf_text += "\n".join(record["pages"])
 
-        # Phase 3: UPDATE student with documents + pdf_text
+        # Phase 3: record documents + pdf_text
         if saved_documents or extracted_pdf_text:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "UPDATE students SET documents = %s::jsonb, pdf_text = %s WHERE id = %s",
-                    (json.dumps(saved_documents), extracted_pdf_text, new_id)
-                )
-
-                log_audit_event(
-                    conn=conn, action="CREATE_LEAD", entity="Student",
-                    entity_id=str(new_id), changed_by=user_data.get("name", "Unknown"),
-                    details={"documents_added": [d["title"] for d in saved_documents]}
-                )
+            async with checkout_db_connection() as conn:
+                with conn.cursor() as cur:
+                    for doc in saved_documents:
+                        add_document(
+                            cur, new_id, doc["filename"], doc["title"], user_data.get("name", "Unknown"),
+                            doc["size_bytes"], doc["sha256"]
+                        )
+                    if extracted_pdf_text:
+                        cur.execute("UPDATE students SET pdf_text = %s WHERE id = %s", (extracted_pdf_text, new_id))
+                    for filename, record in extractions:
+                        save_extraction(conn, filename, record, student_id=new_id)
+
+                    log_audit_event(
+                        conn=conn, action="CREATE_LEAD", entity="Student",
+                        entity_id=str(new_id), changed_by=user_data.get("name", "Unknown"),
+                        details={"documents_added": [d["title"] for d in saved_documents]}
+                    )
                 conn.commit()
 
         msg = "Lead & Documents saved to Cloud!"
@@ -1866,19 +2320,13 @@ async def create_lead(
             "errors": upload_errors if upload_errors else None
         }
     except Exception as e:
-        if conn:
-            conn.rollback()
         print("[create_lead] FATAL:")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to create lead: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
 
 @app.put("/api/pipeline/{case_id}")
-def update_lead(case_id: str, req: UpdateLeadRequest, user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
+def update_lead(case_id: str, req: UpdateLeadRequest, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             # ⬇️ RBAC GUARD — check if reassigning vs editing
@@ -1942,16 +2390,7 @@ def update_lead(case_id: str, req: UpdateLeadRequest, user_data: dict = Depends(
             if req.status and req.status.lower() == "archived":
                 agent_name = user_data.get("name", "Admin") if user_data else "Admin"
                 reason = req.archive_reason or "No reason specified"
-                new_entry = {
-                    "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    "author": agent_name,
-                    "note": f"{agent_name} archived student.\nReason: {reason}.",
-                    "reminder_date": None
-                }
-                cur.execute(
-                    "UPDATE students SET timeline = timeline || %s::jsonb WHERE id = %s",
-                    (json.dumps([new_entry]), case_id)
-                )
+                add_timeline_entry(cur, case_id, agent_name, f"{agent_name} archived student.\nReason: {reason}.")
 
             agent_name = user_data.get("name", "Unknown") if user_data else "Unknown"
             log_audit_event(
@@ -1963,13 +2402,10 @@ def update_lead(case_id: str, req: UpdateLeadRequest, user_data: dict = Depends(
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.delete("/api/pipeline/{case_id}")
-def delete_lead(case_id: str):
-    conn = get_db_connection()
+def delete_lead(case_id: str, conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM students WHERE id = %s", (case_id,))
@@ -1978,8 +2414,6 @@ def delete_lead(case_id: str):
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail="Database deletion error.")
-    finally:
-        conn.close()
 
 # =====================================================================
 # --- SPRINT A: DEDICATED ARCHIVE / REASSIGN ENDPOINT ---
@@ -1988,15 +2422,13 @@ def delete_lead(case_id: str):
 def archive_student(
     case_id: str,
     req: ArchiveStudentRequest,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
 ):
     """Archive a student or reassign to another agent.
     Special case: reason='apply_through_other_agent' triggers reassign instead.
     """
-    conn = None
     try:
-        conn = get_db_connection()
-
         if not check_student_access(conn, case_id, user_data):
             raise HTTPException(status_code=403, detail="Not authorized for this student.")
 
@@ -2007,25 +2439,16 @@ def archive_student(
                 raise HTTPException(status_code=404, detail="Student not found.")
 
         actor_name = user_data.get("name", "Unknown")
-        now_iso = datetime.now().isoformat()
 
         # Special case: reassign instead of archive
         if req.reason == "apply_through_other_agent":
             if not req.new_agent:
                 raise HTTPException(status_code=400, detail="new_agent required when reason is apply_through_other_agent.")
             old_agent = student.get("assignee") or "Unassigned"
-            timeline_note = {
-                "date": now_iso[:16].replace("T", " "),
-                "author": actor_name,
-                "note": f"Reassigned from {old_agent} to {req.new_agent}. Reason: Applying through other agent.{(' - ' + req.notes) if req.notes else ''}"
-            }
+            timeline_note = f"Reassigned from {old_agent} to {req.new_agent}. Reason: Applying through other agent.{(' - ' + req.notes) if req.notes else ''}"
             with conn.cursor() as cur:
-                cur.execute("""
-                    UPDATE students
-                    SET assignee = %s,
-                        timeline = COALESCE(timeline, '[]'::jsonb) || %s::jsonb
-                    WHERE id = %s
-                """, (req.new_agent, json.dumps([timeline_note]), case_id))
+                cur.execute("UPDATE students SET assignee = %s WHERE id = %s", (req.new_agent, case_id))
+                add_timeline_entry(cur, case_id, actor_name, timeline_note)
 
                 # Log to chat_messages (teammate's system)
                 try:
@@ -2053,20 +2476,16 @@ def archive_student(
             "other": "Other"
         }.get(req.reason, req.reason)
 
-        timeline_note = {
-            "date": now_iso[:16].replace("T", " "),
-            "author": actor_name,
-            "note": f"Archived. Reason: {reason_pretty}.{(' - ' + req.notes) if req.notes else ''}"
-        }
+        timeline_note = f"Archived. Reason: {reason_pretty}.{(' - ' + req.notes) if req.notes else ''}"
 
         with conn.cursor() as cur:
             cur.execute("""
                 UPDATE students
                 SET status = 'ARCHIVED',
-                    archive_reason = %s,
-                    timeline = COALESCE(timeline, '[]'::jsonb) || %s::jsonb
+                    archive_reason = %s
                 WHERE id = %s
-            """, (reason_pretty, json.dumps([timeline_note]), case_id))
+            """, (reason_pretty, case_id))
+            add_timeline_entry(cur, case_id, actor_name, timeline_note)
 
             # Log to chat_messages
             try:
@@ -2094,9 +2513,6 @@ def archive_student(
         if conn:
             conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
 
 
 # 🔒 SECURED upload_additional_document
@@ -2108,44 +2524,30 @@ async def upload_additional_document(
     doc_type: str = Form(None),
     user_data: dict = Depends(verify_token)
 ):
-    conn = None
-    cur = None
     try:
-        conn = get_db_connection()
+        # No connection is held across the storage upload and extraction
+        # below: check access, release it, and check out again to write.
+        async with checkout_db_connection() as conn:
+            # ✅ ACCESS CHECK
+            if not check_student_access(conn, case_id, user_data):
+                log_audit_event(
+                    conn=conn, action="DENIED_UPLOAD", entity="Student",
+                    entity_id=case_id, changed_by=user_data.get("name", "Unknown"),
+                    details={"reason": "not_authorized_for_student"}
+                )
+                conn.commit()
+                raise HTTPException(
+                    status_code=403,
+                    detail="You do not have permission to upload documents for this student."
+                )
 
-        # ✅ ACCESS CHECK
-        if not check_student_access(conn, case_id, user_data):
-            log_audit_event(
-                conn=conn, action="DENIED_UPLOAD", entity="Student",
-                entity_id=case_id, changed_by=user_data.get("name", "Unknown"),
-                details={"reason": "not_authorized_for_student"}
-            )
-            conn.commit()
-            raise HTTPException(
-                status_code=403,
-                detail="You do not have permission to upload documents for this student."
-            )
-
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT documents, pdf_text FROM students WHERE id = %s", (case_id,))
-        student = cur.fetchone()
-        if not student:
-            raise HTTPException(status_code=404, detail="Student not found.")
-
-        raw_docs = student.get('documents')
-        if raw_docs is None:
-            current_docs = []
-        elif isinstance(raw_docs, str):
-            try:
-                current_docs = json.loads(raw_docs)
-            except Exception:
-                current_docs = []
-        elif isinstance(raw_docs, list):
-            current_docs = raw_docs
-        else:
-            current_docs = []
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM students WHERE id = %s", (case_id,))
+                if not cur.fetchone():
+                    raise HTTPException(status_code=404, detail="Student not found.")
 
-        current_text = student.get('pdf_text') or ""
+        new_docs = []
+        new_text = ""
 
         files_to_process = []
         if report_card:
@@ -2162,6 +2564,7 @@ async def upload_additional_document(
 
         doc_titles = []
         upload_errors = []
+        extractions = []  # (storage filename, document_extractions record)
 
         for file, title in files_to_process:
             # ✅ MIME CHECK
@@ -2175,77 +2578,78 @@ async def upload_additional_document(
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
             safe_filename = f"S{case_id}_{title.replace(' ', '_')}_{timestamp}_{clean_original}"
 
+            # ✅ STREAM TO DISK: size cap, MIME sniff and sha256 in one pass
             try:
-                file_bytes = await file.read()
+                spooled = await spool_upload(file, MAX_FILE_SIZE_BYTES)
+            except UploadRejected as rejected:
+                upload_errors.append(f"{file.filename}: {rejected}")
+                continue
             except Exception as e:
                 print(f"[upload] Failed to read {file.filename}: {e}")
                 upload_errors.append(f"Could not read {file.filename}")
                 continue
 
-            # ✅ SIZE CHECK
-            if len(file_bytes) > MAX_FILE_SIZE_BYTES:
-                upload_errors.append(f"{file.filename}: file too large ({len(file_bytes) // 1024 // 1024}MB, max {MAX_FILE_SIZE_MB}MB)")
-                continue
-            if len(file_bytes) == 0:
-                upload_errors.append(f"{file.filename}: empty file")
-                continue
-
-            if supabase:
-                try:
-                    supabase.storage.from_("student-documents").upload(
-                        path=safe_filename,
-                        file=file_bytes,
-                        file_options={
-                            "content-type": file.content_type or "application/octet-stream"
-                        }
-                    )
-                except Exception as supa_err:
-                    print(f"[upload] Supabase error for {safe_filename}: {supa_err}")
-                    upload_errors.append(f"Cloud vault error: {str(supa_err)[:100]}")
+            with spooled:
+                if supabase:
+                    try:
+                        await asyncio.to_thread(
+                            upload_to_storage, supabase.storage.from_("student-documents"),
+                            safe_filename, spooled
+                        )
+                    except Exception as supa_err:
+                        print(f"[upload] Supabase error for {safe_filename}: {supa_err}")
+                        upload_errors.append(f"Cloud vault error: {str(supa_err)[:100]}")
+                        continue
+                else:
+                    print("[upload] WARNING: Supabase not configured")
+                    upload_errors.append("Cloud storage not configured")
                     continue
-            else:
-                print("[upload] WARNING: Supabase not configured")
-                upload_errors.append("Cloud storage not configured")
-                continue
 
-            current_docs.append({
-                "title": f"{title} - {file.filename}",
-                "filename": safe_filename,
-                "uploaded_by": user_data.get("name", "Unknown"),
-                "uploaded_at": datetime.now().isoformat(),
-                "size_bytes": len(file_bytes)
-            })
-            doc_titles.append(f"{title} - {file.filename}")
+                new_docs.append((safe_filename, f"{title} - {file.filename}", spooled.size, spooled.sha256))
+                doc_titles.append(f"{title} - {file.filename}")
 
-            if file.filename and file.filename.lower().endswith('.pdf'):
-                try:
-                    reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
-                    current_text += f"\n\n--- [BEGIN {title} - {file.filename}] ---\n"
-                    current_text += "\n".join([page.extract_text() or "" for page in reader.pages])
-                except Exception as pdf_err:
-                    print(f"[upload] PDF extraction failed: {pdf_err}")
+                # Extract once here; AI consumers read document_extractions
+                record = await extract_file_async(
+                    spooled.path, media_type_for(safe_filename) or spooled.content_type,
+                    spooled.sha256, spooled.size
+                )
+                extractions.append((safe_filename, record))
+                if record["method"] == "pypdf2":
+                    new_text += f"\n\n--- [BEGIN {title} - {file.filename}] ---\n"
+                    new_text += "\n".join(record["pages"])
+                elif record["error"]:
+                    print(f"[upload] PDF extraction failed: {record['error']}")
 
         if upload_errors and not doc_titles:
             raise HTTPException(status_code=400, detail="; ".join(upload_errors))
 
-        cur.execute(
-            "UPDATE students SET documents = %s::jsonb, pdf_text = %s WHERE id = %s",
-            (json.dumps(current_docs), current_text, case_id)
-        )
-
+        # Row inserts and an in-place append, so concurrent uploads can't
+        # overwrite each other's entries.
         agent_name = user_data.get("name", "Unknown")
-        for doc_title in doc_titles:
-            cur.execute("""
-                INSERT INTO chat_messages (student_id, sender, message, is_system)
-                VALUES (%s, 'System', %s, TRUE)
-            """, (int(case_id), f"{agent_name} uploaded {doc_title}"))
-        if doc_titles:
-            log_audit_event(
-                conn=conn, action="UPLOAD_DOC", entity="Student",
-                entity_id=case_id, changed_by=agent_name,
-                details={"documents_added": doc_titles}
-            )
-        conn.commit()
+        async with checkout_db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                for filename, title, size_bytes, sha256 in new_docs:
+                    add_document(cur, case_id, filename, title, agent_name, size_bytes, sha256)
+                if new_text:
+                    cur.execute(
+                        "UPDATE students SET pdf_text = COALESCE(pdf_text, '') || %s WHERE id = %s",
+                        (new_text, case_id)
+                    )
+                for filename, record in extractions:
+                    save_extraction(conn, filename, record, student_id=int(case_id))
+
+                for doc_title in doc_titles:
+                    cur.execute("""
+                        INSERT INTO chat_messages (student_id, sender, message, is_system)
+                        VALUES (%s, 'System', %s, TRUE)
+                    """, (int(case_id), f"{agent_name} uploaded {doc_title}"))
+                if doc_titles:
+                    log_audit_event(
+                        conn=conn, action="UPLOAD_DOC", entity="Student",
+                        entity_id=case_id, changed_by=agent_name,
+                        details={"documents_added": doc_titles}
+                    )
+            conn.commit()
 
         msg = "Documents securely added to vault."
         if upload_errors:
@@ -2263,118 +2667,173 @@ async def upload_additional_document(
     except Exception as e:
         print(f"[upload] FATAL error:")
         traceback.print_exc()
-        if conn:
-            conn.rollback()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 
 
 @app.post("/api/pipeline/{case_id}/notes")
-def add_timeline_note(case_id: str, req: TimelineNote):
-    new_entry = {
-        "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-        "author": req.author,
-        "note": req.note,
-        "reminder_date": req.reminder_date
-    }
-    conn = get_db_connection()
+def add_timeline_note(case_id: str, req: TimelineNote, conn=Depends(get_db)):
+    if req.reminder_date:
+        try:
+            date.fromisoformat(req.reminder_date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="reminder_date must be YYYY-MM-DD.")
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE students SET timeline = timeline || %s::jsonb WHERE id = %s",
-                (json.dumps([new_entry]), case_id)
-            )
+            add_timeline_entry(cur, case_id, req.author, req.note, req.reminder_date)
             conn.commit()
             return {"status": "success", "message": "Note added to timeline!"}
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail="Database update error.")
-    finally:
-        conn.close()
 
 
-def extract_mentions(message_text: str, conn):
-    import re
-    # Extract @username patterns. Matches alphanumeric, space, dot, hyphen.
-    tokens = re.findall(r'@([a-zA-Z0-9_\s\-\.]+)', message_text)
-    mentioned_users = []
-    
-    with conn.cursor() as cur:
-        # Fetch active users in system
-        cur.execute("SELECT name FROM users WHERE is_active = TRUE")
-        users = [r[0] for r in cur.fetchall()]
-        
-    for token in tokens:
-        token_clean = token.strip().lower()
-        if not token_clean:
-            continue
-        for u in users:
-            words = u.lower().split()
-            # If token matches any prefix of word in user name, or token is exact username
-            if any(w.startswith(token_clean) for w in words) or token_clean == u.lower():
-                if u not in mentioned_users:
-                    mentioned_users.append(u)
-    return mentioned_users
+def mention_index(conn) -> MentionIndex:
+    """Trie over active user names; rebuilt when invalidate_user_cache() runs."""
+    def load():
+        with conn.cursor() as cur:
+            cur.execute("SELECT name FROM users WHERE is_active = TRUE")
+            return MentionIndex(r[0] for r in cur.fetchall())
+
+    return user_cache.get(("mention_index",), load)
+
+
+def extract_mentions(message_text: str, conn) -> list:
+    return mention_index(conn).resolve(message_text)
+
+
+def notify_mentions(cur, student_id: int, sender: str, mentions: list):
+    """
+    One multi-row INSERT of a notification per mentioned user (the sender
+    excluded). `cur` is a RealDictCursor inside the caller's transaction.
+    """
+    recipients = [name for name in mentions if name != sender]
+    if not recipients:
+        return
+    cur.execute("SELECT name FROM students WHERE id = %s", (student_id,))
+    row = cur.fetchone()
+    student_name = row["name"] if row else f"#{student_id}"
+    text = f"{sender} mentioned you in the chat for {student_name}"
+    execute_values(cur, """
+        INSERT INTO notifications (recipient_username, sender, message)
+        VALUES %s
+    """, [(name, sender, text) for name in recipients])
+
+
+# Team chat excludes SYSTEM events — they belong in audit, not chat.
+TEAM_CHAT_FILTER_SQL = """
+    is_system = FALSE
+    AND sender NOT IN ('System', 'System AI', 'SYSTEM')
+    AND message NOT LIKE 'SYSTEM:%%'
+"""
+
+
+def is_team_chat_message(row: dict) -> bool:
+    """Python twin of TEAM_CHAT_FILTER_SQL, for rows pushed by the realtime trigger."""
+    return (not row.get("is_system")
+            and row.get("sender") not in ("System", "System AI", "SYSTEM")
+            and not (row.get("message") or "").startswith("SYSTEM:"))
+
+
+def normalize_chat_message(m: dict) -> dict:
+    """Shape a chat_messages row for the frontend."""
+    m['id'] = str(m['id'])
+    if m.get('created_at') and not isinstance(m['created_at'], str):
+        m['created_at'] = m['created_at'].isoformat()
+    if m.get('mentioned_users') is None:
+        m['mentioned_users'] = []
+    if m.get('read_by') is None:
+        m['read_by'] = []
+    return m
+
+
+# Read receipts are one high-water mark per (student, user) in chat_read_state;
+# a message's read_by is derived from them. Pages are keyed by message id.
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "100"))
+CHAT_PAGE_MAX = 500
+
+
+def attach_read_by(messages: list, read_states: list) -> list:
+    """Fills each message's read_by from the thread's read high-water marks."""
+    for m in messages:
+        m["read_by"] = [
+            {"user": r["user_name"], "read_at": r["read_at"].strftime("%Y-%m-%d %H:%M")}
+            for r in read_states
+            if r["last_read_id"] >= int(m["id"])
+        ]
+    return messages
 
 
 @app.get("/api/pipeline/{case_id}/chat")
-def get_chat_messages(case_id: str, user_data: dict = Depends(verify_token)):
+async def get_chat_messages(
+    case_id: int,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = CHAT_PAGE_SIZE,
+    user_data: dict = Depends(verify_token)
+):
     """
-    Returns ONLY real team messages (no SYSTEM events).
+    Returns ONLY real team messages (no SYSTEM events), oldest first.
     Restricted to assignees + Master Admin.
+      - no cursor: the latest `limit` messages
+      - ?before_id=: the `limit` messages before that id (scrolling back)
+      - ?after_id=: up to `limit` messages after that id (catching up)
+    `has_more` says whether older messages exist beyond this page (or, with
+    after_id, newer ones).
     """
-    conn = get_db_connection()
+    limit = max(1, min(limit, CHAT_PAGE_MAX))
     try:
-        # Access check
-        if not can_access_student_chat(conn, case_id, user_data):
-            raise HTTPException(
-                status_code=403,
-                detail="You don't have access to this student's chat."
-            )
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Filter out SYSTEM messages — they belong in audit, not chat
-            cur.execute("""
-                SELECT id, student_id, sender, message, mentioned_users, 
-                       read_by, is_system, created_at
-                FROM chat_messages
-                WHERE student_id = %s
-                AND is_system = FALSE
-                AND sender NOT IN ('System', 'System AI', 'SYSTEM')
-                AND message NOT LIKE 'SYSTEM:%%'
-                ORDER BY created_at ASC
-            """, (case_id,))
-            messages = cur.fetchall()
-            
-            # Normalize for frontend
-            for m in messages:
-                m['id'] = str(m['id'])
-                if m.get('created_at'):
-                    m['created_at'] = m['created_at'].isoformat()
-                if m.get('mentioned_users') is None:
-                    m['mentioned_users'] = []
-                if m.get('read_by') is None:
-                    m['read_by'] = []
+        async with get_async_db_connection() as conn:
+            # Access check
+            if not await can_access_student_chat_async(conn, case_id, user_data):
+                raise HTTPException(
+                    status_code=403,
+                    detail="You don't have access to this student's chat."
+                )
             
-            return {"status": "success", "data": messages}
+            async with conn.cursor() as cur:
+                if after_id is not None:
+                    await cur.execute(f"""
+                        SELECT id, student_id, sender, message, mentioned_users, is_system, created_at
+                        FROM chat_messages
+                        WHERE student_id = %s AND id > %s AND {TEAM_CHAT_FILTER_SQL}
+                        ORDER BY id ASC
+                        LIMIT %s
+                    """, (case_id, after_id, limit + 1))
+                    messages = await cur.fetchall()
+                else:
+                    await cur.execute(f"""
+                        SELECT id, student_id, sender, message, mentioned_users, is_system, created_at
+                        FROM chat_messages
+                        WHERE student_id = %s AND id < %s AND {TEAM_CHAT_FILTER_SQL}
+                        ORDER BY id DESC
+                        LIMIT %s
+                    """, (case_id, before_id if before_id is not None else 2**31 - 1, limit + 1))
+                    messages = (await cur.fetchall())[::-1]
+                has_more = len(messages) > limit
+                if has_more:
+                    messages = messages[:limit] if after_id is not None else messages[1:]
+
+                await cur.execute(
+                    "SELECT user_name, last_read_id, read_at FROM chat_read_state WHERE student_id = %s",
+                    (case_id,)
+                )
+                read_states = await cur.fetchall()
+        
+        messages = attach_read_by([normalize_chat_message(m) for m in messages], read_states)
+        return {"status": "success", "data": messages, "has_more": has_more}
     except HTTPException:
         raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.post("/api/pipeline/{case_id}/chat")
 def post_chat_message(
     case_id: str,
     body: dict,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
 ):
     """
     Post a NEW human message. Restricted to assignees + Master Admin.
@@ -2391,7 +2850,6 @@ def post_chat_message(
             detail="Messages cannot start with 'SYSTEM:'. That's reserved for audit events."
         )
     
-    conn = get_db_connection()
     try:
         # Access check
         if not can_access_student_chat(conn, case_id, user_data):
@@ -2402,9 +2860,7 @@ def post_chat_message(
         
         sender_name = user_data.get("name", "Unknown User")
         
-        # Extract @mentions
-        import re
-        mentions = re.findall(r'@(\w+)', message)
+        mentions = extract_mentions(message, conn)
         
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
@@ -2415,6 +2871,15 @@ def post_chat_message(
                           is_system, created_at
             """, (case_id, sender_name, message, json.dumps(mentions)))
             new_message = cur.fetchone()
+            # Your own message counts as read
+            cur.execute("""
+                INSERT INTO chat_read_state (student_id, user_name, last_read_id, read_at)
+                VALUES (%s, %s, %s, NOW())
+                ON CONFLICT (student_id, user_name) DO UPDATE
+                SET last_read_id = GREATEST(chat_read_state.last_read_id, EXCLUDED.last_read_id),
+                    read_at = NOW()
+            """, (case_id, sender_name, new_message['id']))
+            notify_mentions(cur, case_id, sender_name, mentions)
             conn.commit()
             
             # Normalize
@@ -2431,49 +2896,214 @@ def post_chat_message(
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+
+
+# ---------------------------------------------------------------------
+# Server push (see realtime_events.py). Each stream replays what the client
+# missed — rows after its Last-Event-ID / ?after_id — then forwards rows
+# pushed by the LISTEN thread. Access is re-checked every
+# REALTIME_ACCESS_RECHECK_SECONDS so an unassigned agent stops receiving.
+# If the listener is down the stream says so and closes; the frontend then
+# falls back to polling.
+# ---------------------------------------------------------------------
+REALTIME_ENABLED = os.getenv("REALTIME_ENABLED", "true").lower() != "false"
+REALTIME_ACCESS_RECHECK_SECONDS = float(os.getenv("REALTIME_ACCESS_RECHECK_SECONDS", "60"))
+REALTIME_REPLAY_LIMIT = int(os.getenv("REALTIME_REPLAY_LIMIT", "500"))
+# LISTEN needs a session: DATABASE_URL is the transaction pooler, so point
+# this at the direct (5432) or session-mode connection string. Falls back to
+# DATABASE_URL, in which case the hub's self-probe fails and clients poll.
+REALTIME_DATABASE_URL = os.getenv("REALTIME_DATABASE_URL") or DATABASE_URL
+
+event_hub = EventHub(lambda: psycopg2.connect(REALTIME_DATABASE_URL, sslmode='require'))
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _resume_id(last_event_id: Optional[str], after_id: int) -> int:
+    if last_event_id and last_event_id.strip().isdigit():
+        return max(after_id, int(last_event_id.strip()))
+    return after_id
+
+
+async def _chat_messages_after(case_id: int, after_id: int) -> list:
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"""
+                SELECT id, student_id, sender, message, mentioned_users, is_system, created_at
+                FROM chat_messages
+                WHERE student_id = %s AND id > %s AND {TEAM_CHAT_FILTER_SQL}
+                ORDER BY id ASC
+                LIMIT %s
+            """, (case_id, after_id, REALTIME_REPLAY_LIMIT))
+            return [normalize_chat_message(m) for m in await cur.fetchall()]
+
+
+async def _still_allowed(student_id: int, user_data: dict) -> bool:
+    async with get_async_db_connection() as conn:
+        return await can_access_student_chat_async(conn, student_id, user_data)
+
+
+def _realtime_unavailable():
+    async def closed():
+        yield "retry: 30000\n\n"
+        yield sse_message({"reason": "realtime listener unavailable"}, event="unavailable")
+    return StreamingResponse(closed(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.get("/api/pipeline/{case_id}/chat/stream")
+async def stream_chat_messages(
+    case_id: int,
+    request: Request,
+    after_id: int = 0,
+    last_event_id: Optional[str] = Header(None),
+    user_data: dict = Depends(verify_stream_token)
+):
+    """
+    text/event-stream of new team-chat messages for one student
+    (`event: message`, `id:` = chat message id).
+    """
+    if not await _still_allowed(case_id, user_data):
+        raise HTTPException(status_code=403, detail="You don't have access to this student's chat.")
+    if not (REALTIME_ENABLED and event_hub.connected):
+        return _realtime_unavailable()
+
+    sub = event_hub.subscribe(("student", case_id))
+
+    async def events():
+        last_id = _resume_id(last_event_id, after_id)
+        sent = set()
+        checked_at = time.monotonic()
+        try:
+            yield "retry: 3000\n\n"
+            pending = await _chat_messages_after(case_id, last_id)
+            while True:
+                for row in pending:
+                    if row["id"] in sent:
+                        continue
+                    sent.add(row["id"])
+                    last_id = max(last_id, int(row["id"]))
+                    yield sse_message(row, event="message", event_id=row["id"])
+                if len(sent) > 2000:
+                    sent = {i for i in sent if int(i) > last_id - 1000}
+
+                if await request.is_disconnected():
+                    break
+                event = await sub.next(REALTIME_HEARTBEAT_SECONDS)
+                if time.monotonic() - checked_at > REALTIME_ACCESS_RECHECK_SECONDS:
+                    checked_at = time.monotonic()
+                    if not await _still_allowed(case_id, user_data):
+                        yield sse_message({"reason": "access revoked"}, event="revoked")
+                        break
+                if event is None:
+                    yield ": ping\n\n"
+                    pending = []
+                elif event is RESYNC or "row" not in event:
+                    pending = await _chat_messages_after(case_id, last_id)
+                elif is_team_chat_message(event["row"]):
+                    pending = [normalize_chat_message(dict(event["row"]))]
+                else:
+                    pending = []
+        finally:
+            event_hub.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+class ChatReadRequest(BaseModel):
+    up_to_id: Optional[int] = None  # default: everything currently in the thread
 
 
 @app.post("/api/pipeline/{case_id}/chat/read")
-def mark_chat_as_read(case_id: int, user_data: dict = Depends(verify_token)):
+def mark_chat_as_read(
+    case_id: int,
+    req: Optional[ChatReadRequest] = None,
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
+):
+    """Moves the caller's read high-water mark forward (never back) in one upsert."""
     user_name = user_data.get("name", "Unknown")
-    conn = get_db_connection()
+    up_to_id = req.up_to_id if req else None
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Fetch unread messages
-            cur.execute("SELECT id, read_by FROM chat_messages WHERE student_id = %s", (case_id,))
-            messages = cur.fetchall()
-            
-            now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
-            for msg in messages:
-                read_by_list = msg["read_by"] or []
-                if not isinstance(read_by_list, list):
-                    read_by_list = []
-                
-                # Check if this user already read it
-                if not any(r.get("user") == user_name for r in read_by_list):
-                    read_by_list.append({"user": user_name, "read_at": now_str})
-                    cur.execute(
-                        "UPDATE chat_messages SET read_by = %s::jsonb WHERE id = %s",
-                        (json.dumps(read_by_list), msg["id"])
-                    )
+        if not can_access_student_chat(conn, case_id, user_data):
+            raise HTTPException(
+                status_code=403,
+                detail="You don't have access to this student's chat."
+            )
+        
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO chat_read_state (student_id, user_name, last_read_id, read_at)
+                SELECT %s, %s, COALESCE(%s, MAX(id), 0), NOW()
+                FROM chat_messages WHERE student_id = %s
+                ON CONFLICT (student_id, user_name) DO UPDATE
+                SET last_read_id = GREATEST(chat_read_state.last_read_id, EXCLUDED.last_read_id),
+                    read_at = NOW()
+                RETURNING last_read_id
+            """, (case_id, user_name, up_to_id, case_id))
+            last_read_id = cur.fetchone()[0]
             conn.commit()
-            return {"status": "success"}
+            return {"status": "success", "last_read_id": last_read_id}
+    except HTTPException:
+        raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
+
+@app.get("/api/chat/unread")
+async def get_chat_unread_counts(
+    student_ids: Optional[str] = None,
+    user_data: dict = Depends(verify_token)
+):
+    """
+    Unread team-chat messages per student for the caller, counting only
+    messages after their read high-water mark and not sent by themselves.
+    ?student_ids=1,2,3 narrows it to those dossiers; otherwise every
+    dossier the caller can see. Students with nothing unread are omitted.
+    """
+    user_name = user_data.get("name", "")
+    try:
+        async with get_async_db_connection() as conn:
+            if student_ids:
+                ids = sorted(await filter_accessible_student_ids_async(
+                    conn, _normalize_student_ids(student_ids.split(",")), user_data
+                ))
+                scope_sql, scope_params = "m.student_id = ANY(%s)", [ids]
+            else:
+                clause, params = await get_visible_student_filter_async(user_data, conn)
+                scope_sql = f"m.student_id IN (SELECT id FROM students WHERE {clause})"
+                scope_params = list(params)
+
+            async with conn.cursor() as cur:
+                await cur.execute(f"""
+                    SELECT m.student_id, COUNT(*) AS unread, MAX(m.id) AS latest_id
+                    FROM (
+                        SELECT id, student_id, sender FROM chat_messages WHERE {TEAM_CHAT_FILTER_SQL}
+                    ) m
+                    LEFT JOIN chat_read_state r
+                        ON r.student_id = m.student_id AND r.user_name = %s
+                    WHERE {scope_sql}
+                      AND m.id > COALESCE(r.last_read_id, 0)
+                      AND m.sender <> %s
+                    GROUP BY m.student_id
+                """, [user_name, *scope_params, user_name])
+                rows = await cur.fetchall()
+
+        counts = {str(r["student_id"]): r["unread"] for r in rows}
+        return {"status": "success", "data": counts, "total": sum(counts.values())}
+    except HTTPException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
 
 @app.get("/api/pipeline/{case_id}/audit-trail")
-def get_student_audit_trail(case_id: str, user_data: dict = Depends(verify_token)):
+def get_student_audit_trail(case_id: str, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     """
     Returns the audit trail for a single student — SYSTEM events extracted from
-    both chat_messages (legacy) and timeline column.
+    both chat_messages (legacy) and timeline_entries.
     Same access rule as chat.
     """
-    conn = get_db_connection()
     try:
         # Access check (same as chat)
         if not can_access_student_chat(conn, case_id, user_data):
@@ -2513,34 +3143,23 @@ def get_student_audit_trail(case_id: str, user_data: dict = Depends(verify_token
                     "timestamp": m['created_at'].isoformat() if m['created_at'] else None
                 })
             
-            # 2) Also pull from timeline JSONB column (legacy notes that have SYSTEM)
+            # 2) Also pull system notes from the timeline
             cur.execute("""
-                SELECT timeline
-                FROM students
-                WHERE id = %s
-            """, (case_id,))
-            row = cur.fetchone()
-            
-            if row and row.get('timeline'):
-                timeline = row['timeline']
-                if isinstance(timeline, str):
-                    try:
-                        timeline = json.loads(timeline)
-                    except Exception:
-                        timeline = []
-                
-                if isinstance(timeline, list):
-                    for entry in timeline:
-                        note = entry.get('note', '') or ''
-                        if note.upper().startswith("SYSTEM:") or entry.get('author') in ('System', 'System AI'):
-                            cleaned = note[7:].strip() if note.upper().startswith("SYSTEM:") else note
-                            events.append({
-                                "id": f"timeline-{entry.get('date', '')}",
-                                "type": "system_event",
-                                "actor": entry.get('author') if entry.get('author') not in ('System', 'System AI') else None,
-                                "message": cleaned,
-                                "timestamp": entry.get('date')
-                            })
+                SELECT id, author, note, to_char(created_at, 'YYYY-MM-DD HH24:MI') AS date
+                FROM timeline_entries
+                WHERE student_id = %s
+                  AND (UPPER(note) LIKE 'SYSTEM:%%' OR author IN ('System', 'System AI'))
+            """, (int(case_id),))
+            for entry in cur.fetchall():
+                note = entry['note'] or ''
+                cleaned = note[7:].strip() if note.upper().startswith("SYSTEM:") else note
+                events.append({
+                    "id": f"timeline-{entry['id']}",
+                    "type": "system_event",
+                    "actor": entry['author'] if entry['author'] not in ('System', 'System AI') else None,
+                    "message": cleaned,
+                    "timestamp": entry['date']
+                })
         
         # Sort by timestamp descending (newest first)
         events.sort(key=lambda e: e.get('timestamp') or '', reverse=True)
@@ -2551,34 +3170,31 @@ def get_student_audit_trail(case_id: str, user_data: dict = Depends(verify_token
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.get("/api/notifications")
-def get_user_notifications(user_data: dict = Depends(verify_token)):
+async def get_user_notifications(user_data: dict = Depends(verify_token)):
     username = user_data.get("name")
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, recipient_username, sender, message, is_read, 
-                       to_char(created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
-                FROM notifications 
-                WHERE recipient_username = %s AND is_read = FALSE 
-                ORDER BY created_at DESC
-            """, (username,))
-            return {"status": "success", "data": cur.fetchall()}
+        async with get_async_db_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT id, recipient_username, sender, message, is_read, 
+                           to_char(created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
+                    FROM notifications 
+                    WHERE recipient_username = %s AND is_read = FALSE 
+                    ORDER BY created_at DESC
+                """, (username,))
+                return {"status": "success", "data": await cur.fetchall()}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @app.post("/api/notifications/{id}/read")
-def mark_notification_read(id: int, user_data: dict = Depends(verify_token)):
+def mark_notification_read(id: int, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     username = user_data.get("name")
-    conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("""
@@ -2591,31 +3207,101 @@ def mark_notification_read(id: int, user_data: dict = Depends(verify_token)):
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
+
+
+async def _notifications_after(username: str, after_id: int) -> list:
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT id, recipient_username, sender, message, is_read,
+                       to_char(created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
+                FROM notifications
+                WHERE recipient_username = %s AND is_read = FALSE AND id > %s
+                ORDER BY id ASC
+                LIMIT %s
+            """, (username, after_id, REALTIME_REPLAY_LIMIT))
+            return await cur.fetchall()
+
+
+@app.get("/api/notifications/stream")
+async def stream_notifications(
+    request: Request,
+    after_id: int = 0,
+    last_event_id: Optional[str] = Header(None),
+    user_data: dict = Depends(verify_stream_token)
+):
+    """
+    text/event-stream for the current user:
+      - `event: notification` (`id:` = notification id, replayed on resume)
+      - `event: mention` when a chat message @mentions them in a dossier they
+        can access (live only; no id, so it doesn't move the resume point)
+    """
+    username = user_data.get("name")
+    if not (REALTIME_ENABLED and event_hub.connected):
+        return _realtime_unavailable()
+
+    sub = event_hub.subscribe(("user", username))
+
+    async def events():
+        last_id = _resume_id(last_event_id, after_id)
+        chat_access = {}  # student_id -> (allowed, checked_at)
+        try:
+            yield "retry: 3000\n\n"
+            pending = await _notifications_after(username, last_id)
+            while True:
+                for row in pending:
+                    if row["id"] <= last_id:
+                        continue
+                    last_id = row["id"]
+                    yield sse_message(row, event="notification", event_id=row["id"])
+
+                if await request.is_disconnected():
+                    break
+                event = await sub.next(REALTIME_HEARTBEAT_SECONDS)
+                pending = []
+                if event is None:
+                    yield ": ping\n\n"
+                elif event is RESYNC:
+                    pending = await _notifications_after(username, last_id)
+                elif event["type"] == "notification":
+                    if "row" in event:
+                        pending = [event["row"]]
+                    else:
+                        pending = await _notifications_after(username, last_id)
+                elif event["type"] == "chat" and "row" in event and is_team_chat_message(event["row"]):
+                    student_id = int(event["student_id"])
+                    allowed, checked_at = chat_access.get(student_id, (None, 0.0))
+                    if allowed is None or time.monotonic() - checked_at > REALTIME_ACCESS_RECHECK_SECONDS:
+                        allowed = await _still_allowed(student_id, user_data)
+                        chat_access[student_id] = (allowed, time.monotonic())
+                    if allowed:
+                        yield sse_message(normalize_chat_message(dict(event["row"])), event="mention")
+        finally:
+            event_hub.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @app.put("/api/pipeline/{case_id}/applications")
-def update_applications(case_id: str, req: ApplicationData):
-    conn = get_db_connection()
+def update_applications(case_id: str, req: ApplicationData, conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE students SET applications = %s::jsonb WHERE id = %s",
-                (json.dumps(req.applications), case_id)
-            )
+            replace_applications(cur, case_id, req.applications)
             conn.commit()
             return {"status": "success", "message": "Applications updated!"}
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail="Database update error.")
-    finally:
-        conn.close()
 
 
 # 🔒 SECURED download_document — ONLY ONE COPY (duplicate removed)
 @app.get("/api/documents/{filename}")
-def download_document(filename: str, user_data: dict = Depends(verify_token)):
+def download_document(
+    filename: str,
+    redirect: bool = False,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    user_data: dict = Depends(verify_token)
+):
     """
     SECURE document download:
       - Requires valid JWT
@@ -2623,6 +3309,8 @@ def download_document(filename: str, user_data: dict = Depends(verify_token)):
       - Verifies caller has permission for that student
       - Logs every access/denial in audit_logs
       - Sets no-cache + nosniff headers
+      - Streams from the document cache / storage; honours single Range requests (206)
+      - ?redirect=true answers with a 307 to a short-lived signed storage URL instead
     """
     # ✅ Path traversal protection
     if '..' in filename or '/' in filename or '\\' in filename:
@@ -2658,8 +3346,6 @@ def download_document(filename: str, user_data: dict = Depends(verify_token)):
                     detail="You do not have permission to view this document."
                 )
 
-        response = supabase.storage.from_("student-documents").download(filename)
-
         ext = filename.lower().rsplit('.', 1)[-1] if '.' in filename else ''
         content_types = {
             'pdf': 'application/pdf',
@@ -2673,18 +3359,52 @@ def download_document(filename: str, user_data: dict = Depends(verify_token)):
         }
         media_type = content_types.get(ext, 'application/octet-stream')
 
+        if redirect and DOC_SIGNED_URL_TTL_SECONDS > 0:
+            signed = supabase.storage.from_("student-documents").create_signed_url(
+                filename, DOC_SIGNED_URL_TTL_SECONDS
+            )
+            signed_url = signed.get("signedURL") or signed.get("signedUrl")
+            if not signed_url:
+                raise DocumentNotFound(filename)
+
+            # ✅ LOG SUCCESSFUL ACCESS (CCTV trail)
+            log_audit_event(
+                conn=conn, action="VIEW_DOC", entity="Document",
+                entity_id=filename, changed_by=user_data.get("name", "Unknown"),
+                details={"case_id": case_id, "media_type": media_type,
+                         "via": "signed_url", "expires_in": DOC_SIGNED_URL_TTL_SECONDS}
+            )
+            conn.commit()
+            return RedirectResponse(
+                signed_url, status_code=307,
+                headers={"Cache-Control": "private, no-store, max-age=0"}
+            )
+
+        try:
+            served = document_proxy.open(filename, range_header)
+        except RangeNotSatisfiable as e:
+            raise HTTPException(
+                status_code=416, detail="Requested range not satisfiable.",
+                headers={"Content-Range": f"bytes */{e.size}"}
+            )
+
         # ✅ LOG SUCCESSFUL ACCESS (CCTV trail)
+        details = {"case_id": case_id, "media_type": media_type, "via": served.source}
+        if served.byte_range:
+            details["range"] = list(served.byte_range)
         log_audit_event(
             conn=conn, action="VIEW_DOC", entity="Document",
             entity_id=filename, changed_by=user_data.get("name", "Unknown"),
-            details={"case_id": case_id, "media_type": media_type}
+            details=details
         )
         conn.commit()
 
-        return Response(
-            content=response,
+        return StreamingResponse(
+            served.body,
+            status_code=served.status,
             media_type=media_type,
             headers={
+                **served.headers,
                 "Content-Disposition": f'inline; filename="{filename}"',
                 "Cache-Control": "private, no-store, max-age=0",
                 "X-Content-Type-Options": "nosniff",
@@ -2721,19 +3441,17 @@ async def verify_commission(
 
         if result.get("verified"):
             commission = tuition * commission_rate
-            conn = get_db_connection()
-            try:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "UPDATE students SET status = 'COMPLETED', commission_earned = %s WHERE id = %s",
-                        (commission, case_id)
-                    )
-                    conn.commit()
-            except Exception as e:
-                conn.rollback()
-                raise HTTPException(status_code=500, detail="Database update error.")
-            finally:
-                conn.close()
+            async with checkout_db_connection() as conn:
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            "UPDATE students SET status = 'COMPLETED', commission_earned = %s WHERE id = %s",
+                            (commission, case_id)
+                        )
+                        conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    raise HTTPException(status_code=500, detail="Database update error.")
             return {"status": "success", "verified": True, "message": "Deal closed.", "reason": result.get("reason")}
         else:
             return {"status": "error", "verified": False, "message": "Verification failed.", "reason": result.get("reason")}
@@ -2746,48 +3464,94 @@ async def verify_commission(
 # =====================================================================
 # --- 5. AI FEATURES ---
 # =====================================================================
-@app.post("/api/ai-strategy")
-def get_ai_strategy(req: AIRequest, user_data: dict = Depends(verify_token)):
+AI_STRATEGY_JOB = "ai_strategy"
+
+
+def run_ai_strategy(connect, case_id, actor: str, force_regenerate: bool = False) -> dict:
     """
     Generates a strategic placement report by:
     1. Fetching the student record
-    2. Downloading ALL uploaded PDFs from Supabase (raw bytes + extracted text)
+    2. Downloading ALL uploaded PDFs from Supabase (raw bytes + stored or fresh extracted text)
     3. Passing PDFs natively to Gemini so it can OCR scanned rapors with vision
     4. Grouping extracted text by category (Report Card, Profiling Test, Other)
     5. Combining with student's declared field_interests
+
+    Runs on an AI worker (see ai_jobs.py), not in the request. Saves the
+    report on the student, commits, and returns {"report", "stats"}.
+    Unchanged inputs are served from ai_report_cache unless force_regenerate.
+
+    `connect()` returns a pooled connection. One is held only for the reads
+    up front, the report-cache lookup and the final writes; none is checked
+    out while documents download or Gemini runs.
     """
-    conn = None
+    conn = connect()
     try:
-        conn = get_db_connection()
-
-        # Fetch student
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
-                SELECT id, name, notes, documents, field_interests,
+                SELECT id, name, notes, field_interests,
                        program_interest, country_interest, budget
                 FROM students WHERE id = %s
-            """, (req.case_id,))
+            """, (case_id,))
             student = cur.fetchone()
 
         if not student:
-            return {"status": "error", "report": "Student not found."}
+            raise PermanentJobError("Student not found.")
+
+        docs = list_documents(conn, case_id)
+        supported_docs = [d for d in docs if d.get('filename') and media_type_for(d['filename'])]
+        known_extractions = load_extractions(conn, [d['filename'] for d in supported_docs])
+        conn.commit()
+    finally:
+        conn.close()
+
+    # ---------- Parse field_interests ----------
+    field_interests_raw = student.get('field_interests')
+    field_interests = []
+    if field_interests_raw:
+        if isinstance(field_interests_raw, str):
+            try:
+                parsed = json.loads(field_interests_raw)
+                if isinstance(parsed, list):
+                    field_interests = parsed
+                else:
+                    field_interests = [str(parsed)]
+            except Exception:
+                field_interests = [f.strip() for f in field_interests_raw.split(',') if f.strip()]
+        elif isinstance(field_interests_raw, list):
+            field_interests = field_interests_raw
+
+    report_inputs = dict(
+        student_name=student['name'],
+        destination=student.get('country_interest') or "Global (AI Recommended)",
+        budget=student.get('budget') or "",
+        notes=student.get('notes') or "No notes provided.",
+        field_interests=field_interests,
+        program_interest=student.get('program_interest') or ""
+    )
 
-        # Access check
-        if not check_student_access(conn, str(student['id']), user_data):
-            raise HTTPException(status_code=403, detail="Not authorized for this student.")
+    # ---------- Stored extractions (document_extractions) ----------
+    # Uploads record each file's content hash and page text once. When every
+    # document has a record, the report cache can be checked before anything
+    # is downloaded; otherwise they at least spare us re-parsing the PDFs.
+    fetched = {"documents": [], "failures": [], "elapsed_ms": 0.0}
+    premium_report = None
+    cache_key = None
+    new_extractions = []  # (filename, record) for legacy uploads parsed here
+
+    if supabase and not force_regenerate and all(d['filename'] in known_extractions for d in supported_docs):
+        cache_key = report_cache_key(
+            document_hashes=[
+                (d.get('title') or d['filename'], media_type_for(d['filename']),
+                 known_extractions[d['filename']]['content_sha256'])
+                for d in supported_docs
+            ],
+            **report_inputs
+        )
+        premium_report = _lookup_cached_report_with(connect, cache_key)
 
-        # ---------- Parse documents JSONB ----------
-        raw_docs = student.get('documents')
-        if raw_docs is None:
-            docs = []
-        elif isinstance(raw_docs, str):
-            try: docs = json.loads(raw_docs)
-            except: docs = []
-        elif isinstance(raw_docs, list):
-            docs = raw_docs
-        else:
-            docs = []
+    cache_hit = premium_report is not None
 
+    if not cache_hit:
         # ---------- Download PDFs and extract text ----------
         # KEY CHANGE: We now collect BOTH raw PDF bytes AND extracted text.
         # - Raw bytes → passed to Gemini for native vision (OCRs scanned rapors)
@@ -2799,83 +3563,53 @@ def get_ai_strategy(req: AIRequest, user_data: dict = Depends(verify_token)):
 
         if not supabase:
             print("[ai-strategy] WARNING: Supabase not configured; cannot extract PDFs.")
+        else:
+            # Downloads run concurrently; PDFs without a stored extraction are
+            # parsed in the shared process pool as they arrive.
+            fetched = fetch_and_extract(docs, download_student_document, known=known_extractions)
 
-        # NEW: Map of supported file extensions to Gemini-accepted MIME types
-        SUPPORTED_MEDIA = {
-            ".pdf":  "application/pdf",
-            ".jpg":  "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png":  "image/png",
-            ".webp": "image/webp",
-            ".heic": "image/heic",
-            ".heif": "image/heif",
-        }
-        
-        for doc in docs:
-            filename = doc.get('filename')
-            if not filename:
-                continue
-            # Detect mime by extension
-            ext = "." + filename.lower().rsplit(".", 1)[-1] if "." in filename else ""
-            mime_type = SUPPORTED_MEDIA.get(ext)
-            if not mime_type:
-                print(f"[ai-strategy] Skipping unsupported file: {filename}")
-                continue
-            if not supabase:
-                continue
+        for failure in fetched["failures"]:
+            if failure["stage"] == "extract":
+                print(f"[ai-strategy] Text extraction failed for {failure['filename']} (likely scanned — vision will handle it): {failure['error']}")
+            else:
+                print(f"[ai-strategy] Download failed for {failure['filename']}: {failure['error']}")
 
-            try:
-                file_bytes = supabase.storage.from_("student-documents").download(filename)
-                if not file_bytes:
-                    print(f"[ai-strategy] {filename} returned empty from Supabase")
-                    continue
+        for item in fetched["documents"]:
+            filename = item["filename"]
+            doc_label = item["label"]
+            mime_type = item["mime_type"]
 
-                # === STEP 1: Save raw bytes for Gemini's native vision ===
-                # NOW carries mime_type so the helper knows how to send it
-                doc_label = doc.get('title') or filename
-                pdf_files_for_gemini.append((doc_label, file_bytes, mime_type))
+            # Legacy uploads (before document_extractions): recorded with the report
+            if item["extraction"] and not item["from_store"]:
+                new_extractions.append((filename, item["extraction"]))
 
-                # === STEP 2: Try text extraction — ONLY for actual PDFs ===
-                pdf_text = ""
-                if mime_type == "application/pdf":
-                    try:
-                        reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
-                        pages = []
-                        for page in reader.pages:
-                            try:
-                                t = page.extract_text() or ""
-                                if t.strip():
-                                    pages.append(t)
-                            except Exception:
-                                continue
-                        pdf_text = "\n".join(pages).strip()
-                    except Exception as text_err:
-                        print(f"[ai-strategy] Text extraction failed for {filename} (likely scanned — vision will handle it): {text_err}")
-
-                if not pdf_text:
-                    # For images: no text extraction possible, that's expected
-                    # For scanned PDFs: vision will OCR
-                    if mime_type.startswith("image/"):
-                        pdf_text = f"[Image file '{doc_label}' — see attached image for visual content]"
-                    else:
-                        pdf_text = f"[Scanned PDF '{doc_label}' — see attached file for visual content]"
-
-                # Classify by title/filename
-                title = (doc.get('title') or '').upper()
-                fname_upper = filename.upper()
-
-                if ("REPORT CARD" in title or "RAPOT" in title or "RAPOR" in title or
-                    "REPORT_CARD" in fname_upper or "RAPOT" in fname_upper or "RAPOR" in fname_upper):
-                    rapot_texts.append(f"--- {doc_label} ---\n{pdf_text}")
-                elif ("PROFILING" in title or "PSYCHOLOGY" in title or "PSIKOLOG" in title or
-                      "HCC" in title or "PROFILING" in fname_upper or "PSYCHOLOGY" in fname_upper):
-                    profiling_texts.append(f"--- {doc_label} ---\n{pdf_text}")
-                else:
-                    other_texts.append(f"--- {doc_label} ---\n{pdf_text}")
+            # === STEP 1: Save raw bytes for Gemini's native vision ===
+            # NOW carries mime_type so the helper knows how to send it
+            pdf_files_for_gemini.append((doc_label, item["bytes"], mime_type))
 
-            except Exception as e:
-                print(f"[ai-strategy] Download/extract failed for {filename}: {e}")
-                continue
+            # === STEP 2: Text extracted from actual PDFs (stored or fresh) ===
+            pdf_text = item["text"] or ""
+
+            if not pdf_text:
+                # For images: no text extraction possible, that's expected
+                # For scanned PDFs: vision will OCR
+                if mime_type.startswith("image/"):
+                    pdf_text = f"[Image file '{doc_label}' — see attached image for visual content]"
+                else:
+                    pdf_text = f"[Scanned PDF '{doc_label}' — see attached file for visual content]"
+
+            # Classify by title/filename
+            title = (item["doc"].get('title') or '').upper()
+            fname_upper = filename.upper()
+
+            if ("REPORT CARD" in title or "RAPOT" in title or "RAPOR" in title or
+                "REPORT_CARD" in fname_upper or "RAPOT" in fname_upper or "RAPOR" in fname_upper):
+                rapot_texts.append(f"--- {doc_label} ---\n{pdf_text}")
+            elif ("PROFILING" in title or "PSYCHOLOGY" in title or "PSIKOLOG" in title or
+                  "HCC" in title or "PROFILING" in fname_upper or "PSYCHOLOGY" in fname_upper):
+                profiling_texts.append(f"--- {doc_label} ---\n{pdf_text}")
+            else:
+                other_texts.append(f"--- {doc_label} ---\n{pdf_text}")
 
         # Combine extracted text into structured blob (supplementary)
         combined_parts = []
@@ -2888,95 +3622,214 @@ def get_ai_strategy(req: AIRequest, user_data: dict = Depends(verify_token)):
 
         combined_text = "\n\n".join(combined_parts) if combined_parts else "No PDF text extracted. Refer to attached PDF files directly."
 
-        # ---------- Parse field_interests ----------
-        field_interests_raw = student.get('field_interests')
-        field_interests = []
-        if field_interests_raw:
-            if isinstance(field_interests_raw, str):
-                try:
-                    parsed = json.loads(field_interests_raw)
-                    if isinstance(parsed, list):
-                        field_interests = parsed
-                    else:
-                        field_interests = [str(parsed)]
-                except Exception:
-                    field_interests = [f.strip() for f in field_interests_raw.split(',') if f.strip()]
-            elif isinstance(field_interests_raw, list):
-                field_interests = field_interests_raw
-
         print(f"[ai-strategy] Student {student['name']} — "
               f"rapot files: {len(rapot_texts)}, profiling: {len(profiling_texts)}, "
               f"other: {len(other_texts)}, total PDFs sent to Gemini: {len(pdf_files_for_gemini)}, "
               f"interests: {field_interests}")
 
-        # ---------- Generate report ----------
-        try:
-            raw_budget = student.get('budget') or ""
+        # ---------- Generate report (or reuse one for identical inputs) ----------
+        cache_key = report_cache_key(pdf_files=pdf_files_for_gemini, **report_inputs)
+        premium_report = None if force_regenerate else _lookup_cached_report_with(connect, cache_key)
+        cache_hit = premium_report is not None
+
+        if not cache_hit:
             premium_report = generate_strategic_report(
-                student_name=student['name'],
-                destination=student.get('country_interest') or "Global (AI Recommended)",
-                budget=raw_budget,
-                notes=student.get('notes') or "No notes provided.",
-                pdf_data=combined_text,                # text fallback (supplementary)
-                pdf_files=pdf_files_for_gemini,        # NEW: raw PDF bytes for native vision
-                field_interests=field_interests,
-                program_interest=student.get('program_interest') or ""
+                pdf_data=combined_text,            # text fallback (supplementary)
+                pdf_files=pdf_files_for_gemini,    # NEW: raw PDF bytes for native vision
+                **report_inputs
             )
 
-            # Sprint A: persist report to DB so it survives dossier close/reopen
-            try:
-                with conn.cursor() as save_cur:
-                    save_cur.execute("""
-                        UPDATE students
-                        SET ai_report = %s, ai_report_generated_at = NOW()
-                        WHERE id = %s
-                    """, (premium_report, req.case_id))
-            except Exception as save_err:
-                print(f"[ai-strategy] Could not save report: {save_err}")
+    stats = {
+        "documents": len(supported_docs),
+        "pdfs_sent_to_gemini": 0 if cache_hit else len(fetched["documents"]),
+        "field_interests": field_interests,
+        "cache": "hit" if cache_hit else ("forced" if force_regenerate else "miss"),
+        "failed_documents": fetched["failures"],
+        "document_fetch_ms": fetched["elapsed_ms"],
+    }
+    if fetched["documents"]:
+        stats.update(
+            rapot_files=len(rapot_texts),
+            profiling_files=len(profiling_texts),
+            other_files=len(other_texts),
+        )
 
-            log_audit_event(
-                conn=conn, action="AI_QUERY", entity="Student",
-                entity_id=str(student['id']),
-                changed_by=user_data.get("name", "Unknown"),
-                details={
-                    "rapot_files": len(rapot_texts),
-                    "profiling_files": len(profiling_texts),
-                    "other_files": len(other_texts),
-                    "pdfs_sent_to_gemini": len(pdf_files_for_gemini),
-                    "field_interests": field_interests
-                }
-            )
-            conn.commit()
+    conn = connect()
+    try:
+        for filename, extraction in new_extractions:
+            save_extraction(conn, filename, extraction, student_id=student['id'])
+        if not cache_hit:
+            store_cached_report(conn, cache_key, premium_report, student_id=student['id'])
+        conn.commit()
 
-            return {
-                "status": "success",
-                "report": premium_report,
-                "stats": {
-                    "rapot_files": len(rapot_texts),
-                    "profiling_files": len(profiling_texts),
-                    "other_files": len(other_texts),
-                    "pdfs_sent_to_gemini": len(pdf_files_for_gemini),
-                    "field_interests": field_interests
-                }
-            }
+        # Sprint A: persist report to DB so it survives dossier close/reopen
+        try:
+            with conn.cursor() as save_cur:
+                save_cur.execute("""
+                    UPDATE students
+                    SET ai_report = %s, ai_report_generated_at = NOW()
+                    WHERE id = %s
+                """, (premium_report, student['id']))
+        except Exception as save_err:
+            print(f"[ai-strategy] Could not save report: {save_err}")
+            conn.rollback()
 
-        except Exception as e:
-            print(f"[ai-strategy] AI generation error: {e}")
-            traceback.print_exc()
-            raise HTTPException(status_code=500, detail=str(e))
+        log_audit_event(
+            conn=conn, action="AI_QUERY", entity="Student",
+            entity_id=str(student['id']),
+            changed_by=actor,
+            details=stats
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {"report": premium_report, "stats": stats}
+
+
+def _lookup_cached_report_with(connect, cache_key: str):
+    """lookup_cached_report() on a connection checked out just for it."""
+    conn = connect()
+    try:
+        report = lookup_cached_report(conn, cache_key)
+        conn.commit()
+        return report
+    finally:
+        conn.close()
+
+
+@app.post("/api/ai-strategy", status_code=202)
+def submit_ai_strategy(req: AIRequest, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
+    """
+    Queues an AI strategy report and returns the job right away; poll
+    GET /api/ai-strategy/jobs/{job_id} for the result. A second click while
+    a report is already queued/running for the student returns that job.
+    """
+    try:
+        student_id = int(req.case_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid case_id.")
+
+    try:
+        # Access check
+        if not check_student_access(conn, student_id, user_data):
+            raise HTTPException(status_code=403, detail="Not authorized for this student.")
 
+        job, created = enqueue_job(
+            conn, AI_STRATEGY_JOB, student_id,
+            requested_by=user_data.get("name", "Unknown"),
+            payload={"force_regenerate": req.force_regenerate}
+        )
+        return {
+            "status": "queued" if created else "already_queued",
+            "job_id": job["id"],
+            "job": serialize_job(job)
+        }
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[ai-strategy] FATAL: {e}")
+        print(f"[ai-strategy] Could not queue job: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/ai-strategy/jobs/{job_id}")
+def get_ai_strategy_job(job_id: int, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
+    """Job status; once `done`, `result.report` holds the report (or `last_error` says why not)."""
+    job = get_job(conn, job_id)
+    if not job or not check_student_access(conn, job["student_id"], user_data):
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {"status": "success", "job": serialize_job(job)}
+
+
+@app.get("/api/admin/ai-jobs", dependencies=[Depends(get_current_master_admin)])
+def get_ai_job_stats(conn=Depends(get_db)):
+    stats = queue_stats(conn)
+    for row in stats["by_status"]:
+        if row.get("oldest_queued_at"):
+            row["oldest_queued_at"] = row["oldest_queued_at"].isoformat()
+    return {"status": "success", "data": {**stats, "in_process_workers": AI_WORKER_THREADS}}
+
+
+@app.get("/api/admin/ai-report-cache", dependencies=[Depends(get_current_master_admin)])
+def get_ai_report_cache_stats(conn=Depends(get_db)):
+    return {"status": "success", "data": report_cache_stats(conn)}
+
+
+@app.post("/api/admin/ai-report-cache/evict", dependencies=[Depends(get_current_master_admin)])
+def evict_ai_report_cache(conn=Depends(get_db)):
+    """Drops entries from older prompt versions and ones unused for AI_REPORT_CACHE_MAX_AGE_DAYS."""
+    return {"status": "success", "data": evict_stale_reports(conn)}
+
+
+@app.get("/api/admin/document-cache", dependencies=[Depends(get_current_master_admin)])
+def get_document_cache_stats():
+    """Hit rate and size of this process's on-disk document cache."""
+    if not document_proxy:
+        raise HTTPException(status_code=503, detail="Cloud storage not configured.")
+    return {"status": "success", "data": document_proxy.cache.stats()}
+
+
+# ---------------------------------------------------------------------
+# In-process AI workers. Each API process runs AI_WORKER_THREADS of them
+# (default 1). Set it to 0 and run `python ai_worker.py` instead to keep
+# Gemini calls off the API hosts entirely; both can share the queue.
+# ---------------------------------------------------------------------
+AI_WORKER_THREADS = int(os.getenv("AI_WORKER_THREADS", "1"))
+_ai_worker_stop = threading.Event()
+
+AI_JOB_HANDLERS = {
+    AI_STRATEGY_JOB: lambda connect, job: run_ai_strategy(
+        connect, job["student_id"], job.get("requested_by") or "Unknown",
+        force_regenerate=bool((job.get("payload") or {}).get("force_regenerate")),
+    ),
+}
+
+
+@app.on_event("startup")
+def start_ai_workers():
+    if not DATABASE_URL:
+        return
+    conn = get_db_connection()
+    try:
+        evicted = evict_stale_reports(conn)
+        if any(evicted.values()):
+            print(f"[ai-report-cache] evicted {evicted}")
+    except Exception as e:
+        print(f"[ai-report-cache] eviction failed: {e}")
+        conn.rollback()
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+    for i in range(AI_WORKER_THREADS):
+        threading.Thread(
+            target=run_worker, args=(get_db_connection, AI_JOB_HANDLERS, _ai_worker_stop),
+            name=f"ai-worker-{i}", daemon=True
+        ).start()
+
+
+@app.on_event("shutdown")
+def stop_ai_workers():
+    _ai_worker_stop.set()
+
+
+@app.on_event("startup")
+def start_realtime_listener():
+    if DATABASE_URL and REALTIME_ENABLED:
+        event_hub.start()
+
+
+@app.on_event("shutdown")
+def stop_realtime_listener():
+    event_hub.stop()
+
+
+@app.get("/api/admin/realtime", dependencies=[Depends(get_current_master_admin)])
+def get_realtime_stats():
+    """LISTEN connection state and live SSE subscriptions in this process."""
+    return {"status": "success", "data": {**event_hub.stats(), "enabled": REALTIME_ENABLED}}
 
 @app.get("/api/pipeline/{case_id}/ai-report/pdf")
-def download_ai_report_pdf(case_id: str, user_data: dict = Depends(verify_token)):
+def download_ai_report_pdf(case_id: str, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     """Generate a Fortrust-branded PDF — premium template with section title pages."""
     from reportlab.lib.pagesizes import A4
     from reportlab.lib import colors
@@ -2991,9 +3844,7 @@ def download_ai_report_pdf(case_id: str, user_data: dict = Depends(verify_token)
     import io, os, re
     from datetime import datetime
 
-    conn = None
     try:
-        conn = get_db_connection()
         if not check_student_access(conn, case_id, user_data):
             raise HTTPException(status_code=403, detail="Not authorized.")
 
@@ -3545,20 +4396,18 @@ def download_ai_report_pdf(case_id: str, user_data: dict = Depends(verify_token)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"PDF generation failed: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
 # =====================================================================
 # --- 6. MARKETING MODULE ---
 # =====================================================================
 @app.post("/api/marketing/leads")
-async def create_marketing_lead(
+def create_marketing_lead(
     name: str = Form(...),
     email: str = Form(...),
     wa_number: str = Form(""),
     program_interest: str = Form(""),
     lead_source: str = Form(""),
+    conn=Depends(get_db),
 ):
     score = 0
     if wa_number.strip():
@@ -3567,7 +4416,6 @@ async def create_marketing_lead(
         score += 2
     temperature = "Hot Leads" if score >= 3 else "Warm Leads" if score >= 1 else "Cold Leads"
 
-    conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute("""
@@ -3583,8 +4431,11 @@ async def create_marketing_lead(
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
+
+
+# Bulk imports stream through lead_import (validation, dedup, batched
+# inserts); the upload itself is spooled to disk like document uploads.
+IMPORT_MAX_FILE_MB = int(os.getenv("IMPORT_MAX_FILE_MB", "25"))
 
 
 @app.post("/api/bulk-upload")
@@ -3592,63 +4443,56 @@ async def bulk_upload_leads(
     file: UploadFile = File(...),
     user_data: dict = Depends(verify_token)
 ):
-    if not file.filename.endswith(('.xlsx', '.csv')):
+    if not (file.filename or "").lower().endswith(('.xlsx', '.csv')):
         raise HTTPException(status_code=400, detail="Invalid format. Please upload a .csv or .xlsx file.")
 
-    conn = get_db_connection()
     try:
-        contents = await file.read()
-        
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(contents))
-        else:
-            df = pd.read_excel(io.BytesIO(contents))
-
-        df = df.fillna("")
-        df.columns = [str(c).strip().lower() for c in df.columns]
-
-        if 'name' not in df.columns:
-            raise HTTPException(status_code=400, detail="The spreadsheet must contain a column titled 'name'.")
-
-        success_count = 0
-        agent_name = user_data.get("name", "Unknown System")
-
-        with conn.cursor() as cur:
-            for index, row in df.iterrows():
-                name = row.get("name", "Unknown Lead")
-                if not name:
-                    continue
-
-                email = row.get("email", "")
-                phone = str(row.get("phone", ""))
-                program_interest = row.get("program", "")
-
-                cur.execute("""
-                    INSERT INTO students 
-                    (name, email, phone, program_interest, assignee, status, lead_source)
-                    VALUES (%s, %s, %s, %s, %s, 'NEW LEAD', 'Bulk Excel Upload')
-                """, (name, email, phone, program_interest, agent_name))
+        spooled = await spool_upload(file, IMPORT_MAX_FILE_MB * 1024 * 1024)
+    except UploadRejected as rejected:
+        raise HTTPException(status_code=400, detail=f"{file.filename}: {rejected}")
 
-                success_count += 1
-
-            cur.execute("""
-                INSERT INTO audit_logs (entity, action, changed_by, details)
-                VALUES (%s, 'CREATE', %s, %s)
-            """, ("Bulk Leads", agent_name, f'{{"amount_imported": {success_count}}}'))
+    agent_name = user_data.get("name", "Unknown System")
 
+    def run_import():
+        conn = get_db_connection()
+        try:
+            with spooled.open() as stream:
+                report = import_leads(conn, stream, file.filename, assignee=agent_name)
+            log_audit_event(
+                conn=conn, action="CREATE", entity="Bulk Leads", entity_id=file.filename,
+                changed_by=agent_name,
+                details={
+                    "filename": file.filename,
+                    "amount_imported": report["imported"],
+                    "duplicates": report["duplicates"],
+                    "invalid": report["invalid"],
+                    "failed": report["failed"],
+                }
+            )
             conn.commit()
+            return report
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
-        return {"status": "success", "message": f"Successfully imported {success_count} new leads."}
-
+    try:
+        with spooled:
+            report = await asyncio.to_thread(run_import)
+    except ImportFileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        if conn:
-            conn.rollback()
         print("CRITICAL BULK UPLOAD CRASH:")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to process file. Ensure columns are named correctly. Error: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+
+    skipped = report["duplicates"] + report["invalid"] + report["failed"]
+    message = f"Successfully imported {report['imported']} new leads."
+    if skipped:
+        message += (f" Skipped {skipped} row(s): {report['duplicates']} duplicate,"
+                    f" {report['invalid']} invalid, {report['failed']} rejected by the database.")
+    return {"status": "success", "message": message, "report": report}
 
 
 # =====================================================================
@@ -3742,8 +4586,7 @@ def execute_reset_password(request: ResetPasswordRequest):
 # --- 8. STUDENT CRM ---
 # =====================================================================
 @app.post("/api/students", dependencies=[Depends(get_current_user)])
-def create_student(student: StudentCreate):
-    conn = get_db_connection()
+def create_student(student: StudentCreate, conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             cur.execute("""
@@ -3759,87 +4602,77 @@ def create_student(student: StudentCreate):
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @app.get("/api/students", dependencies=[Depends(get_current_user)])
-def get_all_students():
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id, name, email, phone, assignee, status, lead_temperature, program_interest, budget, created_at
-                FROM students ORDER BY created_at DESC
-            """)
-            return {"status": "success", "data": cur.fetchall()}
-    finally:
-        conn.close()
+def get_all_students(conn=Depends(get_db)):
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id, name, email, phone, assignee, status, lead_temperature, program_interest, budget, created_at
+            FROM students ORDER BY created_at DESC
+        """)
+        return {"status": "success", "data": cur.fetchall()}
 
 @app.get("/api/students/{student_id}/application-form-pdf")
 def download_application_form_pdf(
     student_id: int,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
 ):
     """Generate the Fortrust Application Form PDF filled with student data."""
     # Permission check — must have view access on this student
-    require_can_view_student(user_data, student_id)
+    require_can_view_student(conn, student_id, user_data)
     
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM students WHERE id = %s", (student_id,))
-            student = cur.fetchone()
-            if not student:
-                raise HTTPException(status_code=404, detail="Student not found.")
-        
-        # Convert RowDict to plain dict + parse JSONB columns
-        student_dict = dict(student)
-        JSONB_FIELDS = ["program_preferences", "previous_studies", "work_experiences", "language_tests", "referees", "photo_hard_copies"]
-        for field in JSONB_FIELDS:
-            raw = student_dict.get(field)
-            if isinstance(raw, str):
-                try:
-                    student_dict[field] = json.loads(raw)
-                except Exception:
-                    student_dict[field] = []
-            elif raw is None:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT * FROM students WHERE id = %s", (student_id,))
+        student = cur.fetchone()
+        if not student:
+            raise HTTPException(status_code=404, detail="Student not found.")
+    
+    # Convert RowDict to plain dict + parse JSONB columns
+    student_dict = dict(student)
+    JSONB_FIELDS = ["program_preferences", "previous_studies", "work_experiences", "language_tests", "referees", "photo_hard_copies"]
+    for field in JSONB_FIELDS:
+        raw = student_dict.get(field)
+        if isinstance(raw, str):
+            try:
+                student_dict[field] = json.loads(raw)
+            except Exception:
                 student_dict[field] = []
-        
-        # Generate PDF
-        template_path = os.path.join(os.path.dirname(__file__), "templates", "fortrust_application_form.pdf")
-        if not os.path.exists(template_path):
-            raise HTTPException(status_code=500, detail="Template PDF not found on server. Contact admin.")
-        
-        pdf_bytes = generate_application_form_pdf(student_dict, template_path)
-        
-        # Build safe filename
-        safe_name = (student_dict.get("name") or "student").replace(" ", "_").replace("/", "_")
-        safe_name = "".join(c for c in safe_name if c.isalnum() or c in "_-")
-        filename = f"Fortrust_Application_{safe_name}.pdf"
-        
-        # Log audit event
-        try:
-            log_audit_event(
-                actor=user_data.get("name", "Unknown"),
-                event_type="APPLICATION_FORM_GENERATED",
-                student_id=student_id,
-                message=f"Generated Fortrust Application Form PDF for {student_dict.get('name')}",
-            )
-        except Exception:
-            pass  # Audit failures shouldn't break PDF download
-        
-        return StreamingResponse(
-            iter([pdf_bytes]),
-            media_type="application/pdf",
-            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        elif raw is None:
+            student_dict[field] = []
+    
+    # Generate PDF
+    template_path = os.path.join(os.path.dirname(__file__), "templates", "fortrust_application_form.pdf")
+    if not os.path.exists(template_path):
+        raise HTTPException(status_code=500, detail="Template PDF not found on server. Contact admin.")
+    
+    pdf_bytes = generate_application_form_pdf(student_dict, template_path)
+    
+    # Build safe filename
+    safe_name = (student_dict.get("name") or "student").replace(" ", "_").replace("/", "_")
+    safe_name = "".join(c for c in safe_name if c.isalnum() or c in "_-")
+    filename = f"Fortrust_Application_{safe_name}.pdf"
+    
+    # Log audit event
+    try:
+        log_audit_event(
+            actor=user_data.get("name", "Unknown"),
+            event_type="APPLICATION_FORM_GENERATED",
+            student_id=student_id,
+            message=f"Generated Fortrust Application Form PDF for {student_dict.get('name')}",
         )
-    finally:
-        conn.close()
+    except Exception:
+        pass  # Audit failures shouldn't break PDF download
+    
+    return StreamingResponse(
+        iter([pdf_bytes]),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @app.put("/api/students/{student_id}")
-def update_student(student_id: int, student: StudentUpdate, current_user: dict = Depends(get_current_user)):
-    conn = get_db_connection()
+def update_student(student_id: int, student: StudentUpdate, current_user: dict = Depends(get_current_user), conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
              # ⬇️ RBAC GUARD — check permission based on what's being edited
@@ -4009,13 +4842,10 @@ def update_student(student_id: int, student: StudentUpdate, current_user: dict =
         conn.rollback()
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @app.delete("/api/students/{student_id}", dependencies=[Depends(get_current_master_admin)])
-def delete_student(student_id: int):
-    conn = get_db_connection()
+def delete_student(student_id: int, conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM students WHERE id = %s", (student_id,))
@@ -4029,8 +4859,6 @@ def delete_student(student_id: int):
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
 
 # =====================================================================
 # --- MULTI-ASSIGNEE: ARCHIVE FLOW HELPERS ---
@@ -4039,7 +4867,8 @@ def delete_student(student_id: int):
 def get_agent_students(
     agent_name: str, 
     include_inactive: bool = True,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
 ):
     """
     Return all students assigned to this agent (single assignee or multi-assignee).
@@ -4057,40 +4886,33 @@ def get_agent_students(
                 detail="You can only view your own assigned students."
             )
 
-    conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             if include_inactive:
-                cur.execute("""
+                cur.execute(f"""
                     SELECT id, name, email, phone, status, lead_temperature, 
                            assignee, assignees, program_interest, country_interest,
                            budget, archive_reason, created_at, updated_at
                     FROM students
-                    WHERE (
-                        assignee = %s
-                        OR assignees @> %s::jsonb
-                    )
+                    WHERE {ASSIGNED_TO_USER_NAMES_SQL}
                     ORDER BY 
                         CASE 
                             WHEN UPPER(COALESCE(status, '')) IN ('COMPLETED', 'REJECTED', 'ARCHIVED') THEN 1
                             ELSE 0
                         END,
                         updated_at DESC NULLS LAST
-                """, (agent_name, json.dumps([agent_name])))
+                """, ([agent_name],))
             else:
                 # Active only — used by the archive-agent reassign flow
-                cur.execute("""
+                cur.execute(f"""
                     SELECT id, name, email, phone, status, lead_temperature,
                            assignee, assignees, program_interest, country_interest,
                            budget
                     FROM students
-                    WHERE (
-                        assignee = %s
-                        OR assignees @> %s::jsonb
-                    )
+                    WHERE {ASSIGNED_TO_USER_NAMES_SQL}
                     AND UPPER(COALESCE(status, '')) NOT IN ('COMPLETED', 'REJECTED', 'ARCHIVED')
                     ORDER BY name ASC
-                """, (agent_name, json.dumps([agent_name])))
+                """, ([agent_name],))
             
             students = cur.fetchall()
             for s in students:
@@ -4101,8 +4923,6 @@ def get_agent_students(
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 class ReassignBulkRequest(BaseModel):
@@ -4113,96 +4933,27 @@ class ReassignBulkRequest(BaseModel):
 
 
 @app.post("/api/admin/reassign-students", dependencies=[Depends(get_current_master_admin)])
-def reassign_students_bulk(req: ReassignBulkRequest, user_data: dict = Depends(verify_token)):
+def reassign_students_bulk(req: ReassignBulkRequest, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     """
     Bulk-reassign students from one agent to another.
     - mode='replace': remove from_agent from each student's assignees, add to_agent
     - mode='remove_only': just remove from_agent (used when student already has other assignees)
     """
-    conn = get_db_connection()
     actor = user_data.get("name", "Master Admin")
+    if req.mode == "replace":
+        note_msg = f"Reassigned by {actor}: {req.from_agent} → {req.to_agent}"
+    else:
+        note_msg = f"Assignee removed by {actor}: {req.from_agent}"
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Get the students to update
-            if req.student_ids:
-                # Use specific list
-                cur.execute("""
-                    SELECT id, name, assignee, assignees FROM students
-                    WHERE id::text = ANY(%s)
-                """, ([str(i) for i in req.student_ids],))
-            else:
-                # Get ALL active students of this agent
-                cur.execute("""
-                    SELECT id, name, assignee, assignees FROM students
-                    WHERE (assignee = %s OR assignees @> %s::jsonb)
-                      AND UPPER(COALESCE(status, '')) NOT IN ('COMPLETED', 'REJECTED', 'ARCHIVED')
-                """, (req.from_agent, json.dumps([req.from_agent])))
-            
-            students = cur.fetchall()
-            updated_count = 0
-
-            for s in students:
-                # Normalize current assignees
-                current_assignees_raw = s.get('assignees')
-                if current_assignees_raw is None:
-                    current_assignees = []
-                elif isinstance(current_assignees_raw, list):
-                    current_assignees = list(current_assignees_raw)
-                elif isinstance(current_assignees_raw, str):
-                    try: current_assignees = json.loads(current_assignees_raw)
-                    except: current_assignees = []
-                else:
-                    current_assignees = []
-
-                # If legacy single field has a value not in the array, include it
-                old_single = s.get('assignee')
-                if old_single and old_single != 'Unassigned' and old_single not in current_assignees:
-                    current_assignees.insert(0, old_single)
-
-                # Remove from_agent
-                new_assignees = [a for a in current_assignees if a != req.from_agent]
-
-                # Replace mode: add to_agent if not present and not "Unassigned"
-                if req.mode == "replace" and req.to_agent and req.to_agent != "Unassigned":
-                    if req.to_agent not in new_assignees:
-                        new_assignees.append(req.to_agent)
-
-                # New primary = first in array
-                new_primary = new_assignees[0] if new_assignees else "Unassigned"
-
-                cur.execute("""
-                    UPDATE students
-                    SET assignee = %s, assignees = %s::jsonb
-                    WHERE id = %s
-                """, (new_primary, json.dumps(new_assignees), s['id']))
-
-                # Timeline note
-                if req.mode == "replace":
-                    note_msg = f"Reassigned by {actor}: {req.from_agent} → {req.to_agent}"
-                else:
-                    note_msg = f"Assignee removed by {actor}: {req.from_agent}"
-
-                timeline_note = {
-                    "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    "author": actor,
-                    "note": note_msg
-                }
-                cur.execute("""
-                    UPDATE students 
-                    SET timeline = COALESCE(timeline, '[]'::jsonb) || %s::jsonb 
-                    WHERE id = %s
-                """, (json.dumps([timeline_note]), s['id']))
-
-                # Chat system message
-                try:
-                    cur.execute("""
-                        INSERT INTO chat_messages (student_id, sender, message, is_system)
-                        VALUES (%s, 'System', %s, TRUE)
-                    """, (s['id'], note_msg))
-                except Exception:
-                    pass
-
-                updated_count += 1
+        with conn.cursor() as cur:
+            # One set-based pass (see student_assignees.reassign_students):
+            # every student's assignees, timeline note and chat message.
+            updated_ids = reassign_students(
+                cur, req.from_agent, req.to_agent, actor, note_msg,
+                replace=req.mode == "replace",
+                student_ids=_normalize_student_ids(req.student_ids) if req.student_ids else None,
+            )
+            updated_count = len(updated_ids)
 
             log_audit_event(
                 conn=conn, action="BULK_REASSIGN", entity="System",
@@ -4215,39 +4966,35 @@ def reassign_students_bulk(req: ReassignBulkRequest, user_data: dict = Depends(v
                 }
             )
             conn.commit()
+            invalidate_user_cache()
 
             return {
                 "status": "success",
                 "message": f"Reassigned {updated_count} student(s) from {req.from_agent} to {req.to_agent}.",
-                "updated_count": updated_count
+                "updated_count": updated_count,
+                "student_ids": [str(i) for i in updated_ids],
             }
     except Exception as e:
         conn.rollback()
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 # =====================================================================
 # --- 9. NETWORK DIRECTORY & INSTITUTIONS ---
 # =====================================================================
 @app.get("/api/institutions")
-def get_institutions(user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
+def get_institutions(user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT * FROM institutions ORDER BY name ASC")
             return {"status": "success", "data": cur.fetchall()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.post("/api/institutions")
-def create_institution(inst: dict, user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
+def create_institution(inst: dict, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             cur.execute("""
@@ -4264,13 +5011,12 @@ def create_institution(inst: dict, user_data: dict = Depends(verify_token)):
                 inst.get('agreement_type', ''),
             ))
             new_id = cur.fetchone()[0]
+            link_institution(cur, new_id, inst.get('name', 'New Institution'))
             conn.commit()
             return {"status": "success", "message": "Institution created", "id": new_id}
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 # ============================================================
 # INSTITUTION AGREEMENTS (multi-document with File + Link support)
@@ -4327,8 +5073,7 @@ async def upload_agreement_file(
         }
         
         # Append to institution.agreements array
-        conn = get_db_connection()
-        try:
+        async with checkout_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     UPDATE institutions 
@@ -4337,9 +5082,7 @@ async def upload_agreement_file(
                 """, (json.dumps([new_agreement]), institution_id))
                 conn.commit()
             
-            return {"status": "success", "agreement": new_agreement}
-        finally:
-            conn.close()
+        return {"status": "success", "agreement": new_agreement}
             
     except HTTPException:
         raise
@@ -4351,68 +5094,66 @@ async def upload_agreement_file(
 def view_agreement(
     institution_id: str,
     agreement_id: str,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
 ):
     """Fetch an institution agreement and stream it through the backend.
     Uses service_role key to access private bucket. Auth required."""
-    conn = get_db_connection()
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT agreements FROM institutions WHERE id = %s", (institution_id,))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(404, "Institution not found")
+    
+    agreements = row.get("agreements") or []
+    if isinstance(agreements, str):
+        try: agreements = json.loads(agreements)
+        except: agreements = []
+    
+    target = next((a for a in agreements if a.get("id") == agreement_id), None)
+    if not target:
+        raise HTTPException(404, "Agreement not found")
+    
+    # For link-type agreements, return the URL directly
+    if target.get("type") == "link":
+        return {"type": "link", "url": target.get("url")}
+    
+    # File-type — proxy the download
+    storage_path = target.get("filename")
+    if not storage_path:
+        raise HTTPException(404, "File path missing from agreement record")
+    
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT agreements FROM institutions WHERE id = %s", (institution_id,))
-            row = cur.fetchone()
-            if not row:
-                raise HTTPException(404, "Institution not found")
-        
-        agreements = row.get("agreements") or []
-        if isinstance(agreements, str):
-            try: agreements = json.loads(agreements)
-            except: agreements = []
-        
-        target = next((a for a in agreements if a.get("id") == agreement_id), None)
-        if not target:
-            raise HTTPException(404, "Agreement not found")
-        
-        # For link-type agreements, return the URL directly
-        if target.get("type") == "link":
-            return {"type": "link", "url": target.get("url")}
-        
-        # File-type — proxy the download
-        storage_path = target.get("filename")
-        if not storage_path:
-            raise HTTPException(404, "File path missing from agreement record")
-        
-        try:
-            file_bytes = supabase.storage.from_("student-documents").download(storage_path)
-        except Exception as e:
-            raise HTTPException(404, f"File not accessible in storage: {str(e)[:200]}")
-        
-        # MIME detection
-        ext = os.path.splitext(storage_path)[1].lower()
-        mime_map = {
-            ".pdf": "application/pdf",
-            ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
-            ".png": "image/png",
-            ".doc": "application/msword",
-            ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        }
-        mime = mime_map.get(ext, "application/octet-stream")
-        
-        display_name = target.get("name") or f"agreement{ext}"
-        
-        return StreamingResponse(
-            iter([file_bytes]),
-            media_type=mime,
-            headers={"Content-Disposition": f'inline; filename="{display_name}"'}
-        )
-    finally:
-        conn.close()
+        file_bytes = supabase.storage.from_("student-documents").download(storage_path)
+    except Exception as e:
+        raise HTTPException(404, f"File not accessible in storage: {str(e)[:200]}")
+    
+    # MIME detection
+    ext = os.path.splitext(storage_path)[1].lower()
+    mime_map = {
+        ".pdf": "application/pdf",
+        ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
+        ".png": "image/png",
+        ".doc": "application/msword",
+        ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    }
+    mime = mime_map.get(ext, "application/octet-stream")
+    
+    display_name = target.get("name") or f"agreement{ext}"
+    
+    return StreamingResponse(
+        iter([file_bytes]),
+        media_type=mime,
+        headers={"Content-Disposition": f'inline; filename="{display_name}"'}
+    )
 
 
 @app.post("/api/institutions/{institution_id}/agreements/link")
 def add_agreement_link(
     institution_id: str,
     body: dict,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
 ):
     """Add an agreement via external link (Drive, Dropbox, etc.)."""
     if not (is_master_admin(user_data) or is_manager_role(user_data)):
@@ -4437,32 +5178,28 @@ def add_agreement_link(
         "uploaded_at": dt.now().isoformat()
     }
     
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE institutions 
-                SET agreements = COALESCE(agreements, '[]'::jsonb) || %s::jsonb
-                WHERE id = %s
-            """, (json.dumps([new_agreement]), institution_id))
-            conn.commit()
-        
-        return {"status": "success", "agreement": new_agreement}
-    finally:
-        conn.close()
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE institutions 
+            SET agreements = COALESCE(agreements, '[]'::jsonb) || %s::jsonb
+            WHERE id = %s
+        """, (json.dumps([new_agreement]), institution_id))
+        conn.commit()
+    
+    return {"status": "success", "agreement": new_agreement}
 
 
 @app.delete("/api/institutions/{institution_id}/agreements/{agreement_id}")
 def delete_agreement(
     institution_id: str,
     agreement_id: str,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
 ):
     """Remove an agreement from an institution. Also deletes file from storage if it was uploaded."""
     if not (is_master_admin(user_data) or is_manager_role(user_data)):
         raise HTTPException(status_code=403, detail="Only Master Admin or Managers can delete agreements.")
     
-    conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             # Get current agreements
@@ -4502,12 +5239,9 @@ def delete_agreement(
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.put("/api/institutions/{inst_id}")
-def update_institution(inst_id: int, inst: InstitutionUpdate, user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
+def update_institution(inst_id: int, inst: InstitutionUpdate, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             data = inst.dict(exclude_unset=True)
@@ -4526,18 +5260,17 @@ def update_institution(inst_id: int, inst: InstitutionUpdate, user_data: dict =
                     params.append(value)
             params.append(inst_id)
             cur.execute(f"UPDATE institutions SET {', '.join(updates)} WHERE id = %s", tuple(params))
+            if data.get('name'):
+                link_institution(cur, inst_id, data['name'])
             conn.commit()
             return {"status": "success", "message": "Institution updated successfully"}
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.delete("/api/institutions/{inst_id}")
-def delete_institution(inst_id: int, user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
+def delete_institution(inst_id: int, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM institutions WHERE id = %s", (inst_id,))
@@ -4551,8 +5284,6 @@ def delete_institution(inst_id: int, user_data: dict = Depends(verify_token)):
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 # =====================================================================
@@ -5033,8 +5764,7 @@ Begin extraction now."""
 # --- 11. GLOBAL BROADCAST HUB ---
 # =====================================================================
 @app.post("/api/admin/broadcasts", dependencies=[Depends(get_current_master_admin)])
-def create_broadcast(req: BroadcastCreate, user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
+def create_broadcast(req: BroadcastCreate, user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             # 1. Save to DB
@@ -5168,13 +5898,10 @@ def create_broadcast(req: BroadcastCreate, user_data: dict = Depends(verify_toke
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
 
 
 @app.get("/api/admin/broadcasts", dependencies=[Depends(get_current_master_admin)])
-def get_broadcasts():
-    conn = get_db_connection()
+def get_broadcasts(conn=Depends(get_db)):
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
@@ -5188,16 +5915,13 @@ def get_broadcasts():
             return {"status": "success", "data": logs}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 # =====================================================================
 # --- 12. COMMISSIONS & PAYOUTS LEDGER ---
 # =====================================================================
 @app.get("/api/commissions")
-def get_commissions(user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
+def get_commissions(user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             if user_data.get("role") == "MASTER_ADMIN":
@@ -5242,13 +5966,10 @@ def get_commissions(user_data: dict = Depends(verify_token)):
             return {"status": "success", "data": processed}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 @app.post("/api/commissions/claim")
-def claim_commissions(user_data: dict = Depends(verify_token)):
-    conn = get_db_connection()
+def claim_commissions(user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     try:
         with conn.cursor() as cur:
             if user_data.get("role") == "MASTER_ADMIN":
@@ -5264,8 +5985,6 @@ def claim_commissions(user_data: dict = Depends(verify_token)):
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 
 # =====================================================================
@@ -5403,22 +6122,21 @@ async def upload_document(
     document_type: str = Form(...),
     user_data: dict = Depends(verify_token)
 ):
-    conn = None
     try:
-        conn = get_db_connection()
-
-        # Access check - only authorized users can upload to this student
-        if not check_student_access(conn, student_id, user_data):
-            log_audit_event(
-                conn=conn, action="DENIED_UPLOAD", entity="Student",
-                entity_id=student_id, changed_by=user_data.get("name", "Unknown"),
-                details={"reason": "not_authorized_for_student", "endpoint": "upload-document"}
-            )
-            conn.commit()
-            raise HTTPException(
-                status_code=403,
-                detail="You do not have permission to upload documents for this student."
-            )
+        # Access check - only authorized users can upload to this student.
+        # The connection is released before the upload and extraction.
+        async with checkout_db_connection() as conn:
+            if not check_student_access(conn, student_id, user_data):
+                log_audit_event(
+                    conn=conn, action="DENIED_UPLOAD", entity="Student",
+                    entity_id=student_id, changed_by=user_data.get("name", "Unknown"),
+                    details={"reason": "not_authorized_for_student", "endpoint": "upload-document"}
+                )
+                conn.commit()
+                raise HTTPException(
+                    status_code=403,
+                    detail="You do not have permission to upload documents for this student."
+                )
 
         # MIME check
         if file.content_type and file.content_type not in ALLOWED_MIME_TYPES:
@@ -5433,50 +6151,61 @@ async def upload_document(
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
         safe_filename = f"S{student_id}_{clean_doc_type}_{timestamp}_{clean_original}"
 
-        file_bytes = await file.read()
+        # Stream to disk: size cap, MIME sniff and sha256 in one pass
+        try:
+            spooled = await spool_upload(file, MAX_FILE_SIZE_BYTES)
+        except UploadRejected as rejected:
+            raise HTTPException(status_code=400, detail=f"{file.filename}: {rejected}")
 
-        # Size check
-        if len(file_bytes) > MAX_FILE_SIZE_BYTES:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large (max {MAX_FILE_SIZE_MB}MB)"
-            )
-        if len(file_bytes) == 0:
-            raise HTTPException(status_code=400, detail="Empty file.")
+        record = None
+        with spooled:
+            public_url = ""
+            if supabase:
+                try:
+                    await asyncio.to_thread(
+                        upload_to_storage, supabase.storage.from_("student-documents"),
+                        safe_filename, spooled
+                    )
+                    public_url = f"/api/documents/{safe_filename}"
+                except Exception as supa_err:
+                    print(f"[upload-document] Supabase error: {supa_err}")
+                    raise HTTPException(status_code=500, detail=f"Cloud storage error: {str(supa_err)[:100]}")
+            else:
+                # Local fallback (ephemeral on Render)
+                shutil.copyfile(spooled.path, f"uploads/{safe_filename}")
+                public_url = f"/uploads/{safe_filename}"
 
-        public_url = ""
-        if supabase:
-            try:
-                supabase.storage.from_("student-documents").upload(
-                    path=safe_filename,
-                    file=file_bytes,
-                    file_options={"content-type": file.content_type or "application/octet-stream"}
+            if supabase:
+                # Extract once here; AI consumers read document_extractions
+                record = await extract_file_async(
+                    spooled.path, media_type_for(safe_filename) or spooled.content_type,
+                    spooled.sha256, spooled.size
                 )
-                public_url = f"/api/documents/{safe_filename}"
-            except Exception as supa_err:
-                print(f"[upload-document] Supabase error: {supa_err}")
-                raise HTTPException(status_code=500, detail=f"Cloud storage error: {str(supa_err)[:100]}")
-        else:
-            # Local fallback (ephemeral on Render)
-            file_location = f"uploads/{safe_filename}"
-            with open(file_location, "wb") as buffer:
-                buffer.write(file_bytes)
-            public_url = f"/uploads/{safe_filename}"
 
-        log_audit_event(
-            conn=conn,
-            action="UPLOAD_DOC",
-            entity="Student",
-            entity_id=str(student_id),
-            changed_by=user_data.get("name", "Unknown"),
-            details={
-                "document_type": document_type,
-                "filename": file.filename,
-                "stored_as": safe_filename,
-                "size_bytes": len(file_bytes)
-            }
-        )
-        conn.commit()
+        async with checkout_db_connection() as conn:
+            if record:
+                save_extraction(conn, safe_filename, record, student_id=int(student_id))
+            with conn.cursor() as cur:
+                add_document(
+                    cur, student_id, safe_filename, f"{document_type} - {file.filename}",
+                    user_data.get("name", "Unknown"), spooled.size, spooled.sha256
+                )
+
+            log_audit_event(
+                conn=conn,
+                action="UPLOAD_DOC",
+                entity="Student",
+                entity_id=str(student_id),
+                changed_by=user_data.get("name", "Unknown"),
+                details={
+                    "document_type": document_type,
+                    "filename": file.filename,
+                    "stored_as": safe_filename,
+                    "size_bytes": spooled.size,
+                    "sha256": spooled.sha256
+                }
+            )
+            conn.commit()
 
         return {
             "status": "success",
@@ -5488,93 +6217,67 @@ async def upload_document(
     except HTTPException:
         raise
     except Exception as e:
-        if conn:
-            conn.rollback()
         print("[upload-document] FATAL:")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
 
 @app.post("/api/admin/cleanup-orphan-docs")
 def cleanup_orphan_docs(
     fix: bool = False,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db),
 ):
     if user_data.get("role") != "MASTER_ADMIN":
         raise HTTPException(status_code=403, detail="Only Master Admin can run this.")
     if not supabase:
         raise HTTPException(status_code=500, detail="Supabase not configured.")
  
-    conn = get_db_connection()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT id, name, documents FROM students WHERE documents IS NOT NULL")
-        students = cur.fetchall()
- 
-        report = []
-        total_orphans = 0
-        total_cleaned = 0
+        cur.execute("""
+            SELECT d.student_id, s.name AS student_name, d.filename, d.title
+            FROM student_documents d
+            JOIN students s ON s.id = d.student_id
+            ORDER BY d.student_id, d.uploaded_at, d.id
+        """)
+        docs = cur.fetchall()
+        conn.rollback()  # don't hold a transaction open across the storage calls
  
-        for student in students:
-            raw_docs = student.get('documents')
-            if raw_docs is None:
-                continue
-            if isinstance(raw_docs, str):
-                try:
-                    docs = json.loads(raw_docs)
-                except Exception:
-                    continue
-            elif isinstance(raw_docs, list):
-                docs = raw_docs
-            else:
-                continue
+        report = {}
+        orphan_filenames = []
  
-            if not isinstance(docs, list):
+        for doc in docs:
+            filename = doc['filename']
+            try:
+                # Try to get file info from Supabase
+                files = supabase.storage.from_("student-documents").list(
+                    path="",
+                    options={"search": filename}
+                )
+                exists = any(f.get('name') == filename for f in (files or []))
+            except Exception as e:
+                print(f"[cleanup] Could not check {filename}: {e}")
+                exists = True  # Keep it if we can't verify (safer)
+            if exists:
                 continue
  
-            valid_docs = []
-            orphan_docs = []
- 
-            for doc in docs:
-                filename = doc.get('filename')
-                if not filename:
-                    orphan_docs.append({"reason": "no filename", "doc": doc})
-                    continue
-                try:
-                    # Try to get file info from Supabase
-                    files = supabase.storage.from_("student-documents").list(
-                        path="",
-                        options={"search": filename}
-                    )
-                    exists = any(f.get('name') == filename for f in (files or []))
-                    if exists:
-                        valid_docs.append(doc)
-                    else:
-                        orphan_docs.append({"reason": "missing in supabase", "doc": doc})
-                        total_orphans += 1
-                except Exception as e:
-                    print(f"[cleanup] Could not check {filename}: {e}")
-                    valid_docs.append(doc)  # Keep it if we can't verify (safer)
- 
-            if orphan_docs:
-                report.append({
-                    "student_id": student['id'],
-                    "student_name": student['name'],
-                    "orphan_count": len(orphan_docs),
-                    "orphans": [o['doc'].get('title') or o['doc'].get('filename') for o in orphan_docs]
-                })
+            orphan_filenames.append(filename)
+            entry = report.setdefault(doc['student_id'], {
+                "student_id": doc['student_id'],
+                "student_name": doc['student_name'],
+                "orphan_count": 0,
+                "orphans": []
+            })
+            entry["orphan_count"] += 1
+            entry["orphans"].append(doc['title'] or filename)
  
-                if fix:
-                    cur.execute(
-                        "UPDATE students SET documents = %s::jsonb WHERE id = %s",
-                        (json.dumps(valid_docs), student['id'])
-                    )
-                    total_cleaned += len(orphan_docs)
+        total_orphans = len(orphan_filenames)
+        total_cleaned = 0
+        report = list(report.values())
  
-        if fix:
-            conn.commit()
+        if fix and orphan_filenames:
+            cur.execute("DELETE FROM student_documents WHERE filename = ANY(%s)", (orphan_filenames,))
+            total_cleaned = cur.rowcount
             log_audit_event(
                 conn=conn, action="CLEANUP_ORPHAN_DOCS", entity="System",
                 entity_id=None, changed_by=user_data.get("name", "Admin"),
@@ -5596,24 +6299,18 @@ def cleanup_orphan_docs(
         raise
     except Exception as e:
         traceback.print_exc()
-        if conn:
-            conn.rollback()
+        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
 
 @app.delete("/api/pipeline/{case_id}/document/{filename}")
-async def delete_document(
+def delete_document(
     case_id: str,
     filename: str,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
 ):
-    conn = None
-    cur = None
+    # Plain def: the storage call below blocks, so this runs on the threadpool.
     try:
-        conn = get_db_connection()
- 
         # Access check
         if not check_student_access(conn, case_id, user_data):
             log_audit_event(
@@ -5633,25 +6330,13 @@ async def delete_document(
             raise HTTPException(status_code=403, detail="This file doesn't belong to this student.")
  
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT documents FROM students WHERE id = %s", (case_id,))
-        student = cur.fetchone()
-        if not student:
+        cur.execute("SELECT 1 FROM students WHERE id = %s", (case_id,))
+        if not cur.fetchone():
             raise HTTPException(status_code=404, detail="Student not found.")
  
-        # Parse existing docs
-        raw_docs = student.get('documents')
-        if raw_docs is None:
-            docs = []
-        elif isinstance(raw_docs, str):
-            try: docs = json.loads(raw_docs)
-            except: docs = []
-        elif isinstance(raw_docs, list):
-            docs = raw_docs
-        else:
-            docs = []
- 
-        # Find the doc
-        doc_to_delete = next((d for d in docs if d.get('filename') == filename), None)
+        # Drop the record first; the transaction is only committed once
+        # storage has been attempted.
+        doc_to_delete = remove_document(cur, case_id, filename)
         if not doc_to_delete:
             raise HTTPException(status_code=404, detail="Document not found in vault.")
  
@@ -5661,16 +6346,10 @@ async def delete_document(
             try:
                 supabase.storage.from_("student-documents").remove([filename])
                 supabase_removed = True
+                document_proxy.forget(filename)
             except Exception as supa_err:
                 print(f"[delete-doc] Supabase remove error for {filename}: {supa_err}")
  
-        # Remove from documents JSONB
-        new_docs = [d for d in docs if d.get('filename') != filename]
-        cur.execute(
-            "UPDATE students SET documents = %s::jsonb WHERE id = %s",
-            (json.dumps(new_docs), case_id)
-        )
- 
         # Audit log
         log_audit_event(
             conn=conn, action="DELETE_DOC", entity="Student",
@@ -5695,14 +6374,8 @@ async def delete_document(
     except Exception as e:
         print(f"[delete-doc] FATAL: {e}")
         traceback.print_exc()
-        if conn:
-            conn.rollback()
+        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
 # ============================================================
 # SOP TEMPLATE — Master Admin uploads once, everyone downloads
 # ============================================================
@@ -5740,8 +6413,7 @@ async def upload_sop_template(
             file_options={"content-type": file.content_type or "application/pdf"}
         )
         
-        conn = get_db_connection()
-        try:
+        async with checkout_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     INSERT INTO app_settings (key, value, updated_by, updated_at)
@@ -5752,8 +6424,6 @@ async def upload_sop_template(
                         updated_at = NOW()
                 """, (storage_path, user_data.get("name", "Master Admin")))
                 conn.commit()
-        finally:
-            conn.close()
         
         return {
             "status": "success",
@@ -5769,9 +6439,8 @@ async def upload_sop_template(
 
 
 @app.get("/api/templates/sop")
-def download_sop_template(user_data: dict = Depends(verify_token)):
+def download_sop_template(user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     """Any authenticated user can download the SOP template."""
-    conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT value FROM app_settings WHERE key = 'sop_template_path'")
@@ -5801,38 +6470,32 @@ def download_sop_template(user_data: dict = Depends(verify_token)):
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
-    finally:
-        conn.close()
 
 
 @app.get("/api/templates/sop/info")
-def sop_template_info(user_data: dict = Depends(verify_token)):
+def sop_template_info(user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     """Check if SOP template exists + metadata."""
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT value, updated_by, updated_at 
-                FROM app_settings 
-                WHERE key = 'sop_template_path'
-            """)
-            row = cur.fetchone()
-            
-            if not row:
-                return {"status": "success", "exists": False}
-            
-            return {
-                "status": "success",
-                "exists": True,
-                "uploaded_by": row.get("updated_by"),
-                "uploaded_at": row["updated_at"].isoformat() if row.get("updated_at") else None,
-                "filename": os.path.basename(row["value"])
-            }
-    finally:
-        conn.close()
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT value, updated_by, updated_at 
+            FROM app_settings 
+            WHERE key = 'sop_template_path'
+        """)
+        row = cur.fetchone()
+        
+        if not row:
+            return {"status": "success", "exists": False}
+        
+        return {
+            "status": "success",
+            "exists": True,
+            "uploaded_by": row.get("updated_by"),
+            "uploaded_at": row["updated_at"].isoformat() if row.get("updated_at") else None,
+            "filename": os.path.basename(row["value"])
+        }
 
 @app.get("/api/admin/archived-analytics")
-def get_archived_analytics(user_data: dict = Depends(verify_token)):
+def get_archived_analytics(user_data: dict = Depends(verify_token), conn=Depends(get_db)):
     """
     Comprehensive analytics for archived (lost) students.
     Master Admin sees all. Team Managers / Corporate Agents see only their team's archived students.
@@ -5840,7 +6503,6 @@ def get_archived_analytics(user_data: dict = Depends(verify_token)):
     if not (is_master_admin(user_data) or is_manager_role(user_data)):
         raise HTTPException(status_code=403, detail="Manager or Master Admin access required.")
     
-    conn = get_db_connection()
     try:
         # ⬇️ RBAC SCOPING — Master Admin sees all, Managers see their team only
         scope_clause, scope_params = get_visible_student_filter(user_data, conn)
@@ -5862,16 +6524,24 @@ def get_archived_analytics(user_data: dict = Depends(verify_token)):
             """, scope_params)
             archived = cur.fetchall()
             
-            # Also fetch total active + completed for context (within scope)
-            cur.execute(f"""
-                SELECT 
-                    COUNT(*) FILTER (WHERE UPPER(COALESCE(status, '')) NOT IN ('ARCHIVED', 'COMPLETED', 'REJECTED')) AS active_count,
-                    COUNT(*) FILTER (WHERE UPPER(COALESCE(status, '')) = 'COMPLETED') AS completed_count,
-                    COUNT(*) FILTER (WHERE UPPER(COALESCE(status, '')) = 'ARCHIVED') AS archived_count,
-                    COUNT(*) AS total_count
-                FROM students
-                WHERE {scope_clause}
-            """, scope_params)
+            # Also fetch total active + completed for context (within scope).
+            # Unscoped (Master Admin) totals come from the dashboard rollups.
+            cur.execute(ROLLUP_FRESHNESS_SQL)
+            freshness = cur.fetchone()
+            if scope_clause == "TRUE" and freshness.get("last_full_rebuild_at"):
+                cur.execute(ROLLUP_STATUS_COUNTS_SQL)
+                counts_source = "rollup"
+            else:
+                cur.execute(f"""
+                    SELECT 
+                        COUNT(*) FILTER (WHERE UPPER(COALESCE(status, '')) NOT IN ('ARCHIVED', 'COMPLETED', 'REJECTED')) AS active_count,
+                        COUNT(*) FILTER (WHERE UPPER(COALESCE(status, '')) = 'COMPLETED') AS completed_count,
+                        COUNT(*) FILTER (WHERE UPPER(COALESCE(status, '')) = 'ARCHIVED') AS archived_count,
+                        COUNT(*) AS total_count
+                    FROM students
+                    WHERE {scope_clause}
+                """, scope_params)
+                counts_source = "live"
             counts = cur.fetchone()
         
         # Normalize archived rows
@@ -6091,6 +6761,7 @@ def get_archived_analytics(user_data: dict = Depends(verify_token)):
                 ],
                 "high_value_losses": high_value_losses,
                 "archived_students": archived,  # Full list for the table
+                "freshness": describe_freshness(freshness, counts_source),
             }
         }
     except HTTPException:
@@ -6098,8 +6769,6 @@ def get_archived_analytics(user_data: dict = Depends(verify_token)):
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @app.get("/api/me/permissions")
 def get_my_permissions(user_data: dict = Depends(verify_token)):
@@ -6112,70 +6781,50 @@ def get_my_permissions(user_data: dict = Depends(verify_token)):
 @app.post("/api/students/{student_id}/auto-fill-form")
 def auto_fill_application_form(
     student_id: int,
-    user_data: dict = Depends(verify_token)
+    user_data: dict = Depends(verify_token),
+    conn=Depends(get_db)
 ):
     """Use Gemini to read ALL of a student's uploaded documents and extract
     structured fields for the Application Form."""
-    require_can_view_student(user_data, student_id)
-    
     # 1. Get the student's documents from the vault
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                "SELECT id, name, documents FROM students WHERE id = %s",
-                (student_id,)
-            )
-            student = cur.fetchone()
-            if not student:
-                raise HTTPException(404, "Student not found")
-    finally:
-        conn.close()
+    require_can_view_student(conn, student_id, user_data)
     
-    documents = student.get("documents") or []
-    if isinstance(documents, str):
-        try: documents = json.loads(documents)
-        except: documents = []
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "SELECT id, name FROM students WHERE id = %s",
+            (student_id,)
+        )
+        student = cur.fetchone()
+        if not student:
+            raise HTTPException(404, "Student not found")
+    documents = list_documents(conn, student_id)
     
     if not documents:
         raise HTTPException(400, "No documents uploaded yet. Upload passport, transcripts, language tests, etc. to the Application Vault first.")
     
-    # 2. Download each doc from Supabase Storage and prep for Gemini
-    doc_parts = []
-    successfully_processed = []
-    
-    SUPPORTED_MIMES = {
-        "pdf": "application/pdf",
-        "jpg": "image/jpeg",
-        "jpeg": "image/jpeg",
-        "png": "image/png",
-        "webp": "image/webp",
-        "heic": "image/heic",
-        "heif": "image/heif",
-    }
-    
-    for doc in documents[:15]:  # cap to avoid token explosion
-        filename = doc.get("filename")
-        title = doc.get("title", filename)
-        if not filename:
-            continue
-        ext = filename.lower().split(".")[-1]
-        mime = SUPPORTED_MIMES.get(ext)
-        if not mime:
-            continue  # Skip unsupported types (doc, xlsx, txt)
-        try:
-            file_bytes = supabase.storage.from_("student-documents").download(filename)
-            if file_bytes and len(file_bytes) < 15 * 1024 * 1024:  # 15MB max per file
-                doc_parts.append({
-                    "inline_data": {
-                        "mime_type": mime,
-                        "data": base64.b64encode(file_bytes).decode()
-                    }
-                })
-                successfully_processed.append(title)
-        except Exception as e:
-            print(f"[Auto-fill] Could not download {filename}: {e}")
-            continue
+    # 2. Download the docs from Supabase Storage (concurrently) and prep for Gemini
+    if not supabase:
+        raise HTTPException(503, "Cloud storage not configured.")
+
+    fetched = fetch_and_extract(
+        documents[:15],  # cap to avoid token explosion
+        download_student_document,
+        extract_text=False,  # Gemini reads the files natively here
+        max_bytes=15 * 1024 * 1024,  # 15MB max per file
+    )
+    for failure in fetched["failures"]:
+        print(f"[Auto-fill] Could not download {failure['filename']}: {failure['error']}")
+
+    doc_parts = [
+        {
+            "inline_data": {
+                "mime_type": item["mime_type"],
+                "data": base64.b64encode(item["bytes"]).decode()
+            }
+        }
+        for item in fetched["documents"]
+    ]
+    successfully_processed = [item["label"] for item in fetched["documents"]]
     
     if not doc_parts:
         raise HTTPException(400, "Could not read any supported documents (PDF, JPG, PNG, WEBP). Try uploading clearer files.")
@@ -6268,7 +6917,8 @@ Be conservative. When uncertain, use null. Mami will review your output."""
             "status": "success",
             "data": parsed,
             "documents_processed": len(doc_parts),
-            "document_titles": successfully_processed
+            "document_titles": successfully_processed,
+            "failed_documents": fetched["failures"]
         }
     
     except json.JSONDecodeError as e:
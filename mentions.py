@@ -0,0 +1,111 @@
+"""
+@mention resolution for team chat.
+
+extract_mentions() used to load every active user per message and, for each
+@token, compare it against every word of every user name. That is
+O(tokens x users x words) plus a users query per message. post_chat_message
+didn't even call it: it stored a bare re.findall(r'@(\\w+)'), so "@Budi
+Santoso" was saved as "Budi" and no notification was ever written.
+
+MentionIndex is built once from the active user names and cached in
+user_cache, so invalidate_user_cache() rebuilds it after user changes. It
+holds two character tries:
+
+  - full names: at each "@" the text is walked along this trie, and the
+    longest full name ending on a word boundary wins. This is what the chat
+    box's mention picker inserts ("@Budi Santoso ");
+  - name words: for a typed "@bud", the first word after "@" is looked up as
+    a prefix of any word of any name. It is kept as the fallback for hand-typed
+    mentions. A prefix matching more than MENTION_MAX_PREFIX_MATCHES users
+    is ambiguous and ignored, so "@a" doesn't page half the company.
+
+Each "@" costs time proportional to the length of the name it matches,
+whatever the number of users.
+"""
+import os
+import re
+
+MENTION_MAX_PREFIX_MATCHES = int(os.getenv("MENTION_MAX_PREFIX_MATCHES", "3"))
+
+_WORD_RE = re.compile(r"[\w.\-]+")
+
+
+def _is_boundary(text: str, pos: int) -> bool:
+    return pos >= len(text) or not (text[pos].isalnum() or text[pos] == "_")
+
+
+class _Node:
+    __slots__ = ("children", "user", "users")
+
+    def __init__(self):
+        self.children = {}
+        self.user = None    # full-name trie: the user whose name ends here
+        self.users = None   # word trie: users with a name word through this node
+
+
+class MentionIndex:
+    def __init__(self, names):
+        self._names = _Node()
+        self._words = _Node()
+        self.size = 0
+        for name in dict.fromkeys(n for n in names if n and n.strip()):
+            self.add(name)
+
+    def add(self, name: str):
+        key = " ".join(name.lower().split())
+        node = self._names
+        for ch in key:
+            node = node.children.setdefault(ch, _Node())
+        node.user = name
+
+        for word in key.split():
+            node = self._words
+            for ch in word:
+                node = node.children.setdefault(ch, _Node())
+                if node.users is None:
+                    node.users = []
+                if name not in node.users:
+                    node.users.append(name)
+        self.size += 1
+
+    def _longest_name(self, text: str, start: int):
+        """Longest full name starting at text[start] and ending on a word boundary."""
+        node, best, pos = self._names, None, start
+        while pos < len(text):
+            ch = text[pos].lower()
+            if ch.isspace():
+                # Collapse runs of whitespace the way add() does.
+                while pos + 1 < len(text) and text[pos + 1].isspace():
+                    pos += 1
+                ch = " "
+            node = node.children.get(ch)
+            if node is None:
+                break
+            pos += 1
+            if node.user is not None and _is_boundary(text, pos):
+                best = node.user
+        return best
+
+    def _by_prefix(self, token: str) -> list:
+        node = self._words
+        for ch in token.lower():
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        users = node.users or []
+        return users if len(users) <= MENTION_MAX_PREFIX_MATCHES else []
+
+    def resolve(self, text: str) -> list:
+        """User names mentioned in `text`, in order of first mention."""
+        found = {}
+        for match in re.finditer(r"(?:^|(?<=[^\w@]))@", text):
+            start = match.end()
+            user = self._longest_name(text, start)
+            if user is not None:
+                found.setdefault(user, None)
+                continue
+            word = _WORD_RE.match(text, start)
+            if word:
+                for name in self._by_prefix(word.group(0).rstrip(".-")):
+                    found.setdefault(name, None)
+        return list(found)
@@ -0,0 +1,592 @@
+"""
+Versioned schema migrations.
+
+Replaces the old verify_schema() that re-ran ~50 ALTER TABLEs and a
+full-table backfill on every worker boot. Each migration runs exactly once
+and is recorded in `schema_version`; a boot where nothing changed costs a
+single `SELECT MAX(version)`.
+
+Adding a migration: append a function decorated with @migration(<next
+version>, "<description>"). Never edit or renumber one that has shipped.
+
+  - transactional=True (default): runs in one transaction together with its
+    schema_version row, with a short lock_timeout so DDL never queues
+    behind live traffic for long (it fails and is retried next boot).
+  - transactional=False: runs in autocommit mode for statements that can't
+    run in a transaction (CREATE INDEX CONCURRENTLY) or that commit in
+    batches (backfills). These must be safe to re-run if interrupted.
+
+Runners on several workers serialise on a Postgres advisory lock, so only
+one of them applies anything. The others poll for it with nothing open
+rather than blocking in a transaction, which the holder's CREATE INDEX
+CONCURRENTLY would otherwise wait on forever.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # list applied / pending
+"""
+import os
+import sys
+import time
+
+import psycopg2
+from psycopg2 import errors as pg_errors
+
+from ai_jobs import AI_JOBS_SCHEMA_SQL
+from ai_report_cache import AI_REPORT_CACHE_SCHEMA_SQL
+from dashboard_stats import (
+    APPLICATIONS_ROLLUP_TRIGGER_SQL, DASHBOARD_ROLLUP_SCHEMA_SQL, SAFE_JSONB_ARRAY_SQL,
+)
+from document_pipeline import DOCUMENT_EXTRACTIONS_SCHEMA_SQL
+from lead_import import LEAD_DEDUP_INDEXES
+from realtime_events import REALTIME_SCHEMA_SQL
+from student_applications import STUDENT_APPLICATIONS_BACKFILL_SQL, STUDENT_APPLICATIONS_SCHEMA_SQL
+from student_assignees import (
+    STUDENT_ASSIGNEES_BACKFILL_SQL, STUDENT_ASSIGNEES_SCHEMA_SQL, STUDENT_ASSIGNEES_TRIGGERS_SQL,
+)
+from student_documents import (
+    DOC_COUNT_TRIGGER_SQL, STUDENT_DOCUMENTS_BACKFILL_SQL, STUDENT_DOCUMENTS_SCHEMA_SQL,
+)
+from query_plans import STUDENT_INDEXES
+
+MIGRATION_LOCK_KEY = 7301000
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+MIGRATION_LOCK_POLL_SECONDS = float(os.getenv("MIGRATION_LOCK_POLL_SECONDS", "2"))
+MIGRATION_LOCK_WAIT_SECONDS = float(os.getenv("MIGRATION_LOCK_WAIT_SECONDS", "1800"))
+BACKFILL_BATCH_SIZE = int(os.getenv("MIGRATION_BACKFILL_BATCH_SIZE", "5000"))
+
+MIGRATIONS = []  # (version, description, fn, transactional)
+
+
+def migration(version: int, description: str, transactional: bool = True):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn, transactional))
+        return fn
+    return register
+
+
+def backfill_in_batches(conn, sql: str, params=None, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Repeats an UPDATE/DELETE that processes at most `%(batch_size)s` rows per
+    statement until it touches nothing, committing after each batch so locks
+    stay short. The statement must stop matching rows it has already fixed.
+    """
+    total = 0
+    params = dict(params or {}, batch_size=batch_size)
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            affected = cur.rowcount
+        conn.commit()
+        total += affected
+        if affected < batch_size:
+            return total
+
+
+def backfill_by_id_range(conn, sql: str, table: str = "students", batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Runs `sql` once per slice of `table`'s id range, binding %(first_id)s and
+    %(last_id)s (inclusive), and commits after each slice, so no transaction
+    spans the whole table. Slices already done must be no-ops on a re-run.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT MIN(id), MAX(id) FROM {table}")
+        low, high = cur.fetchone()
+    conn.commit()
+    total = 0
+    if low is None:
+        return total
+    for first_id in range(low, high + 1, batch_size):
+        with conn.cursor() as cur:
+            cur.execute(sql, {"first_id": first_id, "last_id": first_id + batch_size - 1})
+            total += max(cur.rowcount, 0)
+        conn.commit()
+    return total
+
+
+# =====================================================================
+# --- MIGRATIONS ---
+# =====================================================================
+@migration(1, "baseline: columns and tables previously ensured by verify_schema()")
+def _baseline(conn, cur):
+    # Everything here is IF NOT EXISTS, so it is a no-op on databases that
+    # were already kept up to date by the old startup check.
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS pdf_text TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS notes TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS commission_earned NUMERIC DEFAULT 0.0;")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS program_interest TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS lead_source TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS lead_temperature TEXT DEFAULT 'Cold Leads';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS currency VARCHAR(10) DEFAULT 'USD';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS payout_status TEXT DEFAULT 'PENDING_CENSUS';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS agent_cut NUMERIC DEFAULT 0;")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS documents JSONB DEFAULT '[]'::jsonb;")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS loss_reason TEXT DEFAULT '';")
+
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS agent_type TEXT DEFAULT 'Individual Agent';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS corporation_name TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS office_address TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bank_name TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bank_branch TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bank_address TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS bank_account TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS swift_code TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE;")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS max_capacity INTEGER DEFAULT 50;")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS commission_rate NUMERIC DEFAULT 0;")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS parent_corporate_id INTEGER REFERENCES users(id) ON DELETE SET NULL;")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS training_points INTEGER DEFAULT 0;")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_archived BOOLEAN DEFAULT FALSE;")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS emergency_contact TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS email TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS field_interests TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS budget TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS archive_reason TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS father_name TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS father_email TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS father_whatsapp TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS mother_name TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS mother_email TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS mother_whatsapp TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS academic_field TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS career_goal TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS campus_env TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS country_interest TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE students ADD COLUMN IF NOT EXISTS assignees JSONB DEFAULT '[]'::jsonb;")
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id SERIAL PRIMARY KEY,
+            student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+            sender TEXT NOT NULL,
+            message TEXT NOT NULL,
+            mentioned_users JSONB DEFAULT '[]'::jsonb,
+            read_by JSONB DEFAULT '[]'::jsonb,
+            is_system BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id SERIAL PRIMARY KEY,
+            recipient_username TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            message TEXT NOT NULL,
+            is_read BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS institutions (
+            id SERIAL PRIMARY KEY,
+            name TEXT DEFAULT '',
+            type TEXT DEFAULT '',
+            country TEXT DEFAULT '',
+            city TEXT DEFAULT '',
+            status TEXT DEFAULT 'Active',
+            website TEXT DEFAULT '',
+            establishment_year TEXT DEFAULT '',
+            student_intake TEXT DEFAULT '',
+            programs_offered TEXT DEFAULT '',
+            agreement_id TEXT DEFAULT '',
+            agreement_date TEXT DEFAULT '',
+            agreement_type TEXT DEFAULT '',
+            base_commission TEXT DEFAULT '',
+            performance_bonus TEXT DEFAULT '',
+            tiered_levels TEXT DEFAULT '',
+            duration_start TEXT DEFAULT '',
+            duration_end TEXT DEFAULT '',
+            terms_conditions TEXT DEFAULT '',
+            contacts JSONB DEFAULT '[]',
+            total_referrals INTEGER DEFAULT 0,
+            total_enrollment INTEGER DEFAULT 0,
+            total_base_commission TEXT DEFAULT '',
+            total_payable TEXT DEFAULT '',
+            commission_status TEXT DEFAULT 'Pending',
+            payment_date TEXT DEFAULT '',
+            commission_notes TEXT DEFAULT '',
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+    cur.execute("ALTER TABLE institutions ADD COLUMN IF NOT EXISTS document_link TEXT;")
+    cur.execute("ALTER TABLE institutions ADD COLUMN IF NOT EXISTS commission_programs JSONB DEFAULT '[]'::jsonb;")
+    cur.execute("ALTER TABLE institutions ADD COLUMN IF NOT EXISTS ai_extracted_at TIMESTAMP;")
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS audit_logs (
+            id SERIAL PRIMARY KEY,
+            action TEXT,
+            entity TEXT,
+            entity_id TEXT,
+            changed_by TEXT,
+            details JSONB DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            target_role TEXT DEFAULT 'ALL',
+            target_branch TEXT DEFAULT 'ALL',
+            send_email BOOLEAN DEFAULT FALSE,
+            created_by TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+
+
+@migration(2, "backfill students.assignees from the legacy assignee column", transactional=False)
+def _backfill_assignees(conn, cur):
+    backfill_in_batches(conn, """
+        UPDATE students
+        SET assignees = jsonb_build_array(assignee)
+        WHERE id IN (
+            SELECT id FROM students
+            WHERE (assignees IS NULL OR assignees = '[]'::jsonb)
+              AND assignee IS NOT NULL
+              AND assignee != ''
+              AND assignee != 'Unassigned'
+            LIMIT %(batch_size)s
+            FOR UPDATE SKIP LOCKED
+        )
+    """)
+
+
+@migration(3, "keep students.assignees populated when only assignee is written")
+def _sync_assignees_trigger(conn, cur):
+    # The old boot-time backfill was the only thing filling `assignees` for
+    # rows created through endpoints that write just `assignee`. Do it at
+    # write time instead.
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION fill_students_assignees() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF (NEW.assignees IS NULL OR NEW.assignees = '[]'::jsonb)
+               AND NEW.assignee IS NOT NULL
+               AND NEW.assignee != ''
+               AND NEW.assignee != 'Unassigned' THEN
+                NEW.assignees := jsonb_build_array(NEW.assignee);
+            END IF;
+            RETURN NEW;
+        END $$;
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS students_fill_assignees ON students")
+    cur.execute("""
+        CREATE TRIGGER students_fill_assignees
+            BEFORE INSERT OR UPDATE OF assignee, assignees ON students
+            FOR EACH ROW EXECUTE FUNCTION fill_students_assignees()
+    """)
+
+
+@migration(4, "safe_jsonb_array() helper for dashboard aggregates")
+def _safe_jsonb_array(conn, cur):
+    cur.execute(SAFE_JSONB_ARRAY_SQL)
+
+
+@migration(5, "dashboard rollup tables and dirty-day trigger")
+def _dashboard_rollups(conn, cur):
+    cur.execute(DASHBOARD_ROLLUP_SCHEMA_SQL)
+
+
+@migration(6, "indexes for the students hot predicates", transactional=False)
+def _student_indexes(conn, cur):
+    for name, ddl in STUDENT_INDEXES:
+        _create_index_concurrently(cur, name, ddl)
+
+
+def _create_index_concurrently(cur, name: str, ddl: str):
+    """CREATE INDEX CONCURRENTLY, first dropping a leftover INVALID copy from an interrupted build."""
+    cur.execute("""
+        SELECT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+    """, (name,))
+    row = cur.fetchone()
+    if row and not row[0]:
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    cur.execute(ddl.replace("CREATE INDEX IF NOT EXISTS", "CREATE INDEX CONCURRENTLY IF NOT EXISTS", 1))
+
+
+@migration(7, "index users.parent_corporate_id for the recursive hierarchy lookup", transactional=False)
+def _users_parent_index(conn, cur):
+    _create_index_concurrently(
+        cur, "idx_users_parent_corporate_id",
+        "CREATE INDEX IF NOT EXISTS idx_users_parent_corporate_id ON users (parent_corporate_id)",
+    )
+
+
+@migration(8, "ai_jobs queue for background AI report generation")
+def _ai_jobs(conn, cur):
+    cur.execute(AI_JOBS_SCHEMA_SQL)
+
+
+@migration(9, "ai_report_cache for content-addressed Gemini reports")
+def _ai_report_cache(conn, cur):
+    cur.execute(AI_REPORT_CACHE_SCHEMA_SQL)
+
+
+@migration(10, "document_extractions: per-file page text written once at upload")
+def _document_extractions(conn, cur):
+    cur.execute(DOCUMENT_EXTRACTIONS_SCHEMA_SQL)
+
+
+@migration(11, "indexes for bulk-import dedup by email and phone digits", transactional=False)
+def _lead_dedup_indexes(conn, cur):
+    for name, ddl in LEAD_DEDUP_INDEXES:
+        _create_index_concurrently(cur, name, ddl)
+
+
+@migration(12, "pg_notify triggers on chat_messages and notifications for server push")
+def _realtime_triggers(conn, cur):
+    cur.execute(REALTIME_SCHEMA_SQL)
+
+
+@migration(13, "chat_read_state high-water marks (from read_by) and chat id-cursor index", transactional=False)
+def _chat_read_state(conn, cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS chat_read_state (
+            student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+            user_name TEXT NOT NULL,
+            last_read_id INTEGER NOT NULL DEFAULT 0,
+            read_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (student_id, user_name)
+        )
+    """)
+    # Each reader's mark is the newest message whose read_by lists them.
+    cur.execute("""
+        INSERT INTO chat_read_state (student_id, user_name, last_read_id)
+        SELECT m.student_id, r->>'user', MAX(m.id)
+        FROM chat_messages m
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(m.read_by) = 'array' THEN m.read_by ELSE '[]'::jsonb END
+        ) r
+        WHERE r->>'user' IS NOT NULL
+        GROUP BY m.student_id, r->>'user'
+        ON CONFLICT (student_id, user_name) DO NOTHING
+    """)
+    _create_index_concurrently(
+        cur, "idx_chat_messages_student_id",
+        "CREATE INDEX IF NOT EXISTS idx_chat_messages_student_id ON chat_messages (student_id, id)",
+    )
+
+
+@migration(14, "append-only timeline_entries (from students.timeline) with reminder and per-student indexes",
+           transactional=False)
+def _timeline_entries(conn, cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS timeline_entries (
+            id BIGSERIAL PRIMARY KEY,
+            student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+            author TEXT NOT NULL DEFAULT 'Unknown',
+            note TEXT NOT NULL DEFAULT '',
+            reminder_date DATE,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    # Legacy entries carry "date" as 'YYYY-MM-DD HH:MM' (sometimes ISO with a
+    # 'T'); anything unparseable falls back to the student's created_at.
+    # students.timeline itself is left in place, no longer read or written.
+    # Each slice commits on its own, so a re-run skips students whose
+    # entries were already copied.
+    backfill_by_id_range(conn, r"""
+        INSERT INTO timeline_entries (student_id, author, note, reminder_date, created_at)
+        SELECT s.id,
+               COALESCE(NULLIF(e->>'author', ''), 'Unknown'),
+               COALESCE(e->>'note', e->>'content', ''),
+               CASE WHEN e->>'reminder_date' ~ '^\d{4}-\d{2}-\d{2}$'
+                    THEN (e->>'reminder_date')::date END,
+               COALESCE(
+                   CASE
+                       WHEN e->>'date' ~ '^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}'
+                           THEN replace(left(e->>'date', 16), 'T', ' ')::timestamp
+                       WHEN e->>'date' ~ '^\d{4}-\d{2}-\d{2}$'
+                           THEN (e->>'date')::date::timestamp
+                   END,
+                   s.created_at, NOW()
+               )
+        FROM students s
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(s.timeline) = 'array' THEN s.timeline ELSE '[]'::jsonb END
+        ) WITH ORDINALITY AS t(e, ord)
+        WHERE s.id BETWEEN %(first_id)s AND %(last_id)s
+          AND jsonb_typeof(e) = 'object'
+          AND NOT EXISTS (SELECT 1 FROM timeline_entries x WHERE x.student_id = s.id)
+        ORDER BY s.id, t.ord
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_timeline_entries_reminder
+        ON timeline_entries (reminder_date) WHERE reminder_date IS NOT NULL
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_timeline_entries_student
+        ON timeline_entries (student_id, created_at)
+    """)
+
+
+@migration(15, "student_documents table (from students.documents) with a trigger-maintained doc_count",
+           transactional=False)
+def _student_documents(conn, cur):
+    cur.execute(STUDENT_DOCUMENTS_SCHEMA_SQL)
+    backfill_by_id_range(conn, STUDENT_DOCUMENTS_BACKFILL_SQL)
+    cur.execute(DOC_COUNT_TRIGGER_SQL)
+
+
+@migration(16, "student_applications table (from students.applications) with status enum and institution FK",
+           transactional=False)
+def _student_applications(conn, cur):
+    cur.execute(STUDENT_APPLICATIONS_SCHEMA_SQL)
+    backfill_by_id_range(conn, STUDENT_APPLICATIONS_BACKFILL_SQL)
+    cur.execute(APPLICATIONS_ROLLUP_TRIGGER_SQL)
+    # Institution names in the rollup now come from linked institutions;
+    # rebuild it all on the next refresh.
+    cur.execute("UPDATE dashboard_rollup_state SET last_full_rebuild_at = NULL")
+
+
+@migration(17, "student_assignees join table (from assignee/assignees names) kept in sync by triggers",
+           transactional=False)
+def _student_assignees(conn, cur):
+    cur.execute(STUDENT_ASSIGNEES_SCHEMA_SQL)
+    # Triggers first: students written while the backfill runs (new rows,
+    # or slices it has already passed) are synced by them.
+    cur.execute(STUDENT_ASSIGNEES_TRIGGERS_SQL)
+    backfill_by_id_range(conn, STUDENT_ASSIGNEES_BACKFILL_SQL)
+
+
+# =====================================================================
+# --- RUNNER ---
+# =====================================================================
+def latest_version() -> int:
+    return max(v for v, *_ in MIGRATIONS)
+
+
+def current_version(conn) -> int:
+    """MAX(version) from schema_version, or 0 if the table doesn't exist yet."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            version = cur.fetchone()[0]
+        conn.rollback()
+        return version
+    except pg_errors.UndefinedTable:
+        conn.rollback()
+        return 0
+
+
+def _acquire_migration_lock(conn) -> bool:
+    """
+    Takes the migration advisory lock, polling pg_try_advisory_lock in
+    autocommit mode. A worker blocked in pg_advisory_lock holds a transaction
+    open, and CREATE INDEX CONCURRENTLY in the holder waits for it to end.
+    Returns False, without the lock, once another worker has applied
+    everything.
+    """
+    deadline = time.monotonic() + MIGRATION_LOCK_WAIT_SECONDS
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            if cur.fetchone()[0]:
+                return True
+        if current_version(conn) >= latest_version():
+            return False
+        if time.monotonic() >= deadline:
+            raise RuntimeError(
+                f"migration lock still held by another runner after {MIGRATION_LOCK_WAIT_SECONDS:.0f}s"
+            )
+        time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+
+
+def run_migrations(conn) -> list:
+    """
+    Applies pending migrations on a psycopg2 connection. Returns the list of
+    versions applied (empty on the fast path).
+    """
+    if current_version(conn) >= latest_version():
+        return []
+
+    applied_now = []
+    conn.autocommit = True
+    if not _acquire_migration_lock(conn):
+        conn.autocommit = False
+        return applied_now
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    duration_ms INTEGER
+                )
+            """)
+            # Re-read under the lock: another worker may have just finished.
+            cur.execute("SELECT version FROM schema_version")
+            done = {r[0] for r in cur.fetchall()}
+
+        for version, description, fn, transactional in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version in done:
+                continue
+            started = time.perf_counter()
+            print(f"[migrations] applying {version}: {description}")
+            conn.autocommit = not transactional
+            with conn.cursor() as cur:
+                if transactional:
+                    cur.execute("SELECT set_config('lock_timeout', %s, true)", (MIGRATION_LOCK_TIMEOUT,))
+                fn(conn, cur)
+                cur.execute(
+                    "INSERT INTO schema_version (version, description, duration_ms) VALUES (%s, %s, %s)",
+                    (version, description, int((time.perf_counter() - started) * 1000)),
+                )
+            if transactional:
+                conn.commit()
+            applied_now.append(version)
+    except Exception:
+        if not conn.autocommit:
+            conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+        conn.autocommit = False
+    return applied_now
+
+
+def migration_status(conn) -> list:
+    applied = {}
+    if current_version(conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT version, applied_at, duration_ms FROM schema_version")
+            applied = {r[0]: r[1:] for r in cur.fetchall()}
+        conn.rollback()
+    return [
+        {
+            "version": version,
+            "description": description,
+            "applied_at": applied[version][0].isoformat() if version in applied else None,
+            "duration_ms": applied[version][1] if version in applied else None,
+        }
+        for version, description, _, _ in sorted(MIGRATIONS, key=lambda m: m[0])
+    ]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    connection = psycopg2.connect(os.getenv("DATABASE_URL"), sslmode="require")
+    try:
+        if "--status" in sys.argv:
+            for m in migration_status(connection):
+                mark = "x" if m["applied_at"] else " "
+                print(f"[{mark}] {m['version']:>3}  {m['description']}  {m['applied_at'] or ''}")
+        else:
+            applied = run_migrations(connection)
+            print(f"Applied {applied}" if applied else "Schema is up to date.")
+    finally:
+        connection.close()
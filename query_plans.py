@@ -0,0 +1,206 @@
+"""
+Indexes for the students table's hot predicates, plus an EXPLAIN-based
+regression check that every hot query is served by the index meant for it.
+
+The expression indexes must match the predicates in main.py character for
+character (UPPER(COALESCE(status, '')) etc.) or the planner won't use them,
+so the hot queries below are copied from the endpoints that run them. When
+you add a query to a hot path, add it to HOT_QUERIES too, with the index
+(or indexes, any one of which will do) it should use.
+
+"No Seq Scan" alone isn't a usable check: with enable_seqscan off and a
+missing index, the planner walks the whole of students_pkey instead, which
+is just as slow and looks like an Index Scan. So each query must show one of
+its expected indexes in the plan.
+"""
+import json
+
+from student_assignees import ASSIGNED_TO_USER_IDS_SQL, ASSIGNED_TO_USER_NAMES_SQL
+
+# Visibility and per-agent lists go through student_assignees (see
+# student_assignees.py), whose own indexes come with its table.
+STUDENT_INDEXES = [
+    # Commissions / payouts key on the primary `assignee` name; bulk
+    # reassignment matches a (possibly deleted) agent's name in either column
+    ("idx_students_assignee", "CREATE INDEX IF NOT EXISTS idx_students_assignee ON students (assignee)"),
+    ("idx_students_assignees_gin", "CREATE INDEX IF NOT EXISTS idx_students_assignees_gin ON students USING GIN (assignees)"),
+    # Normalized status / temperature predicates
+    ("idx_students_status_norm", "CREATE INDEX IF NOT EXISTS idx_students_status_norm ON students ((UPPER(COALESCE(status, ''))))"),
+    ("idx_students_temperature_norm", "CREATE INDEX IF NOT EXISTS idx_students_temperature_norm ON students ((LOWER(COALESCE(lead_temperature, ''))))"),
+    # Staleness (action queue)
+    ("idx_students_last_activity", "CREATE INDEX IF NOT EXISTS idx_students_last_activity ON students ((COALESCE(updated_at, created_at)))"),
+    # Status-filtered lists ordered by recency
+    ("idx_students_status_created", "CREATE INDEX IF NOT EXISTS idx_students_status_created ON students ((UPPER(COALESCE(status, ''))), created_at DESC)"),
+    # ORDER BY created_at DESC (pipeline), id as tie-breaker
+    ("idx_students_created_id", "CREATE INDEX IF NOT EXISTS idx_students_created_id ON students (created_at DESC, id DESC)"),
+]
+
+# name -> (sql, params, expected indexes, selective). Params are representative
+# values; only the plan shape matters. `selective` queries touch few enough
+# rows that the planner should pick the index on its own, with seqscan
+# enabled, on analyzed data.
+HOT_QUERIES = {
+    "pipeline_visible_to_agent": (
+        f"""
+        SELECT id FROM students
+        WHERE {ASSIGNED_TO_USER_IDS_SQL}
+        ORDER BY created_at DESC
+        """,
+        [[1, 2]],
+        ("idx_student_assignees_user",),
+        False,
+    ),
+    "pipeline_first_page": (
+        "SELECT id FROM students ORDER BY created_at DESC, id DESC LIMIT 50",
+        None,
+        ("idx_students_created_id",),
+        True,
+    ),
+    "action_queue_hot_stale": (
+        """
+        SELECT id FROM students
+        WHERE LOWER(COALESCE(lead_temperature, '')) IN ('hot leads', 'warm leads')
+          AND UPPER(COALESCE(status, '')) NOT IN ('COMPLETED', 'REJECTED', 'ARCHIVED')
+          AND COALESCE(updated_at, created_at) < NOW() - INTERVAL '3 days'
+        ORDER BY COALESCE(updated_at, created_at) ASC
+        LIMIT 50
+        """,
+        None,
+        ("idx_students_last_activity", "idx_students_temperature_norm", "idx_students_status_norm", "idx_students_status_created"),
+        False,
+    ),
+    "stale_by_last_activity": (
+        """
+        SELECT id FROM students
+        WHERE COALESCE(updated_at, created_at) < NOW() - INTERVAL '3 days'
+        ORDER BY COALESCE(updated_at, created_at) ASC
+        LIMIT 50
+        """,
+        None,
+        ("idx_students_last_activity",),
+        False,
+    ),
+    "commissions_ready": (
+        """
+        SELECT id FROM students
+        WHERE UPPER(COALESCE(status, '')) = 'COMPLETED'
+          AND COALESCE(commission_earned, 0) > 0
+        LIMIT 50
+        """,
+        None,
+        ("idx_students_status_norm", "idx_students_status_created"),
+        False,
+    ),
+    "archived_list": (
+        """
+        SELECT id FROM students
+        WHERE UPPER(COALESCE(status, '')) = 'ARCHIVED'
+        ORDER BY updated_at DESC NULLS LAST
+        """,
+        None,
+        ("idx_students_status_norm", "idx_students_status_created"),
+        False,
+    ),
+    "status_recent": (
+        """
+        SELECT id FROM students
+        WHERE UPPER(COALESCE(status, '')) = %s
+        ORDER BY created_at DESC
+        LIMIT 50
+        """,
+        ["NEW"],
+        ("idx_students_status_created", "idx_students_created_id"),
+        True,
+    ),
+    "agent_students": (
+        f"""
+        SELECT id FROM students
+        WHERE {ASSIGNED_TO_USER_NAMES_SQL}
+          AND UPPER(COALESCE(status, '')) NOT IN ('COMPLETED', 'REJECTED', 'ARCHIVED')
+        ORDER BY name ASC
+        """,
+        [["Agent 1"]],
+        ("idx_student_assignees_user",),
+        False,
+    ),
+}
+
+
+def create_student_indexes(cur):
+    for _, ddl in STUDENT_INDEXES:
+        cur.execute(ddl)
+
+
+def _index_names(plan: dict) -> set:
+    names = {plan["Index Name"]} if plan.get("Index Name") else set()
+    for child in plan.get("Plans", []):
+        names |= _index_names(child)
+    return names
+
+
+def _seq_scans(plan: dict, table: str) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") == table:
+        found.append(plan)
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child, table))
+    return found
+
+
+def _explain(cur, sql: str, params) -> dict:
+    cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    raw = cur.fetchone()[0]
+    return (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+
+
+def check_hot_query_plans(conn, table: str = "students") -> dict:
+    """
+    EXPLAINs every hot query twice and reports the ones whose plan doesn't
+    use one of their expected indexes:
+
+      - forced: with enable_seqscan off, so the planner takes any usable
+        index. The expected index must appear and `table` must not be
+        sequentially scanned; a full walk of the primary key (what you get
+        when the right index is missing) fails the first condition.
+      - natural: selective queries only, with the planner's own choice. This
+        needs ANALYZEd data of realistic size to mean anything.
+
+    Works on a psycopg2 connection; runs in its own transaction and rolls it
+    back. Returns {"ok": bool, "queries": {name: {"ok", "expected", "plan", "natural"}}}.
+    """
+    report = {}
+    try:
+        with conn.cursor() as cur:
+            for name, (sql, params, expected, selective) in HOT_QUERIES.items():
+                if not selective:
+                    continue
+                plan = _explain(cur, sql, params)
+                report[name] = {"natural": {
+                    "ok": bool(_index_names(plan) & set(expected)),
+                    "plan": _summarize(plan),
+                }}
+
+            cur.execute("SET LOCAL enable_seqscan = off")
+            for name, (sql, params, expected, _) in HOT_QUERIES.items():
+                plan = _explain(cur, sql, params)
+                ok = bool(_index_names(plan) & set(expected)) and not _seq_scans(plan, table)
+                entry = report.setdefault(name, {})
+                entry.update({"ok": ok, "expected": list(expected), "plan": _summarize(plan)})
+                if "natural" in entry:
+                    entry["ok"] = ok and entry["natural"]["ok"]
+    finally:
+        conn.rollback()
+    return {"ok": all(r["ok"] for r in report.values()), "queries": report}
+
+
+def _summarize(plan: dict, depth: int = 0) -> list:
+    """Flattens a JSON plan into readable lines: 'Index Scan using idx_x on students'."""
+    label = plan.get("Node Type", "?")
+    if plan.get("Index Name"):
+        label += f" using {plan['Index Name']}"
+    if plan.get("Relation Name"):
+        label += f" on {plan['Relation Name']}"
+    lines = ["  " * depth + label]
+    for child in plan.get("Plans", []):
+        lines.extend(_summarize(child, depth + 1))
+    return lines
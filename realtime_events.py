@@ -0,0 +1,323 @@
+"""
+Server push for chat messages, @mentions and notifications.
+
+TeamCollabChat polled /api/pipeline/{id}/chat every few seconds, and every
+poll re-ran the access check and re-read the whole thread; the dashboard
+layout polled /api/notifications the same way. Now:
+
+  - AFTER INSERT triggers on chat_messages and notifications call
+    pg_notify(REALTIME_CHANNEL, ...). The payload carries the new row when
+    it fits under Postgres' 8000-byte limit, otherwise just its ids;
+  - each API process runs one EventHub thread holding a dedicated
+    LISTEN connection. It fans each notification out to the asyncio
+    queues of the SSE streams subscribed to its topic:
+        ("student", id)  chat messages of one dossier
+        ("user", name)   that user's notifications and @mentions;
+  - the SSE endpoints in main.py replay what a client missed (everything
+    after its Last-Event-ID) from the database, then forward pushed rows.
+    Clients therefore only ever receive deltas.
+
+After the listener reconnects, or when a slow client's queue overflows, its
+subscribers get a {"type": "resync"} event. They replay from the database
+instead of trusting the gap.
+
+LISTEN needs a session connection. Through a transaction pooler (e.g.
+Supabase's on port 6543) it is accepted but nothing is ever delivered, so
+the hub only reports itself connected once a NOTIFY it sent to itself has
+come back. Until then the SSE endpoints answer `unavailable` and clients
+keep polling.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+REALTIME_CHANNEL = "fortrust_events"
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "256"))
+REALTIME_HEARTBEAT_SECONDS = float(os.getenv("REALTIME_HEARTBEAT_SECONDS", "15"))
+REALTIME_RECONNECT_SECONDS = float(os.getenv("REALTIME_RECONNECT_SECONDS", "2"))
+REALTIME_PROBE_SECONDS = float(os.getenv("REALTIME_PROBE_SECONDS", "5"))
+
+# pg_notify payloads must stay under 8000 bytes; larger rows are sent as ids.
+REALTIME_SCHEMA_SQL = """
+    CREATE OR REPLACE FUNCTION notify_chat_message() RETURNS trigger AS $$
+    DECLARE
+        payload TEXT;
+    BEGIN
+        payload := json_build_object(
+            'type', 'chat', 'id', NEW.id, 'student_id', NEW.student_id,
+            'mentions', COALESCE(NEW.mentioned_users, '[]'::jsonb),
+            'row', json_build_object(
+                'id', NEW.id, 'student_id', NEW.student_id, 'sender', NEW.sender,
+                'message', NEW.message, 'mentioned_users', COALESCE(NEW.mentioned_users, '[]'::jsonb),
+                'is_system', COALESCE(NEW.is_system, FALSE), 'created_at', NEW.created_at
+            )
+        )::text;
+        IF octet_length(payload) > 7900 THEN
+            payload := json_build_object(
+                'type', 'chat', 'id', NEW.id, 'student_id', NEW.student_id,
+                'mentions', COALESCE(NEW.mentioned_users, '[]'::jsonb)
+            )::text;
+        END IF;
+        IF octet_length(payload) > 7900 THEN
+            payload := json_build_object('type', 'chat', 'id', NEW.id, 'student_id', NEW.student_id)::text;
+        END IF;
+        PERFORM pg_notify('fortrust_events', payload);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_chat_messages_notify ON chat_messages;
+    CREATE TRIGGER trg_chat_messages_notify
+        AFTER INSERT ON chat_messages
+        FOR EACH ROW EXECUTE FUNCTION notify_chat_message();
+
+    CREATE OR REPLACE FUNCTION notify_notification() RETURNS trigger AS $$
+    DECLARE
+        payload TEXT;
+    BEGIN
+        payload := json_build_object(
+            'type', 'notification', 'id', NEW.id, 'recipient', NEW.recipient_username,
+            'row', json_build_object(
+                'id', NEW.id, 'recipient_username', NEW.recipient_username, 'sender', NEW.sender,
+                'message', NEW.message, 'is_read', COALESCE(NEW.is_read, FALSE),
+                'created_at', to_char(NEW.created_at, 'YYYY-MM-DD HH24:MI:SS')
+            )
+        )::text;
+        IF octet_length(payload) > 7900 THEN
+            payload := json_build_object(
+                'type', 'notification', 'id', NEW.id, 'recipient', NEW.recipient_username
+            )::text;
+        END IF;
+        PERFORM pg_notify('fortrust_events', payload);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_notifications_notify ON notifications;
+    CREATE TRIGGER trg_notifications_notify
+        AFTER INSERT ON notifications
+        FOR EACH ROW EXECUTE FUNCTION notify_notification();
+"""
+
+RESYNC = {"type": "resync"}
+
+
+def event_topics(event: dict) -> list:
+    """Which subscriptions an event from the channel is delivered to."""
+    if event.get("type") == "chat":
+        topics = [("student", int(event["student_id"]))]
+        mentions = event.get("mentions") or []
+        topics += [("user", name) for name in dict.fromkeys(m for m in mentions if isinstance(m, str))]
+        return topics
+    if event.get("type") == "notification" and event.get("recipient"):
+        return [("user", event["recipient"])]
+    return []
+
+
+def sse_message(data, event: Optional[str] = None, event_id=None) -> str:
+    """One text/event-stream frame."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscription:
+    """An SSE stream's inbox. Lives on the event loop that created it."""
+
+    def __init__(self, hub: "EventHub", topic: tuple, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.hub = hub
+        self.topic = topic
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def _deliver(self, event: dict):
+        # Runs on self.loop. A client too slow to drain its queue gets one
+        # resync marker instead of an unbounded backlog.
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.hub._count("overflows")
+            return
+        self.queue.put_nowait(event)
+
+    async def next(self, timeout: float) -> Optional[dict]:
+        """Next event, or None after `timeout` seconds (time for a heartbeat)."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventHub:
+    """
+    One LISTEN connection per process, fanned out to in-process subscribers.
+    `connect` returns a fresh psycopg2 connection; it is never pooled
+    because LISTEN state belongs to the session, and it must be a direct or
+    session-mode connection (see the module docstring).
+    """
+
+    def __init__(self, connect: Callable, channel: str = REALTIME_CHANNEL,
+                 queue_size: int = REALTIME_QUEUE_SIZE):
+        self._connect = connect
+        self.channel = channel
+        self.queue_size = queue_size
+        self._subs = {}  # topic -> set of Subscription
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.connected = False
+        self._stats = {"notifications": 0, "deliveries": 0, "overflows": 0, "reconnects": 0,
+                       "failed_probes": 0}
+
+    # --- subscribers (event-loop side) ---
+    def subscribe(self, topic: tuple) -> Subscription:
+        sub = Subscription(self, topic, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subs.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subs.get(sub.topic)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.topic]
+
+    def publish(self, event: dict):
+        """Delivers an event to its topics' subscribers; safe from any thread."""
+        for topic in event_topics(event):
+            with self._lock:
+                subs = list(self._subs.get(topic, ()))
+            for sub in subs:
+                try:
+                    sub.loop.call_soon_threadsafe(sub._deliver, event)
+                    self._count("deliveries")
+                except RuntimeError:
+                    self.unsubscribe(sub)  # its event loop is gone
+
+    def _broadcast_resync(self):
+        with self._lock:
+            subs = [s for group in self._subs.values() for s in group]
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._deliver, RESYNC)
+            except RuntimeError:
+                self.unsubscribe(sub)
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "connected": self.connected,
+                "subscriptions": sum(len(s) for s in self._subs.values()),
+                "topics": len(self._subs),
+            }
+
+    # --- listener thread ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="realtime-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                self._probe(conn)
+                self.connected = True
+                if not first:
+                    self._count("reconnects")
+                    self._broadcast_resync()  # anything sent while we were away is lost
+                first = False
+                print(f"[realtime] listening on {self.channel}")
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle(conn.notifies.pop(0))
+            except Exception as e:
+                print(f"[realtime] listener error: {e}")
+            finally:
+                self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(REALTIME_RECONNECT_SECONDS)
+
+    def _probe(self, conn):
+        """
+        NOTIFYs this connection's own channel and waits for it to come back.
+        Raises if it doesn't within REALTIME_PROBE_SECONDS, e.g. because the
+        connection goes through a transaction pooler.
+        """
+        nonce = uuid.uuid4().hex
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (self.channel, json.dumps({"type": "probe", "nonce": nonce})))
+        deadline = time.monotonic() + REALTIME_PROBE_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._count("failed_probes")
+                raise RuntimeError(
+                    "LISTEN probe timed out; REALTIME_DATABASE_URL must be a direct or session-mode connection"
+                )
+            if select.select([conn], [], [], remaining) == ([], [], []):
+                continue
+            conn.poll()
+            answered = False
+            while conn.notifies:
+                note = conn.notifies.pop(0)
+                if _probe_nonce(note.payload) == nonce:
+                    answered = True
+                else:
+                    self._handle(note)
+            if answered:
+                return
+
+    def _handle(self, note):
+        self._count("notifications")
+        if _probe_nonce(note.payload) is not None:
+            return  # another process's probe
+        try:
+            self.publish(json.loads(note.payload))
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"[realtime] bad payload {note.payload[:200]!r}: {e}")
+
+
+def _probe_nonce(payload: str) -> Optional[str]:
+    if '"probe"' not in payload:
+        return None
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        return None
+    return event.get("nonce") if isinstance(event, dict) and event.get("type") == "probe" else None
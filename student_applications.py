@@ -0,0 +1,170 @@
+"""
+University applications as rows in student_applications.
+
+students.applications was a JSON blob: usually an array, sometimes a
+double-encoded string. Every dashboard aggregate unpacked it with
+safe_jsonb_array() / jsonb_array_elements for every student, and institutions
+were grouped by whatever free text was typed into "university". Now:
+
+  - one row per application, in the order the list was saved (position);
+  - status is the application_status enum. normalize_application_status()
+    maps legacy text case-insensitively, and anything else becomes 'Other'
+    with the original wording kept in status_label;
+  - institution_id references institutions when "university" matches an
+    institution's name (case/whitespace-insensitive). link_institution()
+    attaches existing rows when an institution is created or renamed;
+  - indexes on (institution_id, status) and (student_id, position), so
+    institution volume and funnels are indexed GROUP BYs.
+
+Keys other than university/status are kept in `details`, so
+APPLICATION_JSON_SQL gives back the entries the blob used to hold.
+students.applications is left in place by migration 16 but is no longer
+read or written.
+"""
+import json
+
+from psycopg2.extras import execute_values
+
+APPLICATION_STATUSES = (
+    "Draft", "Pending", "Submitted", "Under Review", "Offer Received",
+    "Accepted", "Rejected", "Enrolled", "Withdrawn", "Other",
+)
+
+_STATUS_ENUM_SQL = ", ".join(f"'{s}'" for s in APPLICATION_STATUSES)
+
+STUDENT_APPLICATIONS_SCHEMA_SQL = f"""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace
+            WHERE t.typname = 'application_status' AND n.nspname = current_schema()
+        ) THEN
+            CREATE TYPE application_status AS ENUM ({_STATUS_ENUM_SQL});
+        END IF;
+    END $$;
+
+    CREATE OR REPLACE FUNCTION normalize_application_status(raw TEXT) RETURNS application_status
+    LANGUAGE sql STABLE AS $$
+        SELECT COALESCE(
+            (SELECT e FROM unnest(enum_range(NULL::application_status)) e
+             WHERE lower(e::text) = lower(btrim(raw))),
+            'Other'::application_status
+        )
+    $$;
+
+    CREATE TABLE IF NOT EXISTS student_applications (
+        id BIGSERIAL PRIMARY KEY,
+        student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL DEFAULT 0,
+        institution_id INTEGER REFERENCES institutions(id) ON DELETE SET NULL,
+        university TEXT,
+        status application_status NOT NULL DEFAULT 'Other',
+        status_label TEXT,
+        details JSONB NOT NULL DEFAULT '{{}}'::jsonb,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_student_applications_institution_status
+        ON student_applications (institution_id, status);
+    CREATE INDEX IF NOT EXISTS idx_student_applications_student
+        ON student_applications (student_id, position);
+    CREATE INDEX IF NOT EXISTS idx_institutions_name_key
+        ON institutions ((lower(btrim(name))));
+"""
+
+# The institution an application's free-text "university" points at.
+_INSTITUTION_MATCH_SQL = """
+    (SELECT i.id FROM institutions i
+     WHERE lower(btrim(i.name)) = lower(btrim({university}))
+     ORDER BY i.id LIMIT 1)
+"""
+
+_DETAILS_SQL = "({entry}) - 'university' - 'status'"
+
+# Students with ids in [%(first_id)s, %(last_id)s] that have no rows yet, so
+# re-running a slice changes nothing.
+STUDENT_APPLICATIONS_BACKFILL_SQL = f"""
+    INSERT INTO student_applications
+        (student_id, position, institution_id, university, status, status_label, details)
+    SELECT s.id,
+           t.ord::int - 1,
+           {_INSTITUTION_MATCH_SQL.format(university="e->>'university'")},
+           NULLIF(btrim(e->>'university'), ''),
+           normalize_application_status(e->>'status'),
+           CASE WHEN normalize_application_status(e->>'status') = 'Other'
+                THEN NULLIF(btrim(e->>'status'), '') END,
+           {_DETAILS_SQL.format(entry="e")}
+    FROM students s
+    CROSS JOIN LATERAL jsonb_array_elements(safe_jsonb_array(s.applications)) WITH ORDINALITY AS t(e, ord)
+    WHERE s.id BETWEEN %(first_id)s AND %(last_id)s
+      AND jsonb_typeof(e) = 'object'
+      AND NOT EXISTS (SELECT 1 FROM student_applications x WHERE x.student_id = s.id)
+"""
+
+# One application back in its original blob shape (alias the table `a`).
+APPLICATION_JSON_SQL = """
+    (jsonb_strip_nulls(jsonb_build_object(
+        'university', a.university,
+        'status', CASE WHEN a.status = 'Other' THEN a.status_label ELSE a.status::text END
+    )) || a.details)
+"""
+
+
+def replace_applications(cur, student_id, applications: list) -> int:
+    """
+    Replaces a student's applications with `applications` (the list the
+    blob used to hold). Non-object entries are dropped. Doesn't commit.
+    Returns the number of rows written.
+    """
+    rows = []
+    for position, app in enumerate(a for a in applications if isinstance(a, dict)):
+        status = app.get("status")
+        details = {k: v for k, v in app.items() if k not in ("university", "status")}
+        rows.append((
+            position,
+            str(app.get("university") or "").strip() or None,
+            None if status is None else str(status),
+            json.dumps(details, default=str),
+        ))
+
+    student_id = int(student_id)
+    cur.execute("DELETE FROM student_applications WHERE student_id = %s", (student_id,))
+    if rows:
+        # execute_values takes a single placeholder, so the (integer) id is inlined.
+        execute_values(cur, f"""
+            INSERT INTO student_applications
+                (student_id, position, institution_id, university, status, status_label, details)
+            SELECT {student_id}, v.position, {_INSTITUTION_MATCH_SQL.format(university="v.university")},
+                   v.university, normalize_application_status(v.status),
+                   CASE WHEN normalize_application_status(v.status) = 'Other'
+                        THEN NULLIF(btrim(v.status), '') END,
+                   v.details
+            FROM (VALUES %s) AS v(position, university, status, details)
+        """, rows, template="(%s::int, %s::text, %s::text, %s::jsonb)")
+    return len(rows)
+
+
+def link_institution(cur, institution_id: int, name: str) -> int:
+    """Attaches unlinked applications whose university matches `name`. Doesn't commit."""
+    if not (name or "").strip():
+        return 0
+    cur.execute("""
+        UPDATE student_applications
+        SET institution_id = %s, updated_at = NOW()
+        WHERE institution_id IS NULL AND lower(btrim(university)) = lower(btrim(%s))
+    """, (institution_id, name))
+    return cur.rowcount
+
+
+async def applications_for_students_async(conn, student_ids: list) -> dict:
+    """student_id -> application list for a page of students, in one query (psycopg3, dict rows)."""
+    if not student_ids:
+        return {}
+    async with conn.cursor() as cur:
+        await cur.execute(f"""
+            SELECT a.student_id, jsonb_agg({APPLICATION_JSON_SQL} ORDER BY a.position, a.id) AS applications
+            FROM student_applications a
+            WHERE a.student_id = ANY(%s)
+            GROUP BY a.student_id
+        """, (list(student_ids),))
+        return {r["student_id"]: r["applications"] for r in await cur.fetchall()}
@@ -0,0 +1,295 @@
+"""
+Who a student is assigned to, as rows in student_assignees.
+
+Assignment used to live in two places on students: the legacy `assignee`
+text column and the `assignees` JSONB array, both holding display names.
+Every visibility check had to OR the two (`assignee = ANY(...) OR
+assignees ?| ...`), which only a BitmapOr over two different index types
+could serve, and code that changed assignments normalised both fields in
+Python row by row. Now:
+
+  - one row per (student, user), keyed on users.id rather than the name;
+  - is_primary marks the primary assignee (what `assignee` holds), and
+    position keeps the order of the `assignees` array;
+  - (user_id, student_id) is indexed, so "students of these users" is an
+    index-only semi-join from the users side.
+
+The name columns are still what the endpoints write and what the frontend
+reads, so they stay the source of truth for writes: a trigger on students
+rebuilds a student's rows whenever `assignee` / `assignees` change,
+resolving each name to the newest user of that name (the same rule the
+dashboard uses). Triggers on users rewrite the name columns when a user
+is renamed, and link the students already naming a user when it is
+created, so the two never drift apart. Names that don't resolve to a
+user (typos, deleted agents, 'Unassigned') get no row.
+
+Bulk writers can defer that trigger for the rest of their transaction
+(fortrust.defer_assignee_sync) and resync the rows they touched in one
+statement; reassign_students() does, so moving an agent's whole book is a
+fixed handful of statements however many students it holds. It works on the
+name columns, not on this table, because a deleted agent has no rows here
+any more but still has students to hand over.
+"""
+
+STUDENT_ASSIGNEES_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS student_assignees (
+        student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        is_primary BOOLEAN NOT NULL DEFAULT FALSE,
+        position INTEGER NOT NULL DEFAULT 0,
+        assigned_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (student_id, user_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_student_assignees_user
+        ON student_assignees (user_id, student_id);
+    CREATE INDEX IF NOT EXISTS idx_users_name ON users (name);
+
+    -- (user_id, is_primary, position) for a student's `assignee` and
+    -- `assignees` names. The primary is the first name that resolves; a
+    -- name listed twice keeps its first position.
+    CREATE OR REPLACE FUNCTION resolve_student_assignees(p_assignee TEXT, p_assignees JSONB)
+    RETURNS TABLE (user_id INTEGER, is_primary BOOLEAN, pos INTEGER)
+    LANGUAGE sql STABLE AS $$
+        WITH names AS (
+            SELECT p_assignee AS name, 0::bigint AS ord
+            UNION ALL
+            SELECT e #>> '{}', t.ord
+            FROM jsonb_array_elements(safe_jsonb_array(p_assignees)) WITH ORDINALITY AS t(e, ord)
+            WHERE jsonb_typeof(e) = 'string'
+        ),
+        resolved AS (
+            SELECT (SELECT u.id FROM users u WHERE u.name = n.name ORDER BY u.id DESC LIMIT 1) AS user_id,
+                   n.ord
+            FROM names n
+            WHERE n.name IS NOT NULL AND n.name NOT IN ('', 'Unassigned')
+        ),
+        firsts AS (
+            SELECT r.user_id, MIN(r.ord) AS ord
+            FROM resolved r
+            WHERE r.user_id IS NOT NULL
+            GROUP BY r.user_id
+        )
+        SELECT f.user_id,
+               f.ord = MIN(f.ord) OVER (),
+               (ROW_NUMBER() OVER (ORDER BY f.ord) - 1)::int
+        FROM firsts f
+    $$;
+"""
+
+# Students with ids in [%(first_id)s, %(last_id)s].
+STUDENT_ASSIGNEES_BACKFILL_SQL = """
+    INSERT INTO student_assignees (student_id, user_id, is_primary, position, assigned_at)
+    SELECT s.id, r.user_id, r.is_primary, r.pos, COALESCE(s.created_at, NOW())
+    FROM students s
+    CROSS JOIN LATERAL resolve_student_assignees(s.assignee, s.assignees) r
+    WHERE s.id BETWEEN %(first_id)s AND %(last_id)s
+    ON CONFLICT (student_id, user_id) DO NOTHING;
+"""
+
+# Installed before the backfill, so writes made while it runs are synced
+# too; the backfill's DO NOTHING leaves their rows alone. Runs AFTER
+# students_fill_assignees has mirrored `assignee` into an empty `assignees`.
+STUDENT_ASSIGNEES_TRIGGERS_SQL = """
+    -- Rebuilds the rows of every student in p_ids from its name columns.
+    CREATE OR REPLACE FUNCTION sync_student_assignees_of(p_ids INTEGER[]) RETURNS void
+    LANGUAGE sql AS $$
+        WITH wanted AS (
+            SELECT s.id AS student_id, r.user_id, r.is_primary, r.pos AS position
+            FROM students s
+            CROSS JOIN LATERAL resolve_student_assignees(s.assignee, s.assignees) r
+            WHERE s.id = ANY(p_ids)
+        ),
+        dropped AS (
+            DELETE FROM student_assignees sa
+            WHERE sa.student_id = ANY(p_ids)
+              AND NOT EXISTS (
+                  SELECT 1 FROM wanted w WHERE w.student_id = sa.student_id AND w.user_id = sa.user_id
+              )
+        )
+        INSERT INTO student_assignees (student_id, user_id, is_primary, position)
+        SELECT student_id, user_id, is_primary, position FROM wanted
+        ON CONFLICT (student_id, user_id) DO UPDATE
+            SET is_primary = EXCLUDED.is_primary, position = EXCLUDED.position
+            WHERE (student_assignees.is_primary, student_assignees.position)
+                  IS DISTINCT FROM (EXCLUDED.is_primary, EXCLUDED.position)
+    $$;
+
+    CREATE OR REPLACE FUNCTION sync_student_assignees() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF current_setting('fortrust.defer_assignee_sync', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP = 'UPDATE'
+           AND NEW.assignee IS NOT DISTINCT FROM OLD.assignee
+           AND NEW.assignees IS NOT DISTINCT FROM OLD.assignees THEN
+            RETURN NULL;
+        END IF;
+
+        PERFORM sync_student_assignees_of(ARRAY[NEW.id]);
+        RETURN NULL;
+    END $$;
+
+    DROP TRIGGER IF EXISTS students_sync_assignees ON students;
+    CREATE TRIGGER students_sync_assignees
+        AFTER INSERT OR UPDATE OF assignee, assignees ON students
+        FOR EACH ROW EXECUTE FUNCTION sync_student_assignees();
+
+    -- A rename rewrites the name columns of that user's students (only
+    -- theirs, even if another user shares the old name); the trigger above
+    -- then resolves the new name back to the same id.
+    CREATE OR REPLACE FUNCTION rename_student_assignees() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE students s
+        SET assignee = CASE WHEN s.assignee = OLD.name THEN NEW.name ELSE s.assignee END,
+            assignees = (
+                SELECT COALESCE(jsonb_agg(
+                    CASE WHEN e = to_jsonb(OLD.name) THEN to_jsonb(NEW.name) ELSE e END
+                    ORDER BY t.ord), '[]'::jsonb)
+                FROM jsonb_array_elements(safe_jsonb_array(s.assignees)) WITH ORDINALITY AS t(e, ord)
+            )
+        WHERE s.id IN (SELECT sa.student_id FROM student_assignees sa WHERE sa.user_id = NEW.id);
+        RETURN NULL;
+    END $$;
+
+    DROP TRIGGER IF EXISTS users_rename_student_assignees ON users;
+    CREATE TRIGGER users_rename_student_assignees
+        AFTER UPDATE OF name ON users
+        FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+        EXECUTE FUNCTION rename_student_assignees();
+
+    -- A new (or re-created) user takes over the students that already name
+    -- it; it may also outrank an older user of the same name.
+    CREATE OR REPLACE FUNCTION link_user_student_assignees() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM sync_student_assignees_of(ARRAY(
+            SELECT s.id FROM students s
+            WHERE s.assignee = NEW.name OR s.assignees @> jsonb_build_array(NEW.name::text)
+        ));
+        RETURN NULL;
+    END $$;
+
+    DROP TRIGGER IF EXISTS users_link_student_assignees ON users;
+    CREATE TRIGGER users_link_student_assignees
+        AFTER INSERT ON users
+        FOR EACH ROW WHEN (NEW.name IS NOT NULL)
+        EXECUTE FUNCTION link_user_student_assignees();
+"""
+
+# WHERE fragments over an unaliased `students`; each takes one array param.
+ASSIGNED_TO_USER_IDS_SQL = (
+    "id IN (SELECT sa.student_id FROM student_assignees sa WHERE sa.user_id = ANY(%s::int[]))"
+)
+ASSIGNED_TO_USER_NAMES_SQL = (
+    "id IN (SELECT sa.student_id FROM student_assignees sa"
+    " JOIN users u ON u.id = sa.user_id WHERE u.name = ANY(%s::text[]))"
+)
+
+# A student's assignee names from its own columns (alias students `s`):
+# `assignee` first, then the `assignees` array, each name once. Unlike
+# resolve_student_assignees() nothing is dropped for not matching a user, so
+# a deleted agent's name can still be found and removed.
+ASSIGNEE_NAMES_SQL = """
+    ARRAY(
+        SELECT n.name
+        FROM (
+            SELECT s.assignee AS name, 0::bigint AS ord
+            UNION ALL
+            SELECT e #>> '{}', t.ord
+            FROM jsonb_array_elements(safe_jsonb_array(s.assignees)) WITH ORDINALITY AS t(e, ord)
+            WHERE jsonb_typeof(e) = 'string'
+        ) n
+        WHERE n.name IS NOT NULL AND n.name NOT IN ('', 'Unassigned')
+        GROUP BY n.name
+        ORDER BY MIN(n.ord)
+    )
+"""
+
+# What sync_student_assignees() does, for every student in %(ids)s at once.
+SYNC_STUDENT_ASSIGNEES_SQL = "SELECT sync_student_assignees_of(%(ids)s::int[])"
+
+# One statement: lock the targets in id order, drop %(from_agent)s from each
+# name list (and append %(to_agent)s when %(add)s), write both name columns,
+# and log the change to timeline_entries and chat_messages for every row.
+_REASSIGN_SQL = f"""
+    WITH targets AS (
+        SELECT s.id, {ASSIGNEE_NAMES_SQL} AS names
+        FROM students s
+        WHERE {{target_filter}}
+        ORDER BY s.id
+        FOR UPDATE OF s
+    ),
+    planned AS (
+        SELECT t.id, array_remove(t.names, %(from_agent)s::text) AS names
+        FROM targets t
+    ),
+    updated AS (
+        UPDATE students s
+        SET assignee = COALESCE(n.names[1], 'Unassigned'),
+            assignees = to_jsonb(n.names)
+        FROM (
+            SELECT p.id,
+                   CASE WHEN %(add)s AND NOT (%(to_agent)s::text = ANY(p.names))
+                        THEN p.names || %(to_agent)s::text
+                        ELSE p.names END AS names
+            FROM planned p
+        ) n
+        WHERE s.id = n.id
+        RETURNING s.id
+    ),
+    timeline AS (
+        INSERT INTO timeline_entries (student_id, author, note)
+        SELECT id, %(actor)s, %(note)s FROM updated
+    ),
+    chat AS (
+        INSERT INTO chat_messages (student_id, sender, message, is_system)
+        SELECT id, 'System', %(note)s, TRUE FROM updated
+    )
+    SELECT id FROM updated ORDER BY id
+"""
+
+# Matched on the name columns, not student_assignees: deleting a user
+# cascades away its join rows, but its students still name it and are
+# exactly the ones offboarding has to move. BitmapOr of idx_students_assignee
+# and idx_students_assignees_gin.
+_ACTIVE_OF_AGENT_SQL = """
+    (s.assignee = %(from_agent)s OR s.assignees @> jsonb_build_array(%(from_agent)s::text))
+    AND UPPER(COALESCE(s.status, '')) NOT IN ('COMPLETED', 'REJECTED', 'ARCHIVED')
+"""
+
+
+def reassign_students(cur, from_agent: str, to_agent: str, actor: str, note: str,
+                      replace: bool = True, student_ids: list = None) -> list:
+    """
+    Removes `from_agent` from the given students (or, with no ids, from all
+    of that agent's active students) and, if `replace`, adds `to_agent`
+    unless it is empty or 'Unassigned'. The primary becomes the first
+    remaining name. Each student gets `note` as a timeline entry and a
+    system chat message.
+
+    Set-based: one UPDATE for every student plus one resync of their
+    student_assignees rows. `cur` must be a plain (tuple) cursor. Doesn't
+    commit. Returns the updated ids.
+    """
+    if student_ids is not None:
+        target_filter, params = "s.id = ANY(%(ids)s::int[])", {"ids": list(student_ids)}
+    else:
+        target_filter, params = _ACTIVE_OF_AGENT_SQL, {}
+    params.update({
+        "from_agent": from_agent,
+        "to_agent": to_agent or "",
+        "add": bool(replace and to_agent and to_agent != "Unassigned"),
+        "actor": actor,
+        "note": note,
+    })
+
+    cur.execute("SELECT set_config('fortrust.defer_assignee_sync', 'on', true)")
+    cur.execute(_REASSIGN_SQL.replace("{target_filter}", target_filter), params)
+    ids = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT set_config('fortrust.defer_assignee_sync', 'off', true)")
+    if ids:
+        cur.execute(SYNC_STUDENT_ASSIGNEES_SQL, {"ids": ids})
+    return ids
@@ -0,0 +1,166 @@
+"""
+Per-student document metadata in the student_documents table.
+
+Document metadata used to live in the students.documents JSONB array. Every
+upload and delete read that array into Python, edited it and wrote it back,
+which meant an extra round-trip and a rewrite of the whole array, and two
+concurrent uploads could drop one another's entry. Anything that needed a
+count (the action queue's "missing documents") ran jsonb_array_length over
+every active student.
+
+Now each file is one row, added or removed by a single statement:
+
+  - filename is UNIQUE: it is the storage object name, and deletes and the
+    orphan sweep look it up by it;
+  - (student_id, uploaded_at) serves a student's vault listing;
+  - triggers keep students.doc_count in step with inserts and deletes, so
+    "fewer than 3 documents" is a plain column filter.
+
+Readers get the old JSONB entry shape
+{title, filename, uploaded_by, uploaded_at, size_bytes}, so the frontend
+and fetch_and_extract() are unchanged. students.documents is left in place
+by migration 15 but is no longer read or written.
+"""
+from psycopg2.extras import RealDictCursor
+
+STUDENT_DOCUMENTS_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS student_documents (
+        id BIGSERIAL PRIMARY KEY,
+        student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+        filename TEXT NOT NULL UNIQUE,
+        title TEXT NOT NULL DEFAULT '',
+        size_bytes BIGINT,
+        content_sha256 TEXT,
+        uploaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        uploaded_by TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_student_documents_student
+        ON student_documents (student_id, uploaded_at);
+
+    ALTER TABLE students ADD COLUMN IF NOT EXISTS doc_count INTEGER NOT NULL DEFAULT 0;
+"""
+
+# Copies the JSONB arrays of students with ids in [%(first_id)s, %(last_id)s]
+# over and recounts their doc_count; re-running a slice changes nothing.
+# Entries without a filename point at nothing in storage and are dropped; so
+# are repeats of the same filename.
+STUDENT_DOCUMENTS_BACKFILL_SQL = r"""
+    INSERT INTO student_documents
+        (student_id, filename, title, size_bytes, content_sha256, uploaded_at, uploaded_by)
+    SELECT s.id,
+           d->>'filename',
+           COALESCE(d->>'title', ''),
+           CASE WHEN d->>'size_bytes' ~ '^\d+$' THEN (d->>'size_bytes')::bigint END,
+           x.content_sha256,
+           COALESCE(
+               CASE WHEN d->>'uploaded_at' ~ '^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}'
+                    THEN replace(left(d->>'uploaded_at', 19), 'T', ' ')::timestamp END,
+               s.created_at, NOW()
+           ),
+           d->>'uploaded_by'
+    FROM students s
+    CROSS JOIN LATERAL jsonb_array_elements(
+        CASE WHEN jsonb_typeof(s.documents) = 'array' THEN s.documents ELSE '[]'::jsonb END
+    ) WITH ORDINALITY AS t(d, ord)
+    LEFT JOIN document_extractions x ON x.filename = d->>'filename'
+    WHERE s.id BETWEEN %(first_id)s AND %(last_id)s
+      AND jsonb_typeof(d) = 'object' AND COALESCE(d->>'filename', '') != ''
+    ORDER BY s.id, t.ord
+    ON CONFLICT (filename) DO NOTHING;
+
+    UPDATE students s
+    SET doc_count = c.n
+    FROM (
+        SELECT student_id, COUNT(*) AS n FROM student_documents
+        WHERE student_id BETWEEN %(first_id)s AND %(last_id)s
+        GROUP BY student_id
+    ) c
+    WHERE s.id = c.student_id;
+"""
+
+# Installed after the backfill so the backfill's counts aren't doubled.
+DOC_COUNT_TRIGGER_SQL = """
+    CREATE OR REPLACE FUNCTION maintain_student_doc_count() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE students SET doc_count = doc_count + 1 WHERE id = NEW.student_id;
+        ELSE
+            UPDATE students SET doc_count = GREATEST(doc_count - 1, 0) WHERE id = OLD.student_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_student_documents_count ON student_documents;
+    CREATE TRIGGER trg_student_documents_count
+        AFTER INSERT OR DELETE ON student_documents
+        FOR EACH ROW EXECUTE FUNCTION maintain_student_doc_count();
+"""
+
+# The entry shape students.documents used to hold.
+DOCUMENT_ENTRY_SQL = """
+    title, filename, uploaded_by, size_bytes,
+    to_char(uploaded_at, 'YYYY-MM-DD"T"HH24:MI:SS') AS uploaded_at
+"""
+
+
+def add_document(cur, student_id, filename: str, title: str, uploaded_by: str,
+                 size_bytes: int = None, content_sha256: str = None):
+    """Records an uploaded file. Doesn't commit. Re-uploading a filename updates it."""
+    cur.execute("""
+        INSERT INTO student_documents
+            (student_id, filename, title, size_bytes, content_sha256, uploaded_by)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (filename) DO UPDATE
+        SET title = EXCLUDED.title,
+            size_bytes = EXCLUDED.size_bytes,
+            content_sha256 = EXCLUDED.content_sha256,
+            uploaded_by = EXCLUDED.uploaded_by,
+            uploaded_at = NOW()
+    """, (int(student_id), filename, title, size_bytes, content_sha256, uploaded_by))
+
+
+def remove_document(cur, student_id, filename: str) -> dict:
+    """
+    Deletes one student's file record and returns it, or None if there was
+    none. `cur` must be a RealDictCursor. Doesn't commit.
+    """
+    cur.execute(f"""
+        DELETE FROM student_documents
+        WHERE student_id = %s AND filename = %s
+        RETURNING {DOCUMENT_ENTRY_SQL}
+    """, (int(student_id), filename))
+    row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def list_documents(conn, student_id) -> list:
+    """A student's documents, oldest first, in the old JSONB entry shape."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT {DOCUMENT_ENTRY_SQL}
+            FROM student_documents
+            WHERE student_id = %s
+            ORDER BY uploaded_at, id
+        """, (int(student_id),))
+        return [dict(r) for r in cur.fetchall()]
+
+
+async def documents_for_students_async(conn, student_ids: list) -> dict:
+    """student_id -> document list for a page of students, in one query (psycopg3, dict rows)."""
+    if not student_ids:
+        return {}
+    async with conn.cursor() as cur:
+        await cur.execute("""
+            SELECT student_id,
+                   json_agg(json_build_object(
+                       'title', title, 'filename', filename, 'uploaded_by', uploaded_by,
+                       'size_bytes', size_bytes,
+                       'uploaded_at', to_char(uploaded_at, 'YYYY-MM-DD"T"HH24:MI:SS')
+                   ) ORDER BY uploaded_at, id) AS documents
+            FROM student_documents
+            WHERE student_id = ANY(%s)
+            GROUP BY student_id
+        """, (list(student_ids),))
+        return {r["student_id"]: r["documents"] for r in await cur.fetchall()}
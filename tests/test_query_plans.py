@@ -0,0 +1,50 @@
+import os
+
+import psycopg2
+import pytest
+
+from bench import create_scratch_schema, drop_scratch_schema, seed_assignees, seed_students, seed_users
+from query_plans import check_hot_query_plans, create_student_indexes
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+SCHEMA = "test_query_plans"
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="needs DATABASE_URL")
+
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        create_scratch_schema(conn, SCHEMA)
+        seed_users(conn, 100)
+        seed_students(conn, 20_000, 100)
+        seed_assignees(conn)
+        with conn.cursor() as cur:
+            create_student_indexes(cur)
+            cur.execute("ANALYZE students")
+        conn.commit()
+        yield conn
+    finally:
+        drop_scratch_schema(conn, SCHEMA)
+        conn.close()
+
+
+def failing(report):
+    return {name: result["plan"] for name, result in report["queries"].items() if not result["ok"]}
+
+
+def test_hot_queries_use_their_indexes(conn):
+    report = check_hot_query_plans(conn)
+    assert report["ok"], failing(report)
+
+
+def test_missing_index_is_reported(conn):
+    with conn.cursor() as cur:
+        cur.execute("DROP INDEX idx_students_created_id")
+    try:
+        report = check_hot_query_plans(conn)  # rolls the DROP back
+    finally:
+        conn.rollback()
+    assert not report["ok"]
+    assert "pipeline_first_page" in failing(report)
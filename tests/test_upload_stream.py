@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import io
+import tracemalloc
+
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+from upload_stream import UploadRejected, UploadSizeLimitMiddleware, sniff_mime, spool_upload
+
+LIMIT = 64 * 1024
+BOUNDARY = "test-boundary"
+
+
+def make_app():
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        try:
+            spooled = await spool_upload(file, LIMIT, chunk_size=4096)
+        except UploadRejected as rejected:
+            raise HTTPException(status_code=400, detail=str(rejected))
+        with spooled:
+            return {"size": spooled.size, "sha256": spooled.sha256}
+
+    app.add_middleware(UploadSizeLimitMiddleware, max_bytes=LIMIT)
+    return app
+
+
+def multipart(filename: str, payload: bytes) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + payload + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def chunked(body: bytes, size: int = 8192):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+@pytest.fixture
+def client():
+    return TestClient(make_app())
+
+
+HEADERS = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+
+
+def test_small_upload_is_spooled(client):
+    payload = b"name,email\nAda,ada@example.com\n"
+    resp = client.post("/upload", content=multipart("leads.csv", payload), headers=HEADERS)
+    assert resp.status_code == 200
+    assert resp.json() == {"size": len(payload), "sha256": hashlib.sha256(payload).hexdigest()}
+
+
+def test_oversized_content_length_is_refused(client):
+    resp = client.post("/upload", content=multipart("big.txt", b"a" * (LIMIT * 2)), headers=HEADERS)
+    assert resp.status_code == 413
+
+
+def test_oversized_chunked_body_is_refused(client):
+    body = multipart("big.txt", b"a" * (LIMIT * 4))
+    resp = client.post("/upload", content=chunked(body), headers=HEADERS)
+    assert resp.status_code == 413
+    assert "content-length" not in {k.lower() for k in resp.request.headers}
+
+
+def test_chunked_body_under_limit_passes(client):
+    payload = b"x" * (LIMIT // 2)
+    resp = client.post("/upload", content=chunked(multipart("notes.txt", payload)), headers=HEADERS)
+    assert resp.status_code == 200
+    assert resp.json()["size"] == len(payload)
+
+
+class FakeUpload:
+    def __init__(self, filename: str, data: bytes):
+        self.filename = filename
+        self.content_type = None
+        self._stream = io.BytesIO(data)
+        self.reads = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads += 1
+        return self._stream.read(size)
+
+
+def test_spool_upload_stops_at_the_cap():
+    upload = FakeUpload("big.txt", b"a" * (LIMIT * 10))
+    with pytest.raises(UploadRejected, match="too large"):
+        asyncio.run(spool_upload(upload, LIMIT, chunk_size=4096))
+    assert upload.reads == LIMIT // 4096 + 1
+
+
+class GeneratedUpload(FakeUpload):
+    """Makes each chunk on read, so every byte the reader holds is a traced allocation."""
+
+    def __init__(self, filename: str, size: int):
+        super().__init__(filename, b"")
+        self.remaining = size
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads += 1
+        n = self.remaining if size < 0 else min(size, self.remaining)
+        self.remaining -= n
+        return b"a" * n
+
+
+def spool_peak_bytes(size: int, chunk_size: int) -> int:
+    upload = GeneratedUpload("notes.txt", size)
+    tracemalloc.start()
+    try:
+        spooled = asyncio.run(spool_upload(upload, size, chunk_size=chunk_size))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    spooled.cleanup()
+    assert spooled.size == size
+    return peak
+
+
+def test_spool_upload_peak_memory_is_bounded_by_the_chunk():
+    chunk_size = 64 * 1024
+    small = spool_peak_bytes(4 * chunk_size, chunk_size)
+    large = spool_peak_bytes(32 * 1024 * 1024, chunk_size)
+    assert large <= 4 * chunk_size
+    assert large <= small + chunk_size  # doesn't grow with the file
+
+
+@pytest.mark.parametrize("head", [
+    "name,city\nJosé,São Paulo\n".encode("cp1252"),
+    "name,city\nJosé,São Paulo\n".encode("utf-8"),
+    "name,city\n".encode("utf-16"),
+])
+def test_text_in_any_encoding_is_text(head):
+    assert sniff_mime(head) == "text/plain"
+
+
+def test_binary_is_not_text():
+    assert sniff_mime(bytes(range(256))) is None
+    assert sniff_mime(b"%PDF-1.7\n") == "application/pdf"
@@ -0,0 +1,273 @@
+"""
+Streaming handling for uploaded files.
+
+The upload endpoints used to `await file.read()` the whole file before
+checking its size, so a 200 MB upload sat in worker RAM just to be
+rejected, and a few at once could OOM the worker. spool_upload() reads the
+upload in UPLOAD_CHUNK_BYTES chunks instead. For each chunk it:
+
+  - enforces the size cap, stopping as soon as the limit is crossed;
+  - hashes it (sha256, reused by document_extractions and the AI cache);
+  - appends it to a temp file on disk.
+
+The MIME type is sniffed from the first bytes and must agree with the
+extension. Storage uploads are then given an open file handle, so the
+HTTP client streams from disk. Peak memory per upload is roughly one
+chunk, whatever the file size; `python bench.py upload-memory` checks it.
+
+The form parser spools the whole request to disk before any endpoint
+runs, so UploadSizeLimitMiddleware caps the request itself: from
+Content-Length when there is one, and by counting body bytes as they
+arrive otherwise, so a chunked request can't get past it.
+"""
+import codecs
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional
+
+from starlette.exceptions import HTTPException
+
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None  # None -> system temp dir
+SNIFF_BYTES = 512
+
+# Leading bytes -> MIME type. Checked in order.
+_MAGIC = [
+    (b"%PDF-", "application/pdf"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"PK\x03\x04", "application/zip"),                   # docx / xlsx containers
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),  # legacy doc / xls
+]
+
+# Phones and scanners routinely mislabel one image format as another, so
+# any image extension may hold any image; the sniffed type is what's stored.
+_IMAGES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/heic"}
+
+# What each allowed extension may actually contain.
+EXTENSION_CONTENT = {
+    ".pdf": {"application/pdf"},
+    ".jpg": _IMAGES,
+    ".jpeg": _IMAGES,
+    ".png": _IMAGES,
+    ".gif": _IMAGES,
+    ".webp": _IMAGES,
+    ".heic": _IMAGES,
+    ".heif": _IMAGES,
+    ".docx": {"application/zip"},
+    ".xlsx": {"application/zip"},
+    ".doc": {"application/x-ole-storage"},
+    ".xls": {"application/x-ole-storage"},
+    ".txt": {"text/plain"},
+    ".csv": {"text/plain"},
+}
+
+# Sniffed container -> the content type we store for that extension.
+_STORED_TYPES = {
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".doc": "application/msword",
+    ".xls": "application/vnd.ms-excel",
+    ".csv": "text/csv",
+}
+
+
+# Checked in order: a UTF-32 LE BOM starts with the UTF-16 LE one.
+_TEXT_BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# C0 controls that don't turn up in text files; tab, newlines, form feed,
+# backspace and escape do.
+_BINARY_CONTROLS = bytes(set(range(0x20)) - {0x08, 0x09, 0x0A, 0x0C, 0x0D, 0x1B})
+
+
+def text_encoding(head: bytes) -> str:
+    """Codec for text starting with `head`: from its BOM, else UTF-8."""
+    for bom, encoding in _TEXT_BOMS:
+        if head.startswith(bom):
+            return encoding
+    return "utf-8-sig"
+
+
+def looks_like_text(head: bytes) -> bool:
+    """
+    Text in any encoding: a Unicode BOM, or no NUL bytes and next to no
+    other control bytes. Exports from Excel and older tools are often
+    Windows-1252 or Latin-1, which aren't valid UTF-8 but are still text.
+    """
+    if any(head.startswith(bom) for bom, _ in _TEXT_BOMS):
+        return True
+    if b"\x00" in head:
+        return False
+    controls = sum(head.count(bytes([c])) for c in _BINARY_CONTROLS)
+    return controls <= len(head) // 100
+
+
+class UploadRejected(Exception):
+    """The upload failed a size or content check; str(e) is safe to show the user."""
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """Best guess at the real type from the first bytes, or None."""
+    for magic, mime in _MAGIC:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"hevc", b"heif", b"mif1", b"msf1"):
+        return "image/heic"
+    if looks_like_text(head):
+        return "text/plain"
+    return None
+
+
+class SpooledUpload:
+    """An upload written to a temp file, with its size, sha256 and sniffed type."""
+
+    def __init__(self, path: str, filename: str, size: int, sha256: str, content_type: str):
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.content_type = content_type
+
+    def open(self):
+        """Binary file handle (io.BufferedReader) for streaming the spooled bytes."""
+        return open(self.path, "rb")
+
+    def cleanup(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+async def spool_upload(file, max_bytes: int, chunk_size: int = UPLOAD_CHUNK_BYTES) -> SpooledUpload:
+    """
+    Streams a FastAPI UploadFile to disk. Raises UploadRejected if it is
+    empty, larger than max_bytes, or if its content doesn't match its
+    extension. The caller owns the returned SpooledUpload and must
+    cleanup() it (or use it as a context manager).
+    """
+    filename = file.filename or ""
+    ext = "." + filename.lower().rsplit(".", 1)[-1] if "." in filename else ""
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+
+    fd, path = tempfile.mkstemp(prefix="upload-", dir=UPLOAD_SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"too large (max {max_bytes // 1024 // 1024}MB)")
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                digest.update(chunk)
+                out.write(chunk)
+
+        if size == 0:
+            raise UploadRejected("empty file")
+
+        sniffed = sniff_mime(head)
+        allowed = EXTENSION_CONTENT.get(ext)
+        if allowed is not None and sniffed not in allowed:
+            raise UploadRejected(
+                f"content does not look like a {ext} file (detected {sniffed or 'unknown binary'})"
+            )
+        content_type = _STORED_TYPES.get(ext) or sniffed or file.content_type or "application/octet-stream"
+        return SpooledUpload(path, filename, size, digest.hexdigest(), content_type)
+    except BaseException:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def upload_to_storage(bucket, storage_path: str, spooled: SpooledUpload):
+    """Blocking storage upload that streams from the spooled file (run it in a thread)."""
+    with spooled.open() as stream:
+        return bucket.upload(
+            path=storage_path,
+            file=stream,
+            file_options={"content-type": spooled.content_type},
+        )
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware: a 413 for any request body over max_bytes. Bodies
+    without a Content-Length (chunked) are counted as they stream in and
+    cut off as soon as they cross the limit.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(status_code=413, detail=f"Request too large (max {self.max_bytes // 1024 // 1024}MB)")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        length = dict(scope.get("headers") or []).get(b"content-length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        response_started = False
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the form parser; FastAPI passes
+                    # HTTPExceptions through, so the client gets the 413.
+                    raise self._too_large()
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, tracking_send)
+        except HTTPException as e:
+            # Read outside the app's exception handling (e.g. another middleware).
+            if e.status_code != 413 or response_started:
+                raise
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": self._too_large().detail}).encode()
+        await send({
+            "type": "http.response.start", "status": 413,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})